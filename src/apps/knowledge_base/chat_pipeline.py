@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from apps.knowledge_base.intent_router import IntentRouter
+from apps.knowledge_base.services.answer_cache import FAQAnswerCache, get_faq_answer_cache
+from apps.knowledge_base.services.answer_service import AnswerService, StreamingPostprocessor
+from apps.knowledge_base.services.device_catalog import DeviceCatalog, get_device_catalog
+from apps.knowledge_base.services.device_context import DeviceContextBuilder
+from apps.knowledge_base.services.device_search import (
+    DeviceSelector,
+    get_device_selector_cached,
+    set_device_selector_cached,
+)
+from apps.knowledge_base.services.dialog_history import DialogHistory
+from apps.knowledge_base.services.faq_search import (
+    FAQSearch,
+    get_faq_search_cached,
+    set_faq_search_cached,
+)
+from apps.knowledge_base.services.specs_search import (
+    SpecsSearch,
+    get_specs_search_cached,
+    set_specs_search_cached,
+)
+from logger.config import get_logger
+from utils.answer_format import FormattedAnswer, format_answer
+from settings import config
+
+logger = get_logger(__name__)
+
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+_chat_pipeline: ChatPipeline | None = None
+
+
+@dataclass
+class ChatResult:
+    answer: str
+    intent: str
+    streamed: bool = False
+    cached: bool = False
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @functools.cached_property
+    def formatted(self) -> FormattedAnswer:
+        return format_answer(self.answer)
+
+
+@dataclass
+class _FAQRetrieval:
+    answer: Optional[str]
+    embedding: Optional[List[float]]
+    context: Dict[str, Any]
+    entry_id: Optional[int]
+
+
+def _drop_task(task: asyncio.Task | None) -> None:
+    """
+    Отменяет ненужную спекулятивную задачу (или забирает её исключение).
+    """
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+class ChatPipeline:
+    """
+    Обработка сообщения независимо от канала (Telegram, WhatsApp):
+    история → intent → FAQ / устройства / характеристики → ответ → история.
+
+    Сервисы поиска можно передать явно; по умолчанию берутся общие
+    экземпляры процесса через get_*_cached и создаются при первом обращении.
+    """
+
+    def __init__(
+        self,
+        intent_router: IntentRouter | None = None,
+        answer_service: AnswerService | None = None,
+        history: DialogHistory | None = None,
+        faq_search: FAQSearch | None = None,
+        device_selector: DeviceSelector | None = None,
+        specs_search: SpecsSearch | None = None,
+        answer_cache: FAQAnswerCache | None = None,
+        catalog: DeviceCatalog | None = None,
+        device_context: DeviceContextBuilder | None = None,
+    ) -> None:
+        self.intent_router = intent_router or IntentRouter()
+        self.answer_service = answer_service or AnswerService(model="gpt-4o")
+        self.history = history or DialogHistory(
+            max_messages=config.HISTORY_MAX_MESSAGES,
+            token_budget=config.HISTORY_TOKEN_BUDGET,
+        )
+        self._faq_search = faq_search
+        self._device_selector = device_selector
+        self._specs_search = specs_search
+        self._answer_cache = answer_cache
+        self._catalog = catalog
+        self.device_context = device_context or DeviceContextBuilder()
+
+    @property
+    def faq_search(self) -> FAQSearch:
+        if self._faq_search is not None:
+            return self._faq_search
+        svc = get_faq_search_cached()
+        if svc is None:
+            svc = FAQSearch()
+            set_faq_search_cached(svc)
+        return svc
+
+    @property
+    def device_selector(self) -> DeviceSelector:
+        if self._device_selector is not None:
+            return self._device_selector
+        svc = get_device_selector_cached()
+        if svc is None:
+            svc = DeviceSelector()
+            set_device_selector_cached(svc)
+        return svc
+
+    @property
+    def specs_search(self) -> SpecsSearch:
+        if self._specs_search is not None:
+            return self._specs_search
+        svc = get_specs_search_cached()
+        if svc is None:
+            svc = SpecsSearch()
+            set_specs_search_cached(svc)
+        return svc
+
+    @property
+    def answer_cache(self) -> FAQAnswerCache:
+        return self._answer_cache or get_faq_answer_cache()
+
+    @property
+    def catalog(self) -> DeviceCatalog:
+        if self._catalog is not None:
+            self._catalog.reload_if_changed()
+            return self._catalog
+        return get_device_catalog()
+
+    async def retrieve_faq(
+        self,
+        user_message: str,
+        past_messages: Awaitable[list[dict]] | None = None,
+    ) -> _FAQRetrieval:
+        """
+        FAQ-ветка: кеш ответов, эмбеддинг и векторный поиск.
+        Кеш ответов используется только в начале диалога: уточнение вроде
+        «а сколько стоит?» зависит от истории, и чужой ответ ему не подходит.
+        """
+        use_cache = True
+        if past_messages is not None:
+            use_cache = not await asyncio.shield(past_messages)
+
+        if use_cache:
+            answer = await self.answer_cache.get_exact(user_message)
+            if answer is not None:
+                return _FAQRetrieval(answer, None, {}, None)
+
+        search = self.faq_search
+        embedding = await search.embed(user_message)
+        context = await search.top_faq_json(user_message, top_n=3, embedding=embedding)
+        entry_id = next(iter(context.get("top_ids", [])), None)
+        answer = await self.answer_cache.lookup(embedding, entry_id) if use_cache else None
+        return _FAQRetrieval(answer, embedding, context, entry_id)
+
+    async def run(
+        self,
+        chat_id: str,
+        user_message: str,
+        on_delta: DeltaCallback | None = None,
+    ) -> ChatResult:
+        """
+        Возвращает ответ модели как есть (в кеш и историю пишется он же);
+        разметку под канал даёт ChatResult.formatted (format_answer).
+        С on_delta генерация идёт потоком и колбэк получает сырые дельты.
+        """
+        timings: Dict[str, float] = {}
+        faq_task: asyncio.Task | None = None
+
+        # Гистограммы этапов пишут сами сервисы (common.metrics.timed),
+        # здесь — только длительности для лога конкретного сообщения.
+        async def measured(stage: str, coro):
+            started = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                timings[stage] = time.perf_counter() - started
+
+        history_task = asyncio.create_task(measured("history_read", self.history.get(chat_id)))
+        try:
+            if config.SPECULATIVE_RETRIEVAL:
+                faq_task = asyncio.create_task(
+                    measured("faq_retrieval", self.retrieve_faq(user_message, history_task))
+                )
+
+            route, past_messages = await asyncio.gather(
+                measured("intent", self.intent_router.route(user_message)),
+                history_task,
+            )
+            intent = route.intent
+
+            faq: _FAQRetrieval | None = None
+            context: Any = None
+            if intent == "FAQ":
+                faq = await (
+                    faq_task
+                    or measured("faq_retrieval", self.retrieve_faq(user_message, history_task))
+                )
+                context = faq.context
+            else:
+                _drop_task(faq_task)
+                if intent == "Device":
+                    # Устройства уже определены объединённым вызовом роутера.
+                    if route.device_ids is not None:
+                        selection = route.as_selection(user_message)
+                    else:
+                        selection = await measured(
+                            "device_selection", self.device_selector.select(user_message)
+                        )
+                    context = self.device_context.build(self.catalog, selection)
+                elif intent == "Specs":
+                    started = time.perf_counter()
+                    context = self.specs_search.search(user_message)
+                    timings["specs_search"] = time.perf_counter() - started
+
+            result = ChatResult(answer="", intent=intent, timings=timings)
+            if faq is not None and faq.answer is not None:
+                result.answer, result.cached = faq.answer, True
+            elif intent not in ("FAQ", "Device", "Specs"):
+                result.answer = await measured(
+                    "answer_generation",
+                    self.answer_service.fallback(user_message, past_messages=past_messages),
+                )
+            elif on_delta is not None:
+                result.answer = await measured(
+                    "answer_generation",
+                    self._stream(user_message, context, intent, past_messages, on_delta),
+                )
+                result.streamed = True
+            else:
+                result.answer = await measured(
+                    "answer_generation",
+                    self.answer_service.generate(
+                        user_message, context, intent, past_messages=past_messages
+                    ),
+                )
+
+            if faq is not None and not result.cached and not past_messages:
+                await self.answer_cache.store(user_message, faq.embedding, faq.entry_id, result.answer)
+
+            await self.history.add_turn(chat_id, user_message, result.answer)
+        finally:
+            _drop_task(faq_task)
+            _drop_task(history_task)
+
+        logger.info(
+            "ChatPipeline intent=%s cached=%s timings=%s",
+            result.intent,
+            result.cached,
+            {k: round(v, 3) for k, v in timings.items()},
+        )
+        return result
+
+    async def _stream(
+        self,
+        user_message: str,
+        context: Any,
+        intent: str,
+        past_messages: list[dict],
+        on_delta: DeltaCallback,
+    ) -> str:
+        post = StreamingPostprocessor()
+        async for delta in self.answer_service.generate_stream(
+            user_message, context, intent, past_messages=past_messages
+        ):
+            post.feed(delta)
+            await on_delta(delta)
+        return post.result()
+
+
+def get_chat_pipeline() -> ChatPipeline:
+    global _chat_pipeline
+    if _chat_pipeline is None:
+        _chat_pipeline = ChatPipeline()
+    return _chat_pipeline
+
+
+def set_chat_pipeline(pipeline: ChatPipeline | None) -> None:
+    global _chat_pipeline
+    _chat_pipeline = pipeline
@@ -1,79 +1,286 @@
 from __future__ import annotations
 
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from apps.knowledge_base.services.device_catalog import DeviceCatalog, get_device_catalog
+from apps.knowledge_base.services.intent_classifier import (
+    INTENT_EXAMPLES,
+    IntentPrediction,
+    LocalIntentClassifier,
+)
+from common.llm_usage import record_usage
+from common.metrics import INTENTS, timed
 from common.openai_client import ensure_openai_client
+from logger.config import get_logger
+from settings import config
+
+logger = get_logger(__name__)
 
 
 ALLOWED = {"FAQ", "Device", "Specs", "Other"}
 
+# Статичный префикс: одинаковые байты в каждом запросе, чтобы работал
+# prompt caching OpenAI. Вопрос пользователя идёт отдельным сообщением в конце.
+INTENT_RULES = """
+Ты точный классификатор вопросов от пользователей о продукции Fujida.
+
+Категории:
+- FAQ → поддержка, неисправности, обновления, прошивки, гарантия, ремонт, сервис, связь с техподдержкой; вопросы про описание функций/режимов/характеристик/параметровгде/купить/цену/магазины устройств в целом; пояснение значений параметров («что значит угол обзора 170 градусов», «горизонтальный или диагональный», «что такое CPL-фильтр»); абстрактные вопросы без указания модели (про «лучшее», «топовое», «дальнобойное» устройства и т.п.).
+- Device → выбор, сравнение, отличия моделей, запросы на характеристики ПРИ УПОМИНАНИИ МОДЕЛИ.
+- Specs → вопросы и поиск устройств по их характеристикам, параметрам или функциям БЕЗ УПОМИНАНИЯ МОДЕЛИ. 
+Сюда относятся запросы вида «У каких моделей есть ...», «Все устройства с ...», «Какие устройства поддерживают ...».
+- Other → всё, что не относится к продукции Fujida.
+
+Упоминание модели:
+- УПОМИНАНИЕМ считается полное название модели, сокращение или распространённый алиас/транслитерация.
+- Если модель упомянута — это НЕ Specs.
+
+Приоритет:
+1) Любые вопросы про неисправности/поддержку/прошивки/сервис → FAQ (ДАЖЕ ЕСЛИ МОДЕЛЬ УПОМЯНУТА).
+2) Абстрактные вопросы БЕЗ УПОМИНАНИЯ МОДЕЛИ про «лучшее/топ/дальнобойное/самое…» → FAQ.
+3) Вопросы про объяснение значения параметров/функций («что значит», «для чего нужен», «горизонтальный или диагональный») → FAQ.
+4) Сравнение/выбор/отличия моделей → Device.
+5) Поиск устройств по признаку («у каких моделей есть ...») → Specs.
+6) Остальное → Other.
+
+Примеры:
+{examples}
+
+- "про макс", "pro s", "блис макс дуо", "Fujida Zoom Blik S Duo WiFi", "карма уан", "karma blik", "окко", "хит макс", "смарт се", "блик эс", "магна", "эра", "глобал", "карма про" — СЧИТАЮТСЯ УПОМИНАНИЕМ МОДЕЛИ.
+""".strip().format(
+    examples="\n".join(f'- "{text}" → {label}' for text, label in INTENT_EXAMPLES)
+)
+
+INTENT_SYSTEM_PROMPT = f"""
+{INTENT_RULES}
+
+Вопрос пользователя придёт следующим сообщением.
+Ответ: только одно слово: FAQ, Device, Specs или Other.
+""".strip()
+
+# Правила intent + каталог моделей: префикс меняется только с версией каталога.
+ROUTER_SYSTEM_PROMPT = """
+{rules}
+
+Кроме категории определи устройства Fujida, упомянутые в вопросе:
+- device_ids — id моделей из списка ниже, которые точно упомянуты
+  (по названию, сокращению, алиасу или транслитерации); другие бренды игнорируй;
+- is_comparing — true, если пользователь сравнивает или выбирает между
+  несколькими моделями («или», «что лучше», «сравни», «разница»).
+
+Модели Fujida:
+{models_text}
+
+Вопрос пользователя придёт следующим сообщением.
+Ответ — JSON по заданной схеме.
+""".strip()
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Результат маршрутизации. device_ids is None — устройства не определялись
+    (их найдёт DeviceSelector), иначе — ответ объединённого вызова LLM.
+    """
+
+    intent: str
+    source: str
+    device_ids: Optional[List[str]] = None
+    is_comparing: bool = False
+
+    def as_selection(self, user_message: str) -> Dict[str, Any]:
+        return {
+            "device_ids": list(self.device_ids or []),
+            "is_comparing": self.is_comparing,
+            "question_text": user_message,
+        }
+
+
+def _route_schema(device_ids: List[str]) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "intent": {"type": "string", "enum": sorted(ALLOWED)},
+            "device_ids": {
+                "type": "array",
+                "items": {"type": "string", "enum": device_ids},
+            },
+            "is_comparing": {"type": "boolean"},
+        },
+        "required": ["intent", "device_ids", "is_comparing"],
+        "additionalProperties": False,
+    }
+
 
 class IntentRouter:
+    """
+    Классифицирует сообщение локально (правила + n-граммная модель),
+    LLM вызывается только при уверенности ниже порога.
+    """
+
+    def __init__(
+        self,
+        local: LocalIntentClassifier | None = None,
+        min_confidence: float | None = None,
+        catalog: DeviceCatalog | None = None,
+    ) -> None:
+        self._local = local
+        self._min_confidence = (
+            min_confidence if min_confidence is not None else config.INTENT_LOCAL_MIN_CONFIDENCE
+        )
+        self._catalog = catalog
+        self._router_version: float | None = None
+        self._router_prompt = ""
+        self._router_format: Dict[str, Any] = {}
+
+    @property
+    def local(self) -> LocalIntentClassifier:
+        if self._local is None:
+            self._local = LocalIntentClassifier()
+        return self._local
+
+    def _classify_local(self, user_message: str) -> IntentPrediction | None:
+        """
+        Локальный прогноз, если он уверенный (иначе None — нужен LLM).
+        """
+        if not config.INTENT_LOCAL_CLASSIFIER:
+            return None
+        prediction = self.local.classify(user_message)
+        if prediction.confidence >= self._min_confidence:
+            logger.info(
+                "IntentRouter local intent=%s source=%s confidence=%.2f",
+                prediction.intent,
+                prediction.source,
+                prediction.confidence,
+            )
+            INTENTS.inc(intent=prediction.intent, source=prediction.source)
+            return prediction
+        logger.info(
+            "IntentRouter low confidence=%.2f (%s), fallback to LLM",
+            prediction.confidence,
+            prediction.intent,
+        )
+        return None
+
+    @timed("intent")
     async def classify(self, user_message: str) -> str:
         """
         Возвращает intent: 'FAQ', 'Device', 'Specs', 'Other'
         """
-        
-        prompt = f"""
-            Ты точный классификатор вопросов от пользователей о продукции Fujida.
-
-            Категории:
-            - FAQ → поддержка, неисправности, обновления, прошивки, гарантия, ремонт, сервис, связь с техподдержкой; вопросы про описание функций/режимов/характеристик/параметровгде/купить/цену/магазины устройств в целом; пояснение значений параметров («что значит угол обзора 170 градусов», «горизонтальный или диагональный», «что такое CPL-фильтр»); абстрактные вопросы без указания модели (про «лучшее», «топовое», «дальнобойное» устройства и т.п.).
-            - Device → выбор, сравнение, отличия моделей, запросы на характеристики ПРИ УПОМИНАНИИ МОДЕЛИ.
-            - Specs → вопросы и поиск устройств по их характеристикам, параметрам или функциям БЕЗ УПОМИНАНИЯ МОДЕЛИ. 
-            Сюда относятся запросы вида «У каких моделей есть ...», «Все устройства с ...», «Какие устройства поддерживают ...».
-            - Other → всё, что не относится к продукции Fujida.
-
-            Упоминание модели:
-            - УПОМИНАНИЕМ считается полное название модели, сокращение или распространённый алиас/транслитерация.
-            - Если модель упомянута — это НЕ Specs.
-
-            Приоритет:
-            1) Любые вопросы про неисправности/поддержку/прошивки/сервис → FAQ (ДАЖЕ ЕСЛИ МОДЕЛЬ УПОМЯНУТА).
-            2) Абстрактные вопросы БЕЗ УПОМИНАНИЯ МОДЕЛИ про «лучшее/топ/дальнобойное/самое…» → FAQ.
-            3) Вопросы про объяснение значения параметров/функций («что значит», «для чего нужен», «горизонтальный или диагональный») → FAQ.
-            4) Сравнение/выбор/отличия моделей → Device.
-            5) Поиск устройств по признаку («у каких моделей есть ...») → Specs.
-            6) Остальное → Other.
-
-            Примеры:
-            - "Модель zoom okko, на экране отображаются знаки ограничения скорости" → FAQ
-            - "Как обновить прошивку на pro max?" → FAQ
-            - "Почему не включается fujida?" → FAQ
-            - "Что такое режим СМАРТ?" → FAQ
-            - "Как работает фильтр скорости?" → FAQ
-            - "Подробное описание функций всех устройств" → FAQ
-            - "Какое устройство комбо самое лучшее?" → FAQ
-            - "Устройство с самой лучшей камерой" → FAQ
-            - "самый лучший регистратор" → FAQ
-            - "Где купить Fujida?" → FAQ
-            - "Дай ссылку на озон где купить ваше комба" → FAQ
-            - "Сколько стоит про макс?" → FAQ
-            - "Цена zoom okko" → FAQ
-            - "Какая модель лучше, про с или про макс?" → Device
-            - "сравни карму про и про макс" → Device
-            - "Подскажите характеристики karma one" → Device
-            - "Есть ли WiFi в karma bliss?" → Device
-            - "zoom hit max или smart se — что лучше?" → Device
-            - "У каких моделей есть вайфай?" → Specs
-            - "Все устройства с GPS" → Specs
-            - "У каких моделей есть CPL-фильтр?" → Specs
-            - "Какие устройства поддерживают карту памяти 128 ГБ?" → Specs
-            - "У каких моделей экран больше 3 дюймов?" → Specs
-            - "Где купить машину?" → Other
-            - "Спасибо большое!" → Other
-            
-            - "про макс", "pro s", "блис макс дуо", "Fujida Zoom Blik S Duo WiFi", "карма уан", "karma blik", "окко", "хит макс", "смарт се", "блик эс", "магна", "эра", "глобал", "карма про" — СЧИТАЮТСЯ УПОМИНАНИЕМ МОДЕЛИ.
-
-            Вопрос: "{user_message}"
-            Ответ: только одно слово: FAQ, Device, Specs или Other.
-            """.strip()
+        prediction = self._classify_local(user_message)
+        if prediction is not None:
+            return prediction.intent
+        intent = await self.classify_llm(user_message)
+        INTENTS.inc(intent=intent, source="llm")
+        return intent
+
+    @timed("intent")
+    async def route(self, user_message: str) -> Route:
+        """
+        Intent и, если понадобился LLM (INTENT_COMBINED_ROUTER), сразу
+        упомянутые устройства — одним запросом вместо двух.
+        """
+        prediction = self._classify_local(user_message)
+        if prediction is not None:
+            return Route(prediction.intent, prediction.source)
+        if config.INTENT_COMBINED_ROUTER:
+            route = await self.route_llm(user_message)
+            if route is not None:
+                INTENTS.inc(intent=route.intent, source=route.source)
+                return route
+        intent = await self.classify_llm(user_message)
+        INTENTS.inc(intent=intent, source="llm")
+        return Route(intent, "llm")
+
+    def _current_catalog(self) -> DeviceCatalog:
+        if self._catalog is not None:
+            self._catalog.reload_if_changed()
+            return self._catalog
+        return get_device_catalog()
+
+    def _ensure_router_prompt(self) -> bool:
+        """
+        Пересобирает промпт и JSON-схему (enum id моделей) при смене каталога.
+        """
+        catalog = self._current_catalog()
+        if self._router_version != catalog.version or not self._router_prompt:
+            device_ids = [d["id"] for d in catalog.devices]
+            self._router_prompt = ROUTER_SYSTEM_PROMPT.format(
+                rules=INTENT_RULES,
+                models_text=catalog.models_text(),
+            )
+            self._router_format = {
+                "format": {
+                    "type": "json_schema",
+                    "name": "route",
+                    "schema": _route_schema(device_ids),
+                    "strict": True,
+                }
+            } if device_ids else {}
+            self._router_version = catalog.version
+        return bool(self._router_format)
+
+    async def route_llm(self, user_message: str) -> Route | None:
+        """
+        Один вызов gpt-4.1-mini со structured outputs: intent, device_ids
+        (только id из каталога) и is_comparing. None — ответ не получен
+        (пустой каталог, отказ или обрезанный ответ).
+        """
+        if not self._ensure_router_prompt():
+            return None
+
+        client = await ensure_openai_client()
+        resp = await client.responses.create(
+            model="gpt-4.1-mini",
+            input=[
+                {"role": "system", "content": self._router_prompt},
+                {"role": "user", "content": user_message},
+            ],
+            text=self._router_format,
+            temperature=0,
+            max_output_tokens=200,
+        )
+        record_usage("router", resp)
+
+        try:
+            data = json.loads(resp.output_text)
+        except (TypeError, ValueError):
+            logger.warning("IntentRouter combined route unparsable status=%s", resp.status)
+            return None
+
+        device_ids = list(dict.fromkeys(data["device_ids"]))
+        route = Route(
+            intent=data["intent"],
+            source="llm_combined",
+            device_ids=device_ids,
+            is_comparing=bool(data["is_comparing"]) and len(device_ids) >= 2,
+        )
+        logger.info(
+            "IntentRouter combined intent=%s device_ids=%s comparing=%s",
+            route.intent,
+            route.device_ids,
+            route.is_comparing,
+        )
+        return route
+
+    async def classify_llm(self, user_message: str) -> str:
+        """
+        Классификация через gpt-4.1-mini.
+        """
 
         client = await ensure_openai_client()
         resp = await client.responses.create(
             model="gpt-4.1-mini",
-            input=[{"role": "user", "content": prompt}],
+            input=[
+                {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+                {"role": "user", "content": user_message},
+            ],
             temperature=0,
             max_output_tokens=32,
         )
+        record_usage("intent", resp)
 
         raw = (resp.output_text or "").strip()
         upper = raw.upper()
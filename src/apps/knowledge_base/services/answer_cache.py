@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import time
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from common.redis_client import get_redis
+from logger.config import get_logger
+from settings import config
+from utils.text import normalize
+
+logger = get_logger(__name__)
+
+_PREFIX = "faq_answer"
+_LRU_KEY = f"{_PREFIX}:lru"
+
+_faq_answer_cache: FAQAnswerCache | None = None
+
+
+def _question_hash(question: str) -> str:
+    return hashlib.sha1(normalize(question).encode("utf-8")).hexdigest()
+
+
+def _pack(embedding: Sequence[float]) -> str:
+    return base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _unpack(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class FAQAnswerCache:
+    """
+    Семантический кеш готовых ответов FAQ в Redis.
+
+    Ответ хранится под id совпавшей записи FAQEntry и нормализованным вопросом:
+    хеш faq_answer:entry:{id} (поля — хеши вопросов, он же обратный индекс
+    записи), ключ faq_answer:q:{хеш} → id для дословных повторов и член
+    LRU-множества «{id}:{хеш}». Новый вопрос получает кешированный ответ,
+    если его эмбеддинг близок (cosine >= similarity) к одному из
+    закешированных вопросов той же записи. Старые вопросы вытесняются
+    по LRU, каждая запись живёт не дольше ttl.
+
+    Ответы хранятся сырым текстом модели; разметку под канал делает
+    format_answer при отправке (он принимает и уже готовый HTML).
+    """
+
+    def __init__(
+        self,
+        similarity: float | None = None,
+        ttl: int | None = None,
+        max_entries: int | None = None,
+    ) -> None:
+        self._similarity = similarity if similarity is not None else config.FAQ_ANSWER_CACHE_SIMILARITY
+        self._ttl = ttl if ttl is not None else config.FAQ_ANSWER_CACHE_TTL
+        self._max_entries = max_entries if max_entries is not None else config.FAQ_ANSWER_CACHE_MAX_ENTRIES
+
+    @staticmethod
+    def _entry_key(entry_id: int) -> str:
+        return f"{_PREFIX}:entry:{entry_id}"
+
+    @staticmethod
+    def _question_key(qhash: str) -> str:
+        return f"{_PREFIX}:q:{qhash}"
+
+    async def get_exact(self, question: str) -> Optional[str]:
+        """
+        Ответ для дословно (после нормализации) повторённого вопроса.
+        """
+        redis = await get_redis()
+        qhash = _question_hash(question)
+        entry_id = await redis.get(self._question_key(qhash))
+        if entry_id is None:
+            return None
+        raw = await redis.hget(self._entry_key(int(entry_id)), qhash)
+        answer = self._answer_from(raw)
+        if answer is not None:
+            await redis.zadd(_LRU_KEY, {f"{entry_id}:{qhash}": time.time()})
+            logger.info("FAQAnswerCache exact hit entry_id=%s", entry_id)
+        return answer
+
+    async def lookup(
+        self,
+        embedding: Sequence[float],
+        entry_id: int | None,
+    ) -> Optional[str]:
+        """
+        Ищет закешированный ответ среди вопросов, совпавших с той же записью FAQ.
+        """
+        if entry_id is None:
+            return None
+        redis = await get_redis()
+        cached = await redis.hgetall(self._entry_key(entry_id))
+        if not cached:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query)) or 1.0
+        best_score, best_hash, best_answer = -1.0, None, None
+        for qhash, raw in cached.items():
+            try:
+                payload = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            if time.time() - payload.get("ts", 0) > self._ttl:
+                continue
+            vec = _unpack(payload["emb"])
+            score = float(vec @ query) / ((float(np.linalg.norm(vec)) or 1.0) * query_norm)
+            if score > best_score:
+                best_score, best_hash, best_answer = score, qhash, payload["answer"]
+
+        if best_hash is None or best_score < self._similarity:
+            return None
+
+        await redis.zadd(_LRU_KEY, {f"{entry_id}:{best_hash}": time.time()})
+        logger.info("FAQAnswerCache semantic hit entry_id=%s score=%.3f", entry_id, best_score)
+        return best_answer
+
+    def _answer_from(self, raw: str | None) -> Optional[str]:
+        if raw is None:
+            return None
+        try:
+            payload = json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+        if time.time() - payload.get("ts", 0) > self._ttl:
+            return None
+        return payload.get("answer")
+
+    async def store(
+        self,
+        question: str,
+        embedding: Sequence[float],
+        entry_id: int | None,
+        answer: str,
+    ) -> None:
+        """
+        Сохраняет ответ модели без форматирования под канал (его делает
+        format_answer при отправке) и вытесняет самые старые записи сверх лимита.
+        """
+        if entry_id is None or not answer:
+            return
+        redis = await get_redis()
+        qhash = _question_hash(question)
+        now = time.time()
+        payload = json.dumps(
+            {"q": normalize(question), "emb": _pack(embedding), "answer": answer, "ts": now},
+            ensure_ascii=False,
+        )
+
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(self._entry_key(entry_id), qhash, payload)
+        pipe.expire(self._entry_key(entry_id), self._ttl)
+        pipe.set(self._question_key(qhash), entry_id, ex=self._ttl)
+        pipe.zadd(_LRU_KEY, {f"{entry_id}:{qhash}": now})
+        pipe.zcard(_LRU_KEY)
+        *_, size = await pipe.execute()
+
+        if size > self._max_entries:
+            await self._evict(size - self._max_entries)
+
+    async def _evict(self, count: int) -> None:
+        redis = await get_redis()
+        oldest = await redis.zpopmin(_LRU_KEY, count)
+        if not oldest:
+            return
+        pipe = redis.pipeline(transaction=False)
+        for member, _ in oldest:
+            entry_id, qhash = member.split(":", 1)
+            pipe.hdel(self._entry_key(int(entry_id)), qhash)
+            pipe.delete(self._question_key(qhash))
+        await pipe.execute()
+        logger.info("FAQAnswerCache evicted=%d", len(oldest))
+
+    async def invalidate_entries(self, entry_ids: Iterable[int]) -> None:
+        """
+        Сбрасывает ответы для изменённых или удалённых записей FAQ вместе
+        с ключами дословных вопросов и членами LRU, которые на них указывают.
+        """
+        ids = list(entry_ids)
+        if not ids:
+            return
+        redis = await get_redis()
+        pipe = redis.pipeline(transaction=False)
+        for entry_id in ids:
+            pipe.hkeys(self._entry_key(entry_id))
+        hashes = await pipe.execute()
+
+        pipe = redis.pipeline(transaction=False)
+        questions = 0
+        for entry_id, qhashes in zip(ids, hashes):
+            if qhashes:
+                pipe.delete(*(self._question_key(qhash) for qhash in qhashes))
+                pipe.zrem(_LRU_KEY, *(f"{entry_id}:{qhash}" for qhash in qhashes))
+                questions += len(qhashes)
+            pipe.delete(self._entry_key(entry_id))
+        await pipe.execute()
+        logger.info("FAQAnswerCache invalidated entries=%d questions=%d", len(ids), questions)
+
+
+def get_faq_answer_cache() -> FAQAnswerCache:
+    global _faq_answer_cache
+    if _faq_answer_cache is None:
+        _faq_answer_cache = FAQAnswerCache()
+    return _faq_answer_cache
@@ -2,10 +2,13 @@ from __future__ import annotations
 
 import json
 import re
-from typing import Union
+from typing import Any, AsyncIterator, Union
 
+from common.llm_usage import record_usage
+from common.metrics import timed
 from common.openai_client import ensure_openai_client
 from logger.config import get_logger
+from utils.answer_format import format_answer
 
 logger = get_logger(__name__)
 
@@ -23,6 +26,7 @@ FAQ_SYSTEM_PROMPT = """
     💬 https://wa.me/79270355555 WhatsApp
 - Если пользователь говорит, что действия, которые он предпринял не помогают, посоветуй обратиться в поддержку, его с радостью проконсультруют и помогут.
 - GPS определяет где находятся камеры, мы не решаем вопросы навигации.
+- Если из базы знаний передано несколько возможных ответов — выбери только один, который максимально соответствует запросу пользователя. Не смешивай ответы, не сокращай факты, сохрани все ссылки.
 """
 
 DEVICE_SYSTEM_PROMPT = """
@@ -59,9 +63,17 @@ DEVICE_SYSTEM_PROMPT = """
 """
 
 SPECS_SYSTEM_PROMPT = """
-Ты — консультант компании Fujida.
-Этот режим пока не реализован, поэтому дай заглушку.
-Ответь, что поиск по характеристикам в разработке.
+Ты — консультант компании Fujida. Отвечаешь как человек: просто и по делу.
+Тебе передан результат поиска устройств по характеристикам:
+"conditions" — распознанные условия, "devices" — подходящие модели и значения этих характеристик.
+
+Правила:
+1. Перечисли подходящие модели по их полному названию, кратко указав значение запрошенной характеристики.
+2. Если у модели есть "статус" (снята с продажи, нет в наличии) — укажи его.
+3. Если есть "ссылка" — отдай её как HTML: <a href="...">Страница модели</a>. Не выдумывай ссылки.
+4. Если "devices" пуст — вежливо сообщи, что таких моделей нет.
+5. Если есть "note" — попроси уточнить, какая характеристика интересует, опираясь на список "supported".
+6. Не добавляй модели и характеристики, которых нет в данных.
 """
 
 OTHER_SYSTEM_PROMPT = """
@@ -72,10 +84,6 @@ OTHER_SYSTEM_PROMPT = """
 FALLBACK_SYSTEM_PROMPT = """
 Ты — консультант компании Fujida.
 Отвечай вежливо, от первого лица.
-"""
-
-FALLBACK_PROMPT = """
-Сообщение пользователя: "{user_message}"
 
 Правила:
 - Если это приветствие или смолток — ответь дружелюбно.
@@ -83,42 +91,48 @@ FALLBACK_PROMPT = """
 - Если вопрос совсем не по теме — дай короткий нейтральный ответ.
 """
 
-_MD_LINK_RE = re.compile(r"\[([^\]]+)\]\((https?://[^\s)]+)\)")
-_CODE_FENCE_RE = re.compile(r"```.+?```", flags=re.DOTALL)
+_OPEN_MD_LINK_RE = re.compile(r"\[[^\]\n]*(?:\]\([^)\s]*)?$")
 
 
-def _markdown_links_to_html(text: str) -> str:
-    def repl(m: re.Match) -> str:
-        label = m.group(1).strip()
-        url = m.group(2).strip()
-        return f'<a href="{url}">{label}</a>'
-    return _MD_LINK_RE.sub(repl, text)
+def _safe_prefix(text: str) -> str:
+    """
+    Отрезает незавершённый хвост потока: открытый code fence,
+    недописанную markdown-ссылку, HTML-тег или сущность.
+    """
+    if text.count("```") % 2:
+        text = text[:text.rfind("```")]
+    m = _OPEN_MD_LINK_RE.search(text)
+    if m:
+        text = text[:m.start()]
+    lt = text.rfind("<")
+    if lt > text.rfind(">"):
+        text = text[:lt]
+    amp = text.rfind("&")
+    if amp > text.rfind(";") and " " not in text[amp:]:
+        text = text[:amp]
+    return text
 
 
-def _strip_code_fences(text: str) -> str:
-    return _CODE_FENCE_RE.sub("", text)
+class StreamingPostprocessor:
+    """
+    Копит дельты потока и отдаёт безопасный префикс в виде HTML для Telegram.
+    """
 
+    def __init__(self) -> None:
+        self._parts: list[str] = []
 
-def _clean_meta_phrases(text: str) -> str:
-    bad_bits = [
-        "судя по предоставленной информации",
-        "согласно предоставленным данным",
-        "в контексте",
-        "согласно контексту",
-        "согласно данным",
-        "на основе предоставленных данных",
-    ]
-    out = text
-    for b in bad_bits:
-        out = re.sub(rf"\b{re.escape(b)}\b[:,\s]*", "", out, flags=re.IGNORECASE)
-    return out
+    def feed(self, delta: str) -> None:
+        self._parts.append(delta)
 
+    @property
+    def raw(self) -> str:
+        return "".join(self._parts)
 
-def _postprocess_answer(text: str) -> str:
-    text = _strip_code_fences(text)
-    text = _markdown_links_to_html(text)
-    text = _clean_meta_phrases(text)
-    return text.strip()
+    def render(self) -> str:
+        return format_answer(_safe_prefix(self.raw)).html
+
+    def result(self) -> str:
+        return self.raw.strip()
 
 
 class AnswerService:
@@ -127,45 +141,49 @@ class AnswerService:
 
     def _build_faq_context(self, user_message: str, data: dict) -> str:
         if "exact_match" in data:
-            return f"""
-                Вопрос пользователя:
-                "{user_message}"
-
-                Наиболее подходящий ответ из базы знаний:
-                Q: {data['exact_match']['question']}
-                A: {data['exact_match']['answer']}
-                """
+            return (
+                "Наиболее подходящий ответ из базы знаний:\n"
+                f"Q: {data['exact_match']['question']}\n"
+                f"A: {data['exact_match']['answer']}\n\n"
+                f'Вопрос пользователя:\n"{user_message}"'
+            )
         variants = "\n\n".join(
             f"{i+1}. Q: {q}\n   A: {a}"
             for i, (q, a) in enumerate(zip(data["top_questions"], data["top_answers"]))
         )
-        return f"""
-            Вопрос пользователя:
-            "{user_message}"
-
-            Возможные ответы из базы знаний:
-            {variants}
-
-            Инструкция: выбери только один ответ, который максимально соответствует запросу пользователя. 
-            Не смешивай ответы, не сокращай факты, сохрани все ссылки.
-            """
+        return (
+            f"Возможные ответы из базы знаний:\n{variants}\n\n"
+            f'Вопрос пользователя:\n"{user_message}"'
+        )
 
-    async def generate(
+    def _build_inputs(
         self,
         user_message: str,
         context: Union[str, dict, list],
         intent: str,
         past_messages: list[dict] | None = None,
-    ) -> str:
+    ) -> tuple[list[dict], dict[str, Any]]:
+        """
+        Собирает input для Responses API и доп. параметры запроса.
+        Порядок — от статичного к изменчивому: системный промпт, история,
+        затем контекст и вопрос, чтобы префикс попадал в prompt caching.
+        """
         if intent == "FAQ":
             system_prompt = FAQ_SYSTEM_PROMPT
             context_str = self._build_faq_context(user_message, context)
         elif intent == "Device":
             system_prompt = DEVICE_SYSTEM_PROMPT
-            context_str = json.dumps(context, ensure_ascii=False)
+            if isinstance(context, str):
+                context_str = context
+            else:
+                context_str = json.dumps(context, ensure_ascii=False)
         elif intent == "Specs":
             system_prompt = SPECS_SYSTEM_PROMPT
-            context_str = str(context or "")
+            if isinstance(context, (dict, list)):
+                context_str = json.dumps(context, ensure_ascii=False)
+            else:
+                context_str = str(context or "")
+            context_str = f'{context_str}\n\nВопрос пользователя:\n"{user_message}"'
         else:
             system_prompt = OTHER_SYSTEM_PROMPT
             context_str = str(context or "")
@@ -185,42 +203,76 @@ class AnswerService:
             len(past_messages) if past_messages else 0,
         )
 
+        params: dict[str, Any] = {"temperature": 0.6} if intent == "FAQ" else {}
+        return inputs, params
+
+    @timed("answer_generation")
+    async def generate(
+        self,
+        user_message: str,
+        context: Union[str, dict, list],
+        intent: str,
+        past_messages: list[dict] | None = None,
+    ) -> str:
+        inputs, params = self._build_inputs(user_message, context, intent, past_messages)
+
         client = await ensure_openai_client()
-        if intent == "FAQ":
-            resp = await client.responses.create(
-                model=self._model,
-                input=inputs,
-                temperature=0.6,
-            )
-        else:
-            resp = await client.responses.create(model=self._model, input=inputs)
+        resp = await client.responses.create(model=self._model, input=inputs, **params)
+        record_usage(f"answer:{intent}", resp)
 
         raw = resp.output_text.strip()
         logger.info("AnswerService.generate raw_answer_len=%d", len(raw))
-        return _postprocess_answer(raw)
+        return raw
+
+    async def generate_stream(
+        self,
+        user_message: str,
+        context: Union[str, dict, list],
+        intent: str,
+        past_messages: list[dict] | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        То же, что generate, но отдаёт сырые текстовые дельты по мере генерации.
+        Промежуточный HTML — через StreamingPostprocessor.render().
+        """
+        inputs, params = self._build_inputs(user_message, context, intent, past_messages)
 
+        client = await ensure_openai_client()
+        total = 0
+        with timed("answer_generation"):
+            stream = await client.responses.create(
+                model=self._model, input=inputs, stream=True, **params
+            )
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    total += len(event.delta)
+                    yield event.delta
+                elif event.type == "response.completed":
+                    record_usage(f"answer:{intent}", event.response)
+        logger.info("AnswerService.generate_stream raw_answer_len=%d", total)
+
+    @timed("answer_generation")
     async def fallback(
         self,
         user_message: str,
         past_messages: list[dict] | None = None,
     ) -> str:
-        prompt = FALLBACK_PROMPT.format(user_message=user_message)
-
         inputs = [{"role": "system", "content": FALLBACK_SYSTEM_PROMPT}]
         if past_messages:
             inputs.extend(past_messages)
-        inputs.append({"role": "user", "content": prompt})
+        inputs.append({"role": "user", "content": user_message})
 
         logger.info("AnswerService.fallback inputs=%s", json.dumps(inputs, ensure_ascii=False))
         logger.info(
             "AnswerService.fallback system_prompt_len=%d user_prompt_len=%d history_len=%d",
             len(FALLBACK_SYSTEM_PROMPT),
-            len(prompt),
+            len(user_message),
             len(past_messages) if past_messages else 0,
         )
 
         client = await ensure_openai_client()
         resp = await client.responses.create(model=self._model, input=inputs)
+        record_usage("answer:fallback", resp)
         raw = resp.output_text.strip()
         logger.info("AnswerService.fallback raw_answer_len=%d", len(raw))
-        return _postprocess_answer(raw)
\ No newline at end of file
+        return raw
\ No newline at end of file
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from logger.config import get_logger
+from utils.text import strip_empty_fields
+
+logger = get_logger(__name__)
+
+DEVICES_JSON_PATH = Path(__file__).resolve().parents[3] / "common" / "devices.json"
+
+_device_catalog: DeviceCatalog | None = None
+
+# Поля, которые не несут характеристик (имя модели выводится заголовком).
+_SKIP_KEYS = {"id", "алиасы", "название_модели"}
+# Пересказ структурированного списка отличий тем же текстом.
+_SOURCE_SUFFIX = "_исходник"
+
+
+class DeviceAttribute(NamedTuple):
+    section: str
+    label: str
+    value: str
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "да" if value else "нет"
+    if isinstance(value, list):
+        return "; ".join(_format_value(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return str(value)
+
+
+def flatten_device(device: Dict[str, Any]) -> List[DeviceAttribute]:
+    """
+    Раскладывает запись устройства в плоский список характеристик
+    (раздел, подпись, значение) без пустых и повторяющихся полей:
+    повтор названия модели в разделах и *_исходник рядом с отличиями.
+    """
+    name = device.get("название_модели", "")
+    out: List[DeviceAttribute] = []
+
+    def walk(section: str, path: List[str], value: Any) -> None:
+        if isinstance(value, dict):
+            keys = set(value)
+            for key, item in value.items():
+                if key.endswith(_SOURCE_SUFFIX) and any(k.startswith("отличия") for k in keys):
+                    continue
+                walk(section, path + [key], item)
+            return
+        text = _format_value(value)
+        if text == name:
+            return
+        label = " / ".join(p.replace("_", " ") for p in path)
+        out.append(DeviceAttribute(section, label, text))
+
+    for key, value in strip_empty_fields(device).items():
+        if key in _SKIP_KEYS:
+            continue
+        if isinstance(value, dict):
+            walk(key.replace("_", " "), [], value)
+        else:
+            walk("", [key], value)
+    return out
+
+
+class DeviceCatalog:
+    """
+    Каталог устройств Fujida в памяти процесса.
+    Загружается один раз, индексируется по id и перечитывается
+    только при изменении mtime файла.
+    """
+
+    def __init__(self, json_path: Optional[Path] = None) -> None:
+        self._json_path = json_path or DEVICES_JSON_PATH
+        self._mtime: float | None = None
+        self._devices: List[dict[str, Any]] = []
+        self._by_id: Dict[str, dict[str, Any]] = {}
+        self._attributes: Dict[str, List[DeviceAttribute]] = {}
+        self.load()
+
+    @property
+    def version(self) -> float | None:
+        """
+        Версия каталога (mtime файла), меняется при перезагрузке.
+        """
+        return self._mtime
+
+    @property
+    def devices(self) -> List[dict[str, Any]]:
+        return self._devices
+
+    def load(self) -> None:
+        """
+        Читает devices.json и пересобирает индексы и плоские списки характеристик.
+        """
+        mtime = os.stat(self._json_path).st_mtime
+        with open(self._json_path, encoding="utf-8") as f:
+            devices: List[dict[str, Any]] = json.load(f)
+
+        self._devices = devices
+        self._by_id = {d["id"]: d for d in devices}
+        self._attributes = {d["id"]: flatten_device(d) for d in devices}
+        self._mtime = mtime
+        logger.info("DeviceCatalog loaded devices=%d path=%s", len(devices), self._json_path)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Перечитывает файл, если он изменился. Возвращает True при перезагрузке.
+        """
+        try:
+            mtime = os.stat(self._json_path).st_mtime
+        except OSError as e:
+            logger.warning("DeviceCatalog stat failed: %s", e)
+            return False
+        if mtime == self._mtime:
+            return False
+        self.load()
+        return True
+
+    def get(self, device_id: str) -> dict[str, Any] | None:
+        return self._by_id.get(device_id)
+
+    def by_ids(self, device_ids: Iterable[str]) -> List[dict[str, Any]]:
+        """
+        Возвращает устройства в порядке переданных id, неизвестные id пропускаются.
+        """
+        return [self._by_id[i] for i in device_ids if i in self._by_id]
+
+    def attributes(self, device_id: str) -> List[DeviceAttribute]:
+        """
+        Плоский список характеристик устройства (см. flatten_device).
+        """
+        return self._attributes.get(device_id, [])
+
+    def models_text(self) -> str:
+        """
+        Список моделей с алиасами для промптов, по строке на модель.
+        """
+        lines = []
+        for d in self._devices:
+            aliases = ", ".join(d.get("алиасы", []))
+            lines.append(f"id: {d['id']} | модель: {d['название_модели']} | алиасы: {aliases}")
+        return "\n".join(lines)
+
+
+def init_device_catalog(json_path: Optional[Path] = None) -> DeviceCatalog:
+    """
+    Загружает каталог устройств и кладёт его в кеш процесса.
+    """
+    global _device_catalog
+    if _device_catalog is None:
+        _device_catalog = DeviceCatalog(json_path)
+    return _device_catalog
+
+
+def get_device_catalog() -> DeviceCatalog:
+    """
+    Возвращает каталог устройств, при необходимости перечитывая файл.
+    """
+    catalog = init_device_catalog()
+    catalog.reload_if_changed()
+    return catalog
+
+
+def set_device_catalog(catalog: DeviceCatalog | None) -> None:
+    global _device_catalog
+    _device_catalog = catalog
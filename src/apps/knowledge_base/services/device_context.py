@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+from apps.knowledge_base.services.device_catalog import DeviceAttribute, DeviceCatalog
+from logger.config import get_logger
+from settings import config
+from utils.text import estimate_tokens, normalize
+
+logger = get_logger(__name__)
+
+_WORD_RE = re.compile(r"[\wё]+", re.IGNORECASE)
+
+# Поля, которые нужны в любом ответе (тип, гарантия и ссылка по DEVICE_SYSTEM_PROMPT).
+_ALWAYS = {"тип устройства", "гарантия годы", "ссылка", "статус"}
+
+_STOPWORDS = {
+    "fujida", "фуджида", "модель", "модели", "моделей", "какой", "какая", "какие",
+    "какое", "этот", "этой", "этого", "между", "лучше", "разница", "отличия",
+    "отличается", "отличаются", "сравни", "сравнить", "расскажи", "подскажите",
+}
+
+_Row = Tuple[str, str, List[str | None]]
+
+
+def _stems(text: str) -> Set[str]:
+    """
+    Грубые основы слов: префикс без последних трёх букв, не короче четырёх.
+    """
+    out = set()
+    for word in _WORD_RE.findall(normalize(text)):
+        if len(word) < 4 or word in _STOPWORDS:
+            continue
+        out.add(word[: max(4, len(word) - 3)])
+    return out
+
+
+def _relevant(stems: Set[str], section: str, label: str, values: Sequence[str | None]) -> bool:
+    if not stems:
+        return False
+    words = _WORD_RE.findall(f"{section} {label} {' '.join(v or '' for v in values)}".lower())
+    return any(w.startswith(s) for w in words for s in stems)
+
+
+def _rows(attribute_lists: Sequence[List[DeviceAttribute]]) -> List[_Row]:
+    """
+    Объединяет характеристики устройств в строки таблицы по (раздел, подпись).
+    Сначала поля верхнего уровня, затем разделы; порядок — первого появления.
+    """
+    sections: Dict[str, List[str]] = {"": []}
+    values: Dict[Tuple[str, str], List[str | None]] = {}
+    for i, attributes in enumerate(attribute_lists):
+        for attr in attributes:
+            key = (attr.section, attr.label)
+            if key not in values:
+                sections.setdefault(attr.section, []).append(attr.label)
+                values[key] = [None] * len(attribute_lists)
+            values[key][i] = attr.value
+    return [
+        (section, label, values[(section, label)])
+        for section, labels in sections.items()
+        for label in labels
+    ]
+
+
+def _render_row(label: str, values: Sequence[str | None]) -> str:
+    if len(values) == 1:
+        return f"{label}: {values[0]}"
+    if len(set(values)) == 1:
+        return f"{label}: {values[0]} (у всех)"
+    return f"{label}: " + " | ".join(v if v is not None else "—" for v in values)
+
+
+class DeviceContextBuilder:
+    """
+    Компактный контекст по устройствам для AnswerService (intent Device).
+
+    Характеристики выводятся строками «подпись: значение» по разделам,
+    для нескольких моделей — одной строкой «подпись: A | B | C».
+    При сравнении остаются только различающиеся характеристики и те,
+    что относятся к словам вопроса. Если всё не помещается в token_budget,
+    первыми отбрасываются строки, не связанные с вопросом.
+    """
+
+    def __init__(self, token_budget: int | None = None) -> None:
+        self.token_budget = (
+            token_budget if token_budget is not None else config.DEVICE_CONTEXT_TOKEN_BUDGET
+        )
+
+    def build(self, catalog: DeviceCatalog, selection: Dict[str, Any]) -> str:
+        question = selection.get("question_text", "")
+        devices = catalog.by_ids(selection.get("device_ids", []))
+        footer = f'Вопрос пользователя:\n"{question}"'
+        if not devices:
+            return f"Модели Fujida из вопроса в каталоге не найдены.\n\n{footer}"
+
+        names = [d["название_модели"] for d in devices]
+        # Слова из названий и алиасов выбранных моделей — не признак характеристики.
+        name_stems = _stems(" ".join(names + [a for d in devices for a in d.get("алиасы", [])]))
+        stems = _stems(question) - name_stems
+
+        comparing = len(devices) > 1
+        rows = _rows([catalog.attributes(d["id"]) for d in devices])
+        candidates: List[Tuple[int, int, str, str]] = []
+        for index, (section, label, values) in enumerate(rows):
+            relevant = _relevant(stems, section, label, values)
+            if label in _ALWAYS:
+                priority = 0
+            elif relevant:
+                priority = 1
+            elif not comparing or len(set(values)) > 1:
+                priority = 2
+            else:
+                continue
+            candidates.append((priority, index, section, _render_row(label, values)))
+
+        if comparing:
+            header = "Сравнение моделей: " + " | ".join(names)
+            note = "Одинаковые у всех моделей характеристики, не связанные с вопросом, опущены."
+        else:
+            header = f"Модель: {names[0]}"
+            note = ""
+
+        budget = self.token_budget - estimate_tokens(f"{header}\n{note}\n{footer}")
+        chosen: List[Tuple[int, str, str]] = []
+        opened: Set[str] = set()
+        dropped = 0
+        for priority, index, section, line in sorted(candidates):
+            tokens = estimate_tokens(line) + 1
+            if section and section not in opened:
+                tokens += estimate_tokens(f"[{section}]") + 1
+            if tokens > budget:
+                dropped += 1
+                continue
+            budget -= tokens
+            opened.add(section)
+            chosen.append((index, section, line))
+
+        lines = [header]
+        if note:
+            lines.append(note)
+        current_section = ""
+        for _, section, line in sorted(chosen):
+            if section and section != current_section:
+                lines.append(f"[{section}]")
+                current_section = section
+            lines.append(line)
+
+        logger.info(
+            "DeviceContextBuilder devices=%d rows=%d dropped=%d keywords=%s",
+            len(devices),
+            len(chosen),
+            dropped,
+            sorted(stems),
+        )
+        return "\n".join(lines) + f"\n\n{footer}"
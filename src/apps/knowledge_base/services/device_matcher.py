@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import ahocorasick
+from rapidfuzz import fuzz, process
+
+from utils.text import normalize, transliterate
+
+_PUNCT_RE = re.compile(r"[^\w\s-]+")
+
+_FUZZY_MIN_LEN = 5
+_EDGE_CUTOFF = 70.0
+# Однобуквенные соседи («с», «и», «в») чаще предлоги, чем часть названия.
+_NEIGHBOR_MIN_LEN = 2
+
+_Span = Tuple[int, int, float, frozenset[str]]
+
+_COMPARE_RE = re.compile(
+    r"\b(?:или|что лучше|кто лучше|какой лучше|какая лучше|сравн\w*|"
+    r"разниц\w*|отлич\w*|против|vs|versus)\b"
+)
+
+
+def _prepare(text: str) -> str:
+    """
+    Нормализует текст для поиска: без пунктуации, в нижнем регистре.
+    """
+    return normalize(_PUNCT_RE.sub(" ", text or ""))
+
+
+@dataclass(frozen=True)
+class DeviceMatch:
+    device_ids: List[str] = field(default_factory=list)
+    is_comparing: bool = False
+    confidence: float = 0.0
+
+    def as_selection(self, user_message: str) -> Dict[str, Any]:
+        return {
+            "device_ids": list(self.device_ids),
+            "is_comparing": self.is_comparing,
+            "question_text": user_message,
+        }
+
+
+class DeviceMatcher:
+    """
+    Локальный поиск упомянутых устройств Fujida без обращения к LLM.
+    Точное совпадение — автомат Ахо-Корасик по названиям и алиасам,
+    опечатки и транслит — rapidfuzz по n-граммам слов.
+    """
+
+    def __init__(self, devices: Iterable[dict[str, Any]], fuzzy_cutoff: float = 82.0) -> None:
+        self._fuzzy_cutoff = fuzzy_cutoff
+        self._patterns: Dict[str, Set[str]] = {}
+        self._order: Dict[str, int] = {}
+        self._vocab: Dict[str, Set[str]] = {}
+        self._owners: Dict[str, Set[str]] = {}
+
+        for idx, d in enumerate(devices):
+            device_id = d["id"]
+            self._order[device_id] = idx
+            for name in self._names_for(d):
+                for variant in {name, transliterate(name)}:
+                    self._patterns.setdefault(variant, set()).add(device_id)
+                    self._vocab.setdefault(device_id, set()).update(variant.split())
+
+        for device_id, vocab in self._vocab.items():
+            for word in vocab:
+                self._owners.setdefault(word, set()).add(device_id)
+
+        self._automaton = ahocorasick.Automaton()
+        for pattern, ids in self._patterns.items():
+            self._automaton.add_word(f" {pattern} ", (pattern, frozenset(ids)))
+        self._automaton.make_automaton()
+
+        fuzzy = [
+            (p, frozenset(ids))
+            for p, ids in self._patterns.items()
+            if p == transliterate(p) and len(p) >= _FUZZY_MIN_LEN
+        ]
+        self._fuzzy_names: List[str] = [p for p, _ in fuzzy]
+        self._fuzzy_ids: List[frozenset[str]] = [ids for _, ids in fuzzy]
+        self._max_words = max((len(p.split()) for p in self._patterns), default=1)
+
+    @staticmethod
+    def _names_for(device: dict[str, Any]) -> Set[str]:
+        """
+        Возвращает все нормализованные варианты названия устройства.
+        """
+        names: Set[str] = set()
+        full = _prepare(device.get("название_модели", ""))
+        if full:
+            names.add(full)
+            short = full.removeprefix("fujida ").strip()
+            names.add(short)
+            names.add(short.removesuffix(" wifi").strip())
+        for alias in device.get("алиасы", []):
+            alias = _prepare(alias)
+            if alias:
+                names.add(alias)
+        names.discard("")
+        return names
+
+    def _exact(self, words: List[str]) -> List[_Span]:
+        """
+        Возвращает точные совпадения как интервалы слов.
+        """
+        haystack = f" {' '.join(words)} "
+        word_at: Dict[int, int] = {}
+        pos = 0
+        for i, w in enumerate(words):
+            word_at[pos] = i
+            pos += len(w) + 1
+
+        spans: List[_Span] = []
+        for end, (pattern, ids) in self._automaton.iter(haystack):
+            first = word_at[end - len(pattern) - 1]
+            spans.append((first, first + len(pattern.split()), 100.0, ids))
+        return spans
+
+    def _fuzzy(self, words: List[str]) -> List[_Span]:
+        """
+        Ищет алиасы с опечатками среди n-грамм слов текста.
+        """
+        spans: List[_Span] = []
+        for size in range(min(self._max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                chunk = " ".join(words[start:start + size])
+                if len(chunk) < _FUZZY_MIN_LEN:
+                    continue
+                found = process.extractOne(
+                    chunk,
+                    self._fuzzy_names,
+                    scorer=fuzz.ratio,
+                    score_cutoff=self._fuzzy_cutoff,
+                )
+                if found is None:
+                    continue
+                choice, score, idx = found
+                if not self._edges_match(chunk, choice):
+                    continue
+                spans.append((start, start + size, score, self._fuzzy_ids[idx]))
+        return spans
+
+    def _edges_match(self, chunk: str, choice: str) -> bool:
+        """
+        Проверяет, что крайние слова n-граммы похожи на крайние слова алиаса,
+        чтобы соседние слова не «прилипали» к совпадению.
+        """
+        a, b = chunk.split(), choice.split()
+        return (
+            fuzz.ratio(a[0], b[0]) >= _EDGE_CUTOFF
+            and fuzz.ratio(a[-1], b[-1]) >= _EDGE_CUTOFF
+        )
+
+    def _coverage(self, span: _Span, words: List[str], latin: List[str]) -> int:
+        """
+        Сколько подряд идущих слов запроса вокруг совпадения входит в названия
+        и алиасы его устройства: «karma pro max» целиком покрывает Pro Max,
+        а Karma Pro — только «karma pro».
+        """
+        best = 0
+        for device_id in span[3]:
+            vocab = self._vocab.get(device_id, set())
+
+            def known(i: int) -> bool:
+                return words[i] in vocab or latin[i] in vocab
+
+            start, end = span[0], span[1]
+            while start > 0 and known(start - 1):
+                start -= 1
+            while end < len(words) and known(end):
+                end += 1
+            best = max(best, end - start)
+        return best
+
+    def _foreign_neighbor(self, span: _Span, words: List[str], latin: List[str]) -> bool:
+        """
+        Есть ли рядом с совпадением слово из названия другого устройства,
+        которого нет в названиях найденного: в «зум хит» алиас «hit» даёт
+        Karma Hit, но «зум» указывает на линейку Zoom.
+        """
+        for i in (span[0] - 1, span[1]):
+            if not 0 <= i < len(words):
+                continue
+            for word in {words[i], latin[i]}:
+                if len(word) < _NEIGHBOR_MIN_LEN:
+                    continue
+                owners = self._owners.get(word, set())
+                if owners - span[3] and not owners & span[3]:
+                    return True
+        return False
+
+    def _resolve(
+        self, spans: List[_Span], words: List[str], latin: List[str]
+    ) -> Tuple[List[_Span], bool]:
+        """
+        Оставляет непересекающиеся совпадения: длиннее, с большим покрытием
+        запроса и точнее — приоритетнее. Второе значение — был ли конфликт:
+        отброшенное совпадение другого устройства частично пересекалось
+        с выбранным (не вкладывалось в него).
+        """
+        spans = sorted(
+            spans,
+            key=lambda s: (-(s[1] - s[0]), -self._coverage(s, words, latin), -s[2], s[0]),
+        )
+        taken: List[_Span] = []
+        conflict = False
+        for span in spans:
+            overlapping = [t for t in taken if span[0] < t[1] and t[0] < span[1]]
+            if not overlapping:
+                taken.append(span)
+                continue
+            if any(
+                not (span[3] & t[3]) and not (t[0] <= span[0] and span[1] <= t[1])
+                for t in overlapping
+            ):
+                conflict = True
+        taken.sort(key=lambda s: s[0])
+        return taken, conflict
+
+    def _ordered_ids(self, groups: Iterable[frozenset[str]]) -> List[str]:
+        out: List[str] = []
+        for ids in groups:
+            for device_id in sorted(ids, key=self._order.__getitem__):
+                if device_id not in out:
+                    out.append(device_id)
+        return out
+
+    @staticmethod
+    def is_comparison(text: str) -> bool:
+        """
+        Определяет сравнение по ключевым словам.
+        """
+        return _COMPARE_RE.search(_prepare(text)) is not None
+
+    def match(self, user_message: str) -> DeviceMatch:
+        """
+        Возвращает найденные id устройств, флаг сравнения и уверенность 0..1.
+        """
+        text = _prepare(user_message)
+        if not text:
+            return DeviceMatch()
+
+        words = text.split()
+        latin = transliterate(text).split()
+        spans = self._exact(words) + self._exact(latin) + self._fuzzy(latin)
+        taken, conflict = self._resolve(spans, words, latin)
+
+        groups = [t[3] for t in taken]
+        device_ids = self._ordered_ids(groups)
+        confidence = min((t[2] for t in taken), default=0.0) / 100.0
+        comparison = self.is_comparison(text)
+        if (
+            conflict
+            or any(len(g) > 1 for g in groups)
+            or any(self._foreign_neighbor(t, words, latin) for t in taken)
+            or (comparison and len(device_ids) < 2)
+        ):
+            confidence = min(confidence, 0.5)
+
+        is_comparing = len(device_ids) >= 2 and comparison
+        return DeviceMatch(
+            device_ids=device_ids,
+            is_comparing=is_comparing,
+            confidence=confidence if device_ids else 0.0,
+        )
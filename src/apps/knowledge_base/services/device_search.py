@@ -1,9 +1,15 @@
 from __future__ import annotations
 import json
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional
 
+from apps.knowledge_base.services.device_catalog import DeviceCatalog, get_device_catalog
+from apps.knowledge_base.services.device_matcher import DeviceMatch, DeviceMatcher
+from common.llm_usage import record_usage
+from common.metrics import timed
 from common.openai_client import ensure_openai_client
+from logger.config import get_logger
+
+logger = get_logger(__name__)
 
 
 _device_selector_cached: DeviceSelector | None = None
@@ -22,11 +28,12 @@ DEVICE_SELECTOR_PROMPT = """
 4. Определи, сравнивает ли пользователь несколько моделей.
    Если есть слова вроде "или", "что лучше", "сравни", "разница" → это сравнение.
 
+Текст пользователя придёт следующим сообщением.
+
 Формат ответа строго JSON:
 {{
   "device_ids": ["..."],
-  "is_comparing": true/false,
-  "question_text": "{user_message}"
+  "is_comparing": true/false
 }}
 """
 
@@ -34,45 +41,84 @@ DEVICE_SELECTOR_PROMPT = """
 class DeviceSelector:
     """
     Определяет, какие устройства Fujida упомянуты в тексте пользователя.
+    Сначала ищет локально (DeviceMatcher), LLM вызывается только
+    при низкой уверенности локального поиска.
     """
 
-    def __init__(self, json_path: Optional[Path] = None) -> None:
-        if json_path is None:
-            json_path = Path(__file__).resolve().parents[3] / "common" / "devices.json"
-
-        self._json_path = json_path
-        with open(json_path, encoding="utf-8") as f:
-            self._devices: List[dict[str, Any]] = json.load(f)
-
-    def _models_with_aliases(self) -> str:
+    def __init__(
+        self,
+        catalog: Optional[DeviceCatalog] = None,
+        min_confidence: float = 0.85,
+    ) -> None:
+        self._catalog = catalog
+        self._min_confidence = min_confidence
+        self._matcher: DeviceMatcher | None = None
+        self._matcher_version: float | None = None
+        self._system_prompt = ""
+        self._ensure_index()
+
+    def _current_catalog(self) -> DeviceCatalog:
+        if self._catalog is not None:
+            self._catalog.reload_if_changed()
+            return self._catalog
+        return get_device_catalog()
+
+    def _ensure_index(self) -> DeviceMatcher:
         """
-        Возвращает список моделей и алиасов в компактном виде.
+        Пересобирает матчер и список моделей при смене версии каталога.
         """
-        lines = []
-        for d in self._devices:
-            aliases = ", ".join(d.get("алиасы", []))
-            lines.append(f"id: {d['id']} | модель: {d['название_модели']} | алиасы: {aliases}")
-        return "\n".join(lines)
+        catalog = self._current_catalog()
+        if self._matcher is None or self._matcher_version != catalog.version:
+            self._matcher = DeviceMatcher(catalog.devices)
+            self._system_prompt = DEVICE_SELECTOR_PROMPT.format(
+                models_text=catalog.models_text()
+            )
+            self._matcher_version = catalog.version
+        return self._matcher
+
+    def match(self, user_message: str) -> DeviceMatch:
+        """
+        Только локальный поиск упомянутых моделей, без LLM.
+        """
+        return self._ensure_index().match(user_message)
 
+    @timed("device_selection")
     async def select(self, user_message: str) -> Dict[str, Any]:
         """
-        Отправляет текст пользователя + список моделей в LLM,
-        чтобы определить, какие модели упомянуты.
+        Определяет упомянутые модели: локально или через LLM.
         Возвращает JSON: { device_ids, is_comparing, question_text }
         """
-        models_text = self._models_with_aliases()
-
-        prompt = DEVICE_SELECTOR_PROMPT.format(
-            models_text=models_text,
-            user_message=user_message,
+        match = self.match(user_message)
+        if match.confidence >= self._min_confidence:
+            logger.info(
+                "DeviceSelector local match ids=%s confidence=%.2f",
+                match.device_ids,
+                match.confidence,
+            )
+            return match.as_selection(user_message)
+
+        logger.info(
+            "DeviceSelector low confidence=%.2f, fallback to LLM", match.confidence
         )
+        return await self._select_llm(user_message)
 
+    async def _select_llm(self, user_message: str) -> Dict[str, Any]:
+        """
+        Отправляет текст пользователя + список моделей в LLM,
+        чтобы определить, какие модели упомянуты.
+        Список моделей — в системном сообщении (стабильный префикс
+        для prompt caching), текст пользователя — последним.
+        """
         client = await ensure_openai_client()
         resp = await client.responses.create(
             model="gpt-4.1-mini",
-            input=[{"role": "user", "content": prompt}],
+            input=[
+                {"role": "system", "content": self._system_prompt},
+                {"role": "user", "content": user_message},
+            ],
             max_output_tokens=600,
         )
+        record_usage("device_selector", resp)
 
         try:
             parsed = json.loads(resp.output_text)
@@ -83,6 +129,7 @@ class DeviceSelector:
                 "question_text": user_message,
             }
 
+        parsed["question_text"] = user_message
         if len(parsed.get("device_ids", [])) < 2:
             parsed["is_comparing"] = False
 
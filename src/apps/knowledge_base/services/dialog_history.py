@@ -1,34 +1,290 @@
+from __future__ import annotations
+
+import asyncio
 import json
-from typing import Literal
-from common.redis_client import get_redis
+import struct
+from textwrap import dedent
+from typing import Dict, Literal, Sequence, Tuple
+
+from redis.exceptions import WatchError
+
+from common.llm_usage import record_usage
+from common.metrics import timed
+from common.openai_client import ensure_openai_client
+from common.redis_client import get_redis_bytes
+from logger.config import get_logger
+from settings import config
+from utils.text import estimate_tokens
+
+logger = get_logger(__name__)
 
 MessageRole = Literal["user", "assistant"]
 
+# Запись в списке: 1 байт роли, 2 байта числа токенов (big-endian), UTF-8 текст.
+# Старые записи в JSON (начинаются с "{") читаются как раньше.
+_HEADER = struct.Struct(">BH")
+_ROLE_CODES = {"user": 1, "assistant": 2}
+_ROLE_NAMES = {code: role for role, code in _ROLE_CODES.items()}
+
+# rpush + ltrim + счётчик токенов + TTL за один round-trip.
+# KEYS: список, счётчик токенов, конспект.
+# ARGV: idle TTL (0 — без TTL), длина списка, прирост токенов, записи...
+_APPEND_LUA = """
+redis.call('rpush', KEYS[1], unpack(ARGV, 4))
+redis.call('ltrim', KEYS[1], -tonumber(ARGV[2]), -1)
+local total = redis.call('incrby', KEYS[2], ARGV[3])
+local ttl = tonumber(ARGV[1])
+if ttl > 0 then
+    redis.call('expire', KEYS[1], ttl)
+    redis.call('expire', KEYS[2], ttl)
+    redis.call('expire', KEYS[3], ttl)
+end
+return total
+"""
+
+Entry = Tuple[MessageRole, str, int]
+
+
+def encode_entry(role: MessageRole, content: str, tokens: int) -> bytes:
+    return _HEADER.pack(_ROLE_CODES[role], min(tokens, 0xFFFF)) + content.encode("utf-8")
+
+
+def decode_entry(raw: bytes) -> Entry | None:
+    if not raw:
+        return None
+    if raw[:1] == b"{":
+        try:
+            item = json.loads(raw)
+            content = item["content"]
+            return item["role"], content, int(item.get("tokens") or estimate_tokens(content))
+        except (ValueError, KeyError, TypeError):
+            return None
+    if len(raw) < _HEADER.size:
+        return None
+    code, tokens = _HEADER.unpack_from(raw)
+    role = _ROLE_NAMES.get(code)
+    if role is None:
+        return None
+    return role, raw[_HEADER.size:].decode("utf-8", errors="replace"), tokens
+
+
+SUMMARY_SYSTEM_PROMPT = dedent("""
+    Ты ведёшь краткий конспект диалога пользователя с ботом поддержки Fujida.
+    На вход — прежний конспект (может быть пустым) и следующие реплики.
+    Верни обновлённый конспект на русском: о каких устройствах и проблемах
+    шла речь, что пользователь уже сообщил о себе и своей ситуации, какие
+    ответы и рекомендации уже даны. Без приветствий и оценок, только факты.
+    Не длиннее {max_tokens} токенов.
+""").strip()
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
 
 class DialogHistory:
-    def __init__(self, max_messages: int = 10) -> None:
+    """
+    История диалога в Redis: список реплик dialog:{chat_id} в компактной
+    бинарной записи (см. encode_entry). Все ключи чата живут idle_ttl
+    секунд с последней реплики.
+
+    Без token_budget хранит последние max_messages реплик. С token_budget
+    get() возвращает конспект ранних реплик и столько последних, сколько
+    влезает в бюджет. Когда сумма токенов списка превышает бюджет, старые
+    реплики в фоне сворачиваются в конспект (dialog:{chat_id}:summary)
+    и удаляются из списка.
+    """
+
+    def __init__(
+        self,
+        max_messages: int = 10,
+        token_budget: int | None = None,
+        idle_ttl: int | None = None,
+    ) -> None:
         self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.idle_ttl = idle_ttl if idle_ttl is not None else config.HISTORY_IDLE_TTL
+        self._summarizing: Dict[str, asyncio.Task] = {}
 
     def _key(self, chat_id: str) -> str:
         return f"dialog:{chat_id}"
 
+    def _summary_key(self, chat_id: str) -> str:
+        return f"dialog:{chat_id}:summary"
+
+    def _tokens_key(self, chat_id: str) -> str:
+        return f"dialog:{chat_id}:tokens"
+
+    async def _append(self, chat_id: str, messages: Sequence[Tuple[MessageRole, str]]) -> None:
+        entries, tokens = [], 0
+        for role, content in messages:
+            count = estimate_tokens(content)
+            entries.append(encode_entry(role, content, count))
+            tokens += count
+        # Без бюджета список режется по max_messages, с бюджетом — только
+        # страховочно: старое уходит в конспект.
+        cap = self.max_messages if self.token_budget is None else config.HISTORY_MAX_ENTRIES
+
+        redis = await get_redis_bytes()
+        script = redis.register_script(_APPEND_LUA)
+        total = await script(
+            keys=[self._key(chat_id), self._tokens_key(chat_id), self._summary_key(chat_id)],
+            args=[self.idle_ttl, cap, tokens, *entries],
+        )
+        if self.token_budget is not None and int(total) > self.token_budget:
+            self._schedule_summary(chat_id)
+
     async def add(self, chat_id: str, role: MessageRole, content: str) -> None:
-        redis = await get_redis()
-        entry = json.dumps({"role": role, "content": content}, ensure_ascii=False)
-        await redis.rpush(self._key(chat_id), entry)
-        await redis.ltrim(self._key(chat_id), -self.max_messages, -1)
+        await self._append(chat_id, [(role, content)])
+
+    async def add_turn(self, chat_id: str, user: str, assistant: str) -> None:
+        """
+        Записывает вопрос и ответ одним обращением к Redis.
+        """
+        await self._append(chat_id, [("user", user), ("assistant", assistant)])
 
+    @timed("history_read")
     async def get(self, chat_id: str) -> list[dict]:
-        redis = await get_redis()
-        raw_entries = await redis.lrange(self._key(chat_id), 0, -1)
+        redis = await get_redis_bytes()
+        if self.token_budget is None:
+            raw_entries = await redis.lrange(self._key(chat_id), -self.max_messages, -1)
+            return [{"role": role, "content": content} for role, content, _ in self._decode(raw_entries)]
+
+        pipe = redis.pipeline(transaction=False)
+        pipe.lrange(self._key(chat_id), -self.max_messages, -1)
+        pipe.get(self._summary_key(chat_id))
+        raw_entries, raw_summary = await pipe.execute()
+
+        budget = self.token_budget
         out: list[dict] = []
-        for raw in raw_entries:
-            try:
-                out.append(json.loads(raw))
-            except Exception:
-                continue
+        summary = self._load_summary(raw_summary)
+        if summary["text"]:
+            budget -= summary["tokens"]
+        recent: list[dict] = []
+        for role, content, tokens in reversed(self._decode(raw_entries)):
+            if tokens > budget:
+                break
+            budget -= tokens
+            recent.append({"role": role, "content": content})
+        if summary["text"]:
+            out.append({"role": "system", "content": SUMMARY_PREFIX + summary["text"]})
+        out.extend(reversed(recent))
         return out
 
     async def clear(self, chat_id: str) -> None:
-        redis = await get_redis()
-        await redis.delete(self._key(chat_id))
\ No newline at end of file
+        redis = await get_redis_bytes()
+        await redis.delete(self._key(chat_id), self._summary_key(chat_id), self._tokens_key(chat_id))
+
+    @staticmethod
+    def _decode(raw_entries: list[bytes]) -> list[Entry]:
+        return [entry for entry in map(decode_entry, raw_entries) if entry is not None]
+
+    @staticmethod
+    def _entry_tokens(raw: bytes) -> int:
+        entry = decode_entry(raw)
+        return entry[2] if entry is not None else 0
+
+    @staticmethod
+    def _load_summary(raw: bytes | None) -> dict:
+        if raw:
+            try:
+                return json.loads(raw)
+            except ValueError:
+                pass
+        return {"text": "", "tokens": 0}
+
+    def _schedule_summary(self, chat_id: str) -> None:
+        """
+        Запускает сворачивание истории в фоне, не больше одного на чат.
+        """
+        if chat_id in self._summarizing:
+            return
+        task = asyncio.create_task(self._summarize(chat_id))
+        self._summarizing[chat_id] = task
+        task.add_done_callback(lambda _: self._summarizing.pop(chat_id, None))
+
+    async def _summarize(self, chat_id: str) -> None:
+        try:
+            await self.compact(chat_id)
+        except Exception as e:
+            logger.warning("DialogHistory summary failed chat_id=%s: %s", chat_id, e)
+
+    @timed("history_summary")
+    async def compact(self, chat_id: str) -> bool:
+        """
+        Сворачивает старые реплики в конспект, оставляя последние
+        примерно на половину бюджета. Реплики, дописанные за время вызова
+        модели, не теряются: список меняется в транзакции с WATCH,
+        и если его начало изменилось, попытка отменяется.
+        """
+        assert self.token_budget is not None
+        redis = await get_redis_bytes()
+        key = self._key(chat_id)
+        pipe = redis.pipeline(transaction=False)
+        pipe.lrange(key, 0, -1)
+        pipe.get(self._summary_key(chat_id))
+        raw_entries, raw_summary = await pipe.execute()
+
+        keep_budget = self.token_budget // 2
+        kept_tokens, split = 0, len(raw_entries)
+        for raw in reversed(raw_entries):
+            tokens = self._entry_tokens(raw)
+            if kept_tokens + tokens > keep_budget:
+                break
+            kept_tokens += tokens
+            split -= 1
+        old_raw = raw_entries[:split]
+        if not old_raw:
+            # Счётчик разошёлся со списком (например, после обрезки по HISTORY_MAX_ENTRIES).
+            await redis.set(self._tokens_key(chat_id), kept_tokens, ex=self.idle_ttl or None)
+            return False
+
+        previous = self._load_summary(raw_summary)["text"]
+        text = await self._summarize_turns(previous, self._decode(old_raw))
+        if not text:
+            return False
+        summary = json.dumps({"text": text, "tokens": estimate_tokens(text)}, ensure_ascii=False)
+
+        async with redis.pipeline(transaction=True) as tx:
+            try:
+                await tx.watch(key)
+                current = await tx.lrange(key, 0, -1)
+                if current[:split] != old_raw:
+                    return False
+                remaining = sum(self._entry_tokens(raw) for raw in current[split:])
+                tx.multi()
+                ttl = self.idle_ttl or None
+                tx.set(self._summary_key(chat_id), summary, ex=ttl)
+                tx.ltrim(key, split, -1)
+                tx.set(self._tokens_key(chat_id), remaining, ex=ttl)
+                await tx.execute()
+            except WatchError:
+                return False
+        logger.info(
+            "DialogHistory compacted chat_id=%s turns=%d summary_tokens=%d",
+            chat_id, split, estimate_tokens(text),
+        )
+        return True
+
+    async def _summarize_turns(self, previous: str, entries: list[Entry]) -> str:
+        turns = "\n".join(
+            f"{'Пользователь' if role == 'user' else 'Бот'}: {content}"
+            for role, content, _ in entries
+        )
+        client = await ensure_openai_client()
+        resp = await client.responses.create(
+            model=config.HISTORY_SUMMARY_MODEL,
+            input=[
+                {
+                    "role": "system",
+                    "content": SUMMARY_SYSTEM_PROMPT.format(
+                        max_tokens=config.HISTORY_SUMMARY_MAX_TOKENS
+                    ),
+                },
+                {
+                    "role": "user",
+                    "content": f"Прежний конспект:\n{previous or '—'}\n\nНовые реплики:\n{turns}",
+                },
+            ],
+            max_output_tokens=config.HISTORY_SUMMARY_MAX_TOKENS * 2,
+        )
+        record_usage("history_summary", resp)
+        return resp.output_text.strip()
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from common.redis_client import get_redis
+from db.models.faq_entry import FAQEntry
+from db.session import async_session_maker
+from logger.config import get_logger
+from settings import config
+
+logger = get_logger(__name__)
+
+FAQ_UPDATES_CHANNEL = "faq:updated"
+_LISTEN_BACKOFF_MIN = 1.0
+_LISTEN_BACKOFF_MAX = 30.0
+
+_faq_index: FAQVectorIndex | None = None
+
+
+class FAQVectorIndex:
+    """
+    Векторный индекс FAQ в памяти процесса.
+    Эмбеддинги хранятся нормированной матрицей float32,
+    top-k считается одним умножением матрицы на вектор и argpartition.
+    Если записей больше max_rows — индекс выключается и поиск идёт через pgvector.
+    """
+
+    def __init__(self, max_rows: int | None = None) -> None:
+        self._max_rows = max_rows if max_rows is not None else config.FAQ_INMEMORY_MAX_ROWS
+        self._entries: List[FAQEntry] = []
+        self._matrix: np.ndarray | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._matrix is not None
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    async def reload(self) -> None:
+        """
+        Перечитывает faq_entries из БД; при ошибке оставляет прежние данные.
+        """
+        async with self._lock:
+            try:
+                async with async_session_maker() as session:
+                    total = await session.scalar(select(func.count()).select_from(FAQEntry))
+                    if total is None or total > self._max_rows:
+                        self._entries, self._matrix = [], None
+                        logger.info(
+                            "FAQVectorIndex disabled rows=%s max_rows=%d, using pgvector",
+                            total,
+                            self._max_rows,
+                        )
+                        return
+                    result = await session.execute(
+                        select(FAQEntry.id, FAQEntry.question, FAQEntry.answer, FAQEntry.embedding)
+                        .order_by(FAQEntry.id)
+                    )
+                    rows = result.all()
+            except Exception as e:
+                logger.error("FAQVectorIndex reload failed", exc_info=e)
+                return
+
+            entries = [FAQEntry(id=r[0], question=r[1], answer=r[2]) for r in rows]
+            if rows:
+                matrix = np.asarray([np.asarray(r[3], dtype=np.float32) for r in rows])
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                matrix = matrix / norms
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+
+            self._entries, self._matrix = entries, matrix
+            logger.info("FAQVectorIndex loaded rows=%d", len(entries))
+
+    def search(self, embedding: Sequence[float], top_n: int) -> List[Tuple[FAQEntry, float]]:
+        """
+        Возвращает топ-N записей FAQ и их cosine similarity.
+        """
+        matrix = self._matrix
+        if matrix is None or not len(self._entries):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm:
+            query = query / norm
+        scores = matrix @ query
+
+        k = min(top_n, len(scores))
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(self._entries[i], float(scores[i])) for i in top]
+
+
+async def init_faq_index() -> FAQVectorIndex:
+    """
+    Создаёт и загружает индекс FAQ (один на процесс).
+    """
+    global _faq_index
+    if _faq_index is None:
+        _faq_index = FAQVectorIndex()
+        await _faq_index.reload()
+    return _faq_index
+
+
+def get_faq_index() -> FAQVectorIndex | None:
+    """
+    Возвращает загруженный индекс или None, если он выключен или не создан.
+    """
+    if _faq_index is not None and _faq_index.ready:
+        return _faq_index
+    return None
+
+
+def set_faq_index(index: FAQVectorIndex | None) -> None:
+    global _faq_index
+    _faq_index = index
+
+
+async def publish_faq_updated() -> None:
+    """
+    Сообщает всем процессам, что FAQ изменился и индекс нужно перечитать.
+    """
+    redis = await get_redis()
+    await redis.publish(FAQ_UPDATES_CHANNEL, "1")
+
+
+async def _listen_once(index: FAQVectorIndex, resubscribed: bool) -> None:
+    redis = await get_redis()
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(FAQ_UPDATES_CHANNEL)
+    try:
+        if resubscribed:
+            # Пока соединения не было, обновления могли пройти мимо.
+            await index.reload()
+        async for message in pubsub.listen():
+            if message.get("type") == "message":
+                logger.info("FAQ updated, reloading index")
+                try:
+                    await index.reload()
+                except Exception as e:
+                    logger.error("FAQ index reload failed", exc_info=e)
+    finally:
+        await pubsub.aclose()
+
+
+async def listen_faq_updates(index: FAQVectorIndex) -> None:
+    """
+    Слушает канал обновлений FAQ и перезагружает индекс. При обрыве
+    соединения с Redis переподключается с экспоненциальной задержкой
+    и после переподключения перечитывает индекс.
+    """
+    delay = _LISTEN_BACKOFF_MIN
+    resubscribed = False
+    while True:
+        started = time.monotonic()
+        try:
+            await _listen_once(index, resubscribed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("FAQ updates listener failed, reconnecting in %.0f s", delay, exc_info=e)
+        if time.monotonic() - started > _LISTEN_BACKOFF_MAX:
+            delay = _LISTEN_BACKOFF_MIN
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _LISTEN_BACKOFF_MAX)
+        resubscribed = True
@@ -2,14 +2,16 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Tuple
 
-from sqlalchemy import select, func, cast
+from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from pgvector.sqlalchemy import Vector
 
 from db.models.faq_entry import FAQEntry
-from common.openai_client import ensure_openai_client
+from db.session import async_session_maker
+from apps.knowledge_base.services.faq_index import FAQVectorIndex, get_faq_index
+from common.embeddings import get_embedding
+from common.metrics import timed
+from settings import config
 
-_EMBEDDING_MODEL = "text-embedding-3-small"
 _faq_search_cached: FAQSearch | None = None
 
 
@@ -18,47 +20,83 @@ class FAQSearch:
     Семантический поиск по FAQ с приоритетом на точное совпадение.
     Если близость > threshold → возвращается только один результат,
     иначе — топ-N похожих.
+    Если загружен индекс в памяти — ищет по нему, иначе через pgvector.
+    Без переданной сессии открывает короткую сессию на каждый запрос к БД,
+    поэтому один экземпляр можно переиспользовать между сообщениями.
     """
 
-    def __init__(self, session: AsyncSession, threshold: float = 0.9) -> None:
+    def __init__(
+        self,
+        session: AsyncSession | None = None,
+        threshold: float = 0.9,
+        index: FAQVectorIndex | None = None,
+    ) -> None:
         self._session = session
         self._threshold = threshold
+        self._index = index
 
-    async def _embed(self, text: str) -> list[float]:
+    async def embed(self, text: str) -> list[float]:
         """
-        Возвращает эмбеддинг текста фиксированной длины 1536.
+        Возвращает эмбеддинг текста фиксированной длины 1536 (через общий кеш).
         """
-        client = await ensure_openai_client()
-        resp = await client.embeddings.create(
-            model=_EMBEDDING_MODEL,
-            input=text or "",
+        return await get_embedding(text or "")
+
+    @staticmethod
+    async def _apply_search_params(session: AsyncSession) -> None:
+        """
+        Задаёт параметры ANN-поиска (HNSW / IVFFlat) на текущую транзакцию.
+        """
+        await session.execute(
+            text(
+                "SELECT set_config('hnsw.ef_search', :ef_search, true), "
+                "set_config('ivfflat.probes', :probes, true)"
+            ),
+            {
+                "ef_search": str(config.FAQ_HNSW_EF_SEARCH),
+                "probes": str(config.FAQ_IVFFLAT_PROBES),
+            },
         )
-        return resp.data[0].embedding
 
+    @timed("vector_search")
     async def _search_similar(
         self, embedding: list[float], top_n: int
     ) -> List[Tuple[FAQEntry, float]]:
         """
         Возвращает топ-N FAQ + их similarity score.
         """
-        stmt = (
-            select(
-                FAQEntry,
-                1 - func.cosine_distance(FAQEntry.embedding, cast(embedding, Vector)).label("score"),
-            )
-            .order_by(func.cosine_distance(FAQEntry.embedding, cast(embedding, Vector)))
-            .limit(top_n)
-        )
-        result = await self._session.execute(stmt)
-        return [(row[0], row[1]) for row in result.all()]
+        index = self._index or get_faq_index()
+        if index is not None:
+            return index.search(embedding, top_n)
+
+        if self._session is not None:
+            return await self._search_db(self._session, embedding, top_n)
+        async with async_session_maker() as session:
+            return await self._search_db(session, embedding, top_n)
 
-    async def top_faq_json(self, user_message: str, *, top_n: int = 3) -> Dict[str, Any]:
+    async def _search_db(
+        self, session: AsyncSession, embedding: list[float], top_n: int
+    ) -> List[Tuple[FAQEntry, float]]:
+        await self._apply_search_params(session)
+        distance = FAQEntry.embedding.cosine_distance(embedding).label("distance")
+        stmt = select(FAQEntry, distance).order_by(distance).limit(top_n)
+        result = await session.execute(stmt)
+        return [(row[0], 1 - row[1]) for row in result.all()]
+
+    async def top_faq_json(
+        self,
+        user_message: str,
+        *,
+        top_n: int = 3,
+        embedding: list[float] | None = None,
+    ) -> Dict[str, Any]:
         """
         Возвращает JSON: если есть очень близкий матч — только его,
         иначе — топ-N похожих вопросов и ответов.
+        В "top_ids" — id найденных записей (первый — наиболее близкий).
         """
-        emb = await self._embed(user_message)
+        emb = embedding if embedding is not None else await self.embed(user_message)
         rows = await self._search_similar(emb, top_n)
+        top_ids = [r[0].id for r in rows]
 
         if rows and rows[0][1] >= self._threshold:
             top = rows[0][0]
@@ -66,12 +104,14 @@ class FAQSearch:
                 "exact_match": {
                     "question": top.question,
                     "answer": top.answer,
-                }
+                },
+                "top_ids": top_ids[:1],
             }
 
         return {
             "top_questions": [r[0].question for r in rows],
             "top_answers": [r[0].answer for r in rows],
+            "top_ids": top_ids,
         }
 
 
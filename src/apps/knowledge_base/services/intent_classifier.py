@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from apps.knowledge_base.services.device_matcher import DeviceMatch
+from apps.knowledge_base.services.device_search import (
+    DeviceSelector,
+    get_device_selector_cached,
+)
+from utils.text import normalize
+
+INTENTS = ("FAQ", "Device", "Specs", "Other")
+
+# Размеченные примеры из промпта IntentRouter: обучающая выборка
+# локальной модели и основа офлайн-оценки (benchmarks/intent_eval.py).
+INTENT_EXAMPLES: Tuple[Tuple[str, str], ...] = (
+    ("Модель zoom okko, на экране отображаются знаки ограничения скорости", "FAQ"),
+    ("Как обновить прошивку на pro max?", "FAQ"),
+    ("Почему не включается fujida?", "FAQ"),
+    ("Что такое режим СМАРТ?", "FAQ"),
+    ("Как работает фильтр скорости?", "FAQ"),
+    ("Подробное описание функций всех устройств", "FAQ"),
+    ("Какое устройство комбо самое лучшее?", "FAQ"),
+    ("Устройство с самой лучшей камерой", "FAQ"),
+    ("самый лучший регистратор", "FAQ"),
+    ("Где купить Fujida?", "FAQ"),
+    ("Дай ссылку на озон где купить ваше комба", "FAQ"),
+    ("Сколько стоит про макс?", "FAQ"),
+    ("Цена zoom okko", "FAQ"),
+    ("Какая модель лучше, про с или про макс?", "Device"),
+    ("сравни карму про и про макс", "Device"),
+    ("Подскажите характеристики karma one", "Device"),
+    ("Есть ли WiFi в karma bliss?", "Device"),
+    ("zoom hit max или smart se — что лучше?", "Device"),
+    ("У каких моделей есть вайфай?", "Specs"),
+    ("Все устройства с GPS", "Specs"),
+    ("У каких моделей есть CPL-фильтр?", "Specs"),
+    ("Какие устройства поддерживают карту памяти 128 ГБ?", "Specs"),
+    ("У каких моделей экран больше 3 дюймов?", "Specs"),
+    ("Где купить машину?", "Other"),
+    ("Спасибо большое!", "Other"),
+)
+
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+
+# Основы слов привязаны к началу слова (\b): «цен\w*» не должно находиться
+# внутри «оцените».
+
+_SUPPORT_RE = re.compile(
+    r"\b(?:прошив\w*|обнов\w*|не\s+(?:включ|работа|вкл|загруж|вид|пиш|запис|лов|сохран|реагир)\w*|"
+    r"выключа\w*|перезагру\w*|завис\w*|слома\w*|неисправ\w*|ошибк\w*|гаранти\w*|ремонт\w*|"
+    r"сервис\w*|поддержк\w*|техподдерж\w*|сброс\w*|настро\w*|отображ\w*|глюч\w*|брак\w*|"
+    r"возврат\w*|инструкц\w*|firmware|update)"
+)
+_EXPLAIN_RE = re.compile(
+    r"\b(?:что\s+(?:такое|значит|означает)|для\s+чего|зачем\s+нуж\w*|как\s+работа\w*|"
+    r"подробн\w*\s+описан\w*|описани\w*\s+функц\w*|горизонтальн\w*\s+или\s+диагональн\w*)"
+)
+_SHOP_RE = re.compile(
+    r"\b(?:купить|куплю|цен\w*|сколько\s+стои\w*|стоимост\w*|магазин\w*|озон\w*|ozon|"
+    r"wildberries|вайлдберр\w*|маркетплейс\w*|заказ\w*|доставк\w*|скидк\w*)"
+)
+_SUPERLATIVE_RE = re.compile(
+    r"\b(?:сам\w+\s+(?:лучш|топ|дальнобойн|хорош|мощн|нов|дешев|дорог)\w*|лучш\w*|топов\w*|дальнобойн\w*)"
+)
+_SPECS_RE = re.compile(
+    r"\b(?:(?:у|в)\s+как\w+\s+(?:модел|устройств|регистратор|радар|комбо|девайс)\w*|"
+    r"(?:все|какие)\s+(?:модели|устройства|регистраторы|радар\w*|комбо|девайсы)\s+"
+    r"(?:с|со|без|поддержива\w*|име\w*|есть|умеют|подход\w*)\b|"
+    r"(?:модели|устройства|регистраторы)\s+(?:с|со)\s)"
+)
+_PRODUCT_RE = re.compile(
+    r"\b(?:fujida|фудзида|фуджида|фуджиду|фудзиду|регистратор\w*|радар\w*|комбо|комба|"
+    r"устройств\w*|модел\w*|девайс\w*)"
+)
+_SMALLTALK_RE = re.compile(
+    r"^(?:спасибо|благодар\w*|привет\w*|здравствуй\w*|добрый\s+\w+|доброе\s+\w+|пока|"
+    r"ок|окей|хорошо|понятно|ясно|отлично|супер)\b"
+)
+
+
+def _prepare(text: str) -> str:
+    return normalize(_PUNCT_RE.sub(" ", text or ""))
+
+
+@dataclass(frozen=True)
+class IntentPrediction:
+    intent: str
+    confidence: float
+    source: str
+
+
+class CharNgramCentroids:
+    """
+    Nearest-centroid классификатор над TF-IDF символьных n-грамм.
+    Центроиды классов считаются один раз; предсказание — косинус
+    с каждым центроидом и softmax по ним как оценка уверенности.
+    """
+
+    def __init__(
+        self,
+        examples: Iterable[Tuple[str, str]],
+        ngram_range: Tuple[int, int] = (2, 4),
+        temperature: float = 0.1,
+    ) -> None:
+        self._ngram_range = ngram_range
+        self._temperature = temperature
+
+        docs = [(self._ngrams(text), label) for text, label in examples]
+        df: Counter[str] = Counter()
+        for grams, _ in docs:
+            df.update(grams.keys())
+        total = len(docs)
+        self._idf = {g: math.log((1 + total) / (1 + n)) + 1.0 for g, n in df.items()}
+
+        sums: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for grams, label in docs:
+            for g, w in self._vector(grams).items():
+                sums[label][g] += w
+        self._centroids = {label: self._normalized(vec) for label, vec in sums.items()}
+
+    def _ngrams(self, text: str) -> Counter[str]:
+        lo, hi = self._ngram_range
+        grams: Counter[str] = Counter()
+        for word in _prepare(text).split():
+            padded = f" {word} "
+            for n in range(lo, hi + 1):
+                for i in range(len(padded) - n + 1):
+                    grams[padded[i:i + n]] += 1
+        return grams
+
+    def _vector(self, grams: Counter[str]) -> Dict[str, float]:
+        vec = {
+            g: (1.0 + math.log(c)) * self._idf[g]
+            for g, c in grams.items()
+            if g in self._idf
+        }
+        return self._normalized(vec)
+
+    @staticmethod
+    def _normalized(vec: Dict[str, float]) -> Dict[str, float]:
+        norm = math.sqrt(sum(w * w for w in vec.values()))
+        if not norm:
+            return dict(vec)
+        return {g: w / norm for g, w in vec.items()}
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """
+        Косинусная близость текста к центроиду каждого класса.
+        """
+        vec = self._vector(self._ngrams(text))
+        return {
+            label: sum(w * centroid.get(g, 0.0) for g, w in vec.items())
+            for label, centroid in self._centroids.items()
+        }
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        scores = self.scores(text)
+        if not scores:
+            return "Other", 0.0
+        top = max(scores.values())
+        exps = {k: math.exp((v - top) / self._temperature) for k, v in scores.items()}
+        total = sum(exps.values())
+        label = max(scores, key=scores.get)
+        return label, exps[label] / total
+
+
+class LocalIntentClassifier:
+    """
+    Локальный классификатор намерений без обращения к LLM.
+
+    Сначала правила (слова поддержки и прошивок → FAQ, упоминание модели → Device,
+    «у каких моделей …» → Specs), затем nearest-centroid по символьным n-граммам.
+    Уверенность ниже порога в IntentRouter означает фолбэк на LLM.
+    """
+
+    def __init__(
+        self,
+        examples: Optional[Sequence[Tuple[str, str]]] = None,
+        device_match: Optional[Callable[[str], DeviceMatch]] = None,
+        min_device_confidence: float = 0.85,
+    ) -> None:
+        self._model = CharNgramCentroids(examples if examples is not None else INTENT_EXAMPLES)
+        self._device_match = device_match
+        self._own_selector: DeviceSelector | None = None
+        self._min_device_confidence = min_device_confidence
+
+    def _mentions_device(self, user_message: str) -> bool:
+        if self._device_match is not None:
+            match = self._device_match(user_message)
+        else:
+            selector = get_device_selector_cached()
+            if selector is None:
+                if self._own_selector is None:
+                    self._own_selector = DeviceSelector()
+                selector = self._own_selector
+            match = selector.match(user_message)
+        return bool(match.device_ids) and match.confidence >= self._min_device_confidence
+
+    def rules(self, user_message: str) -> Optional[IntentPrediction]:
+        """
+        Правила в порядке приоритетов промпта IntentRouter.
+        Возвращает None, если ни одно правило не сработало.
+        """
+        text = _prepare(user_message)
+        if not text:
+            return IntentPrediction("Other", 1.0, "rules")
+
+        if _SUPPORT_RE.search(text):
+            return IntentPrediction("FAQ", 0.95, "rules")
+
+        has_device = self._mentions_device(user_message)
+        if _SHOP_RE.search(text):
+            if has_device or _PRODUCT_RE.search(text):
+                return IntentPrediction("FAQ", 0.9, "rules")
+            # «Где купить машину?» — покупка не нашей продукции; решает LLM.
+            return IntentPrediction("Other", 0.6, "rules")
+        if _EXPLAIN_RE.search(text):
+            return IntentPrediction("FAQ", 0.9, "rules")
+        if has_device:
+            return IntentPrediction("Device", 0.9, "rules")
+        if _SPECS_RE.search(text):
+            return IntentPrediction("Specs", 0.9, "rules")
+        if _SUPERLATIVE_RE.search(text) and _PRODUCT_RE.search(text):
+            return IntentPrediction("FAQ", 0.85, "rules")
+        if _SMALLTALK_RE.search(text) and len(text.split()) <= 4:
+            return IntentPrediction("Other", 0.85, "rules")
+        return None
+
+    def model_predict(self, user_message: str) -> Tuple[str, float]:
+        """
+        Только n-граммная модель, без правил.
+        """
+        return self._model.predict(user_message)
+
+    def classify(self, user_message: str) -> IntentPrediction:
+        prediction = self.rules(user_message)
+        if prediction is not None:
+            return prediction
+        intent, confidence = self.model_predict(user_message)
+        return IntentPrediction(intent, confidence, "model")
@@ -0,0 +1,559 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Set, Tuple
+
+from apps.knowledge_base.services.device_catalog import DeviceCatalog, get_device_catalog
+from common.metrics import timed
+from logger.config import get_logger
+from utils.text import normalize
+
+logger = get_logger(__name__)
+
+ColumnKind = Literal["bool", "number", "enum", "text"]
+Op = Literal["eq", "gt", "gte", "lt", "lte", "contains"]
+
+_SKIP_KEYS = {"id", "название_модели", "алиасы", "ссылка", "модель"}
+_ENUM_MAX_DISTINCT = 12
+_ENUM_MAX_LEN = 60
+
+_specs_search_cached: SpecsSearch | None = None
+
+
+@dataclass(frozen=True)
+class SpecCondition:
+    column: str
+    op: Op
+    value: Any
+
+
+@dataclass(frozen=True)
+class SpecAttribute:
+    """
+    Каноническая характеристика: колонка индекса, тип и способ вычисления.
+    """
+
+    name: str
+    kind: ColumnKind
+    title: str
+    extract: Callable[[Dict[str, Any]], Any]
+
+
+def _flatten(obj: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """
+    Разворачивает вложенные секции в плоские колонки вида «секция.ключ».
+    """
+    out: Dict[str, Any] = {}
+    for key, value in obj.items():
+        if key in _SKIP_KEYS:
+            continue
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(_flatten(value, path))
+        elif value not in (None, "", []):
+            out[path] = value
+    return out
+
+
+def _as_text(value: Any) -> str:
+    if isinstance(value, list):
+        return normalize(" ".join(str(v) for v in value))
+    return normalize(str(value))
+
+
+def _first(flat: Dict[str, Any], *suffixes: str) -> Any:
+    for path, value in flat.items():
+        if path.endswith(suffixes):
+            return value
+    return None
+
+
+def _has(flat: Dict[str, Any], *suffixes: str) -> bool | None:
+    """
+    Булево значение поля: bool как есть, строка «Есть…» → True.
+    """
+    value = _first(flat, *suffixes)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return value
+    text = _as_text(value)
+    return not text.startswith(("нет", "false", "отсутств"))
+
+
+def _all_text(flat: Dict[str, Any]) -> str:
+    return " ".join(_as_text(v) for v in flat.values())
+
+
+def _number(pattern: str, text: str | None, *, pick: Callable[[Iterable[float]], float] = max) -> float | None:
+    if not text:
+        return None
+    found = [float(m.replace(",", ".")) for m in re.findall(pattern, text)]
+    return pick(found) if found else None
+
+
+def _screen(flat: Dict[str, Any]) -> float | None:
+    screen = _first(flat, "общие_параметры.экран")
+    return _number(r"^(\d+(?:[.,]\d+)?)", _as_text(screen) if screen else None, pick=lambda x: next(iter(x)))
+
+
+def _resolutions(flat: Dict[str, Any]) -> str:
+    parts = [
+        _as_text(v)
+        for path, v in flat.items()
+        if path.startswith("видеозапись.основная_камера.разрешени")
+    ]
+    return " ".join(parts)
+
+
+def _display(flat: Dict[str, Any]) -> str:
+    return _as_text(_first(flat, ".экран", ".дисплей") or "")
+
+
+def _auto_brightness(flat: Dict[str, Any]) -> bool:
+    text = _display(flat)
+    if "без автояркости" in text:
+        return False
+    return "автояркост" in text or "автоматической регулировки" in text
+
+
+def _lna(flat: Dict[str, Any]) -> bool:
+    missing = _as_text(_first(flat, ".отсутствуют_функции") or "")
+    return "lna" in _all_text(flat) and "lna" not in missing
+
+
+ATTRIBUTES: Tuple[SpecAttribute, ...] = (
+    SpecAttribute("wifi", "bool", "Wi-Fi", lambda f: bool(_has(f, ".wifi"))),
+    SpecAttribute("gps", "bool", "GPS/ГЛОНАСС", lambda f: bool(_has(f, ".gps_glonass"))),
+    SpecAttribute(
+        "радар",
+        "bool",
+        "Радар-детектор",
+        lambda f: any(p.startswith(("радар_детектор_gps.", "радарные_функции.")) for p in f),
+    ),
+    SpecAttribute(
+        "вторая_камера",
+        "bool",
+        "Дополнительная камера в комплекте",
+        lambda f: bool(_has(f, "дополнительная_камера.в_комплекте")),
+    ),
+    SpecAttribute("cpl_фильтр", "bool", "CPL-фильтр", lambda f: bool(_has(f, ".cpl_фильтр"))),
+    SpecAttribute("hdr", "bool", "HDR/WDR", lambda f: bool(_has(f, ".hdr_wdr"))),
+    SpecAttribute(
+        "ai_знаки",
+        "bool",
+        "AI-распознавание дорожных знаков",
+        lambda f: bool(_has(f, ".ai_распознавание_знаков")),
+    ),
+    SpecAttribute("датчик_движения", "bool", "Датчик движения", lambda f: bool(_has(f, "функции_датчики.датчик_движения"))),
+    SpecAttribute(
+        "магнитное_крепление",
+        "bool",
+        "Магнитное крепление",
+        lambda f: "магнитн" in _as_text(_first(f, ".крепление") or ""),
+    ),
+    SpecAttribute("автояркость", "bool", "Автояркость экрана", _auto_brightness),
+    SpecAttribute("oled", "bool", "OLED-дисплей", lambda f: "oled" in _display(f)),
+    SpecAttribute("суперконденсатор", "bool", "Суперконденсатор", lambda f: "суперконденсатор" in _as_text(_first(f, ".питание") or "")),
+    SpecAttribute("lna", "bool", "LNA-усилитель", _lna),
+    SpecAttribute("формат_зеркала", "bool", "Формат зеркала", lambda f: "зеркал" in _as_text(_first(f, "тип_устройства") or "")),
+    SpecAttribute("в_продаже", "bool", "В продаже", lambda f: _first(f, "статус") is None),
+    SpecAttribute("диагональ_экрана", "number", "Диагональ экрана, дюймы", _screen),
+    SpecAttribute("угол_обзора", "number", "Угол обзора, градусы", lambda f: _first(f, "общие_параметры.угол_обзора_градусы")),
+    SpecAttribute(
+        "microsd_гб",
+        "number",
+        "Максимальный объём microSD, ГБ",
+        lambda f: _number(r"(\d+)\s*гб", _as_text(_first(f, ".карта_памяти") or "")),
+    ),
+    SpecAttribute("гарантия_лет", "number", "Гарантия, лет", lambda f: _first(f, ".гарантия_годы")),
+    SpecAttribute(
+        "разрешение_p",
+        "number",
+        "Максимальное разрешение (строк)",
+        lambda f: _number(r"\d{3,4}x(\d{3,4})", _resolutions(f)),
+    ),
+    SpecAttribute("fps", "number", "Максимальная частота кадров", lambda f: _number(r"(\d+) fps", _resolutions(f))),
+    SpecAttribute("тип_устройства", "enum", "Тип устройства", lambda f: _first(f, "тип_устройства")),
+    SpecAttribute("разъем_питания", "enum", "Разъём питания", lambda f: _first(f, ".разъем_питания")),
+    SpecAttribute("базы_камер", "enum", "Базы камер", lambda f: _first(f, ".базы_камер")),
+    SpecAttribute("диапазоны", "enum", "Диапазоны радара", lambda f: _first(f, ".диапазоны")),
+)
+_ATTRS_BY_NAME = {a.name: a for a in ATTRIBUTES}
+
+
+class SpecsIndex:
+    """
+    Колоночный индекс характеристик устройств.
+    bool/enum — инвертированные индексы, числа — отсортированные массивы.
+    """
+
+    def __init__(self, devices: Iterable[dict[str, Any]]) -> None:
+        self._order: Dict[str, int] = {}
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self.kinds: Dict[str, ColumnKind] = {}
+
+        raw_rows: Dict[str, Dict[str, Any]] = {}
+        for idx, d in enumerate(devices):
+            self._order[d["id"]] = idx
+            raw_rows[d["id"]] = _flatten(d)
+
+        for device_id, flat in raw_rows.items():
+            row = dict(flat)
+            for attr in ATTRIBUTES:
+                value = attr.extract(flat)
+                if value is not None:
+                    row[attr.name] = value
+            self._rows[device_id] = row
+
+        self._infer_kinds(raw_rows)
+        self._bool: Dict[str, Dict[bool, Set[str]]] = {}
+        self._enum: Dict[str, Dict[str, Set[str]]] = {}
+        self._numeric: Dict[str, Tuple[List[float], List[str]]] = {}
+        self._text: Dict[str, Dict[str, str]] = {}
+        self._build()
+
+    def _infer_kinds(self, raw_rows: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Определяет тип каждой сырой колонки по всем значениям.
+        """
+        values: Dict[str, List[Any]] = {}
+        for flat in raw_rows.values():
+            for path, value in flat.items():
+                values.setdefault(path, []).append(value)
+
+        for path, vals in values.items():
+            if all(isinstance(v, bool) for v in vals):
+                kind: ColumnKind = "bool"
+            elif all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in vals):
+                kind = "number"
+            elif all(isinstance(v, list) for v in vals) or (
+                all(isinstance(v, str) for v in vals)
+                and len(set(vals)) <= _ENUM_MAX_DISTINCT
+                and max(len(v) for v in vals) <= _ENUM_MAX_LEN
+            ):
+                kind = "enum"
+            else:
+                kind = "text"
+            self.kinds[path] = kind
+
+        for attr in ATTRIBUTES:
+            self.kinds[attr.name] = attr.kind
+
+    def _build(self) -> None:
+        numeric: Dict[str, List[Tuple[float, str]]] = {}
+        for device_id, row in self._rows.items():
+            for column, value in row.items():
+                kind = self.kinds.get(column, "text")
+                if kind == "bool":
+                    self._bool.setdefault(column, {True: set(), False: set()})[bool(value)].add(device_id)
+                elif kind == "number":
+                    numeric.setdefault(column, []).append((float(value), device_id))
+                elif kind == "enum":
+                    items = value if isinstance(value, list) else [value]
+                    bucket = self._enum.setdefault(column, {})
+                    for item in items:
+                        bucket.setdefault(normalize(str(item)), set()).add(device_id)
+                else:
+                    self._text.setdefault(column, {})[device_id] = _as_text(value)
+
+        for column, pairs in numeric.items():
+            pairs.sort()
+            self._numeric[column] = ([p[0] for p in pairs], [p[1] for p in pairs])
+
+    def _match(self, cond: SpecCondition) -> Set[str]:
+        kind = self.kinds.get(cond.column)
+        if kind == "bool":
+            return set(self._bool.get(cond.column, {}).get(bool(cond.value), set()))
+
+        if kind == "number":
+            values, ids = self._numeric.get(cond.column, ([], []))
+            x = float(cond.value)
+            if cond.op == "gt":
+                lo, hi = bisect_right(values, x), len(values)
+            elif cond.op == "gte":
+                lo, hi = bisect_left(values, x), len(values)
+            elif cond.op == "lt":
+                lo, hi = 0, bisect_left(values, x)
+            elif cond.op == "lte":
+                lo, hi = 0, bisect_right(values, x)
+            else:
+                lo, hi = bisect_left(values, x), bisect_right(values, x)
+            return set(ids[lo:hi])
+
+        if kind == "enum":
+            bucket = self._enum.get(cond.column, {})
+            needle = normalize(str(cond.value))
+            if cond.op == "contains":
+                out: Set[str] = set()
+                for value, ids in bucket.items():
+                    if needle in value:
+                        out |= ids
+                return out
+            return set(bucket.get(needle, set()))
+
+        needle = normalize(str(cond.value))
+        return {i for i, text in self._text.get(cond.column, {}).items() if needle in text}
+
+    def query(self, conditions: Iterable[SpecCondition]) -> List[str]:
+        """
+        Возвращает id устройств, удовлетворяющих всем условиям (в порядке каталога).
+        """
+        result: Set[str] | None = None
+        for cond in conditions:
+            matched = self._match(cond)
+            result = matched if result is None else result & matched
+            if not result:
+                return []
+        if result is None:
+            return []
+        return sorted(result, key=self._order.__getitem__)
+
+    def value(self, device_id: str, column: str) -> Any:
+        return self._rows.get(device_id, {}).get(column)
+
+
+_NEGATION = r"(?:без|нет|не\s+поддержива\w*|отсутству\w*)\s+(?:\w+\s+)?"
+
+_BOOL_PATTERNS: Tuple[Tuple[str, str], ...] = (
+    ("wifi", r"wi\s?fi|вай\s?фа[йя]|вайфа[йя]"),
+    ("gps", r"gps|глонасс|жпс|джипиэс"),
+    ("радар", r"радар|антирадар"),
+    ("вторая_камера", r"(?:втор\w*|дополнительн\w*|задн\w*)\s+камер\w*|дв[ея]\s+камер\w*|двухканальн\w*|duo|дуо"),
+    ("cpl_фильтр", r"cpl|цпл|поляризац\w*"),
+    ("hdr", r"hdr|wdr"),
+    ("ai_знаки", r"\bai\b|\bии\b|распознавани\w*\s+(?:дорожных\s+)?знак\w*"),
+    ("датчик_движения", r"датчик\w*\s+движени\w*"),
+    ("магнитное_крепление", r"магнит\w*"),
+    ("автояркость", r"автояркост\w*|автоматическ\w*\s+(?:регулировк\w*\s+)?яркост\w*"),
+    ("oled", r"oled|олед"),
+    ("суперконденсатор", r"суперконденсатор\w*|ионистор\w*"),
+    ("lna", r"lna"),
+    ("формат_зеркала", r"зеркал\w*"),
+    ("в_продаже", r"в\s+продаже|в\s+наличии|актуальн\w*"),
+)
+
+_NUMERIC_PATTERNS: Tuple[Tuple[str, str, Op], ...] = (
+    ("диагональ_экрана", r"экран\w*|диагонал\w*|диспле\w*|дюйм\w*", "eq"),
+    ("угол_обзора", r"угол\w*\s+обзора|обзор\w*", "gte"),
+    ("microsd_гб", r"карт\w*\s+памяти|microsd|micro\s+sd|флешк\w*|sd\s+карт\w*", "gte"),
+    ("гарантия_лет", r"гаранти\w*", "gte"),
+    ("fps", r"fps|кадр\w*", "gte"),
+)
+
+_RESOLUTION_PATTERNS: Tuple[Tuple[str, float], ...] = (
+    (r"4k|4к|ultra\s+hd|2160", 2160),
+    (r"2k|2к|quad\s+hd|qhd|1440", 1440),
+    (r"super\s+hd|1296", 1296),
+    (r"full\s+hd|1080", 1080),
+)
+
+_ENUM_PATTERNS: Tuple[Tuple[str, str, Op, str], ...] = (
+    (r"type\s?c|тайп\s?си|usb\s?c", "разъем_питания", "eq", "type c"),
+    (r"micro\s?usb|микро\s?usb", "разъем_питания", "eq", "micro usb"),
+    (r"mini\s?usb|мини\s?usb", "разъем_питания", "eq", "mini usb"),
+    (r"комбо\w*", "тип_устройства", "contains", "комбо"),
+    (r"европ\w*", "базы_камер", "eq", "европа"),
+    (r"\bka\b|ка[\s-]?диапазон\w*", "диапазоны", "eq", "ka"),
+)
+
+_CMP_RE = re.compile(
+    r"(?P<cmp>больше|более|свыше|выше|не\s+менее|от|меньше|менее|ниже|не\s+более|до|>=|<=|>|<)?"
+    r"\s*(?P<num>\d+(?:[.,]\d+)?)"
+)
+_CMP_OPS: Dict[str, Op] = {
+    "больше": "gt",
+    "более": "gt",
+    "свыше": "gt",
+    "выше": "gt",
+    ">": "gt",
+    "не менее": "gte",
+    "от": "gte",
+    ">=": "gte",
+    "меньше": "lt",
+    "менее": "lt",
+    "ниже": "lt",
+    "<": "lt",
+    "не более": "lte",
+    "до": "lte",
+    "<=": "lte",
+}
+_NUMBER_WINDOW = 40
+_LOWER_OPS = {"gt", "gte"}
+_UPPER_OPS = {"lt", "lte"}
+
+
+def _negated(text: str, start: int) -> bool:
+    return re.search(_NEGATION + r"$", text[max(0, start - 30):start]) is not None
+
+
+def _cmp_op(num: re.Match, default_op: Op) -> Op:
+    return _CMP_OPS.get(" ".join((num.group("cmp") or "").split()), default_op)
+
+
+def _cmp_value(num: re.Match) -> float:
+    return float(num.group("num").replace(",", "."))
+
+
+def _range_end(num: re.Match, rest: str, default_op: Op) -> re.Match | None:
+    """
+    Верхняя граница диапазона «от 3 до 4»: число с «до»/«меньше»
+    сразу после нижней границы.
+    """
+    if _cmp_op(num, default_op) not in _LOWER_OPS:
+        return None
+    stripped = rest.lstrip(" ,")
+    upper = _CMP_RE.match(stripped)
+    if upper is None or not upper.group("cmp") or _cmp_op(upper, default_op) not in _UPPER_OPS:
+        return None
+    return upper
+
+
+def parse_specs_query(user_message: str) -> List[SpecCondition]:
+    """
+    Разбирает запрос вида «у каких моделей есть WiFi / экран больше 3 дюймов»
+    в список условий по колонкам индекса.
+    """
+    text = normalize(re.sub(r"[^\w\s.,<>=-]+", " ", user_message or ""))
+    conditions: List[SpecCondition] = []
+
+    for column, pattern in _BOOL_PATTERNS:
+        m = re.search(rf"(?<!\w)(?:{pattern})", text)
+        if m:
+            conditions.append(SpecCondition(column, "eq", not _negated(text, m.start())))
+
+    for column, pattern, default_op in _NUMERIC_PATTERNS:
+        m = re.search(rf"(?<!\w)(?:{pattern})", text)
+        if not m:
+            continue
+        window = text[m.end():m.end() + _NUMBER_WINDOW]
+        num = _CMP_RE.search(window)
+        upper = _range_end(num, window[num.end():], default_op) if num else None
+        if num is None:
+            window = text[max(0, m.start() - _NUMBER_WINDOW):m.start()]
+            found = list(_CMP_RE.finditer(window))
+            num = found[-1] if found else None
+            if len(found) > 1 and _range_end(found[-2], window[found[-2].end():], default_op):
+                num, upper = found[-2], found[-1]
+        if num is None:
+            continue
+        op = _cmp_op(num, default_op)
+        if upper is not None:
+            conditions.append(SpecCondition(column, op, _cmp_value(num)))
+            conditions.append(SpecCondition(column, _cmp_op(upper, default_op), _cmp_value(upper)))
+            continue
+        if column == "microsd_гб" and op == "lte":
+            op = "gte"
+        conditions.append(SpecCondition(column, op, _cmp_value(num)))
+
+    for pattern, value in _RESOLUTION_PATTERNS:
+        if re.search(rf"(?<!\w)(?:{pattern})", text):
+            conditions.append(SpecCondition("разрешение_p", "gte", value))
+            break
+
+    for pattern, column, op, value in _ENUM_PATTERNS:
+        if re.search(rf"(?<!\w)(?:{pattern})", text):
+            conditions.append(SpecCondition(column, op, value))
+
+    return conditions
+
+
+_OP_TEXT = {"eq": "=", "gt": ">", "gte": "≥", "lt": "<", "lte": "≤", "contains": "содержит"}
+
+
+def describe_condition(cond: SpecCondition) -> str:
+    attr = _ATTRS_BY_NAME.get(cond.column)
+    title = attr.title if attr else cond.column
+    if attr and attr.kind == "bool":
+        return f"{title}: {'есть' if cond.value else 'нет'}"
+    value = cond.value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{title} {_OP_TEXT[cond.op]} {value}"
+
+
+class SpecsSearch:
+    """
+    Поиск устройств по характеристикам без LLM.
+    В модель ответа передаётся только подходящее подмножество.
+    """
+
+    def __init__(self, catalog: Optional[DeviceCatalog] = None) -> None:
+        self._catalog = catalog
+        self._index: SpecsIndex | None = None
+        self._index_version: float | None = None
+        self._ensure_index()
+
+    def _ensure_index(self) -> SpecsIndex:
+        """
+        Пересобирает индекс при смене версии каталога.
+        """
+        if self._catalog is not None:
+            self._catalog.reload_if_changed()
+            catalog = self._catalog
+        else:
+            catalog = get_device_catalog()
+        if self._index is None or self._index_version != catalog.version:
+            self._index = SpecsIndex(catalog.devices)
+            self._index_version = catalog.version
+        return self._index
+
+    def _current_catalog(self) -> DeviceCatalog:
+        return self._catalog or get_device_catalog()
+
+    @timed("specs_search")
+    def search(self, user_message: str) -> Dict[str, Any]:
+        """
+        Возвращает JSON: { conditions, total, devices } — только совпавшие устройства
+        и только запрошенные характеристики.
+        """
+        index = self._ensure_index()
+        conditions = parse_specs_query(user_message)
+        if not conditions:
+            return {
+                "conditions": [],
+                "total": 0,
+                "devices": [],
+                "note": "Не удалось распознать характеристику в запросе.",
+                "supported": [a.title for a in ATTRIBUTES],
+            }
+
+        ids = index.query(conditions)
+        catalog = self._current_catalog()
+        columns = list(dict.fromkeys(c.column for c in conditions))
+
+        devices = []
+        for device in catalog.by_ids(ids):
+            item: Dict[str, Any] = {"модель": device["название_модели"]}
+            for column in columns:
+                value = index.value(device["id"], column)
+                if value is not None:
+                    title = _ATTRS_BY_NAME[column].title if column in _ATTRS_BY_NAME else column
+                    item[title] = value
+            if device.get("статус"):
+                item["статус"] = device["статус"]
+            if device.get("ссылка"):
+                item["ссылка"] = device["ссылка"]
+            devices.append(item)
+
+        logger.info(
+            "SpecsSearch conditions=%s matched=%d",
+            [describe_condition(c) for c in conditions],
+            len(devices),
+        )
+        return {
+            "conditions": [describe_condition(c) for c in conditions],
+            "total": len(devices),
+            "devices": devices,
+        }
+
+
+def get_specs_search_cached() -> SpecsSearch | None:
+    return _specs_search_cached
+
+
+def set_specs_search_cached(svc: SpecsSearch | None) -> None:
+    global _specs_search_cached
+    _specs_search_cached = svc
@@ -1,14 +1,35 @@
+import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 
-from settings import config
-from apps.telegram_bot.dispatcher import bot
+from apps.telegram_bot.dispatcher import bot, dp, setup_webhook, shutdown_webhook
 from apps.telegram_bot.router import router as telegram_router
-from apps.telegram_bot.commands.commands import set_default_commands
-from apps.whatsapp_bot.router import router as whatsapp_router
+from apps.telegram_bot.update_processor import get_update_processor, set_update_processor
+from apps.whatsapp_bot.router import router as whatsapp_router, process_whatsapp_message
+from apps.whatsapp_bot.queue import WhatsAppWorkerPool
 from logger import setup_logging, get_logger
 from logger.middlewares.fastapi import RequestContextMiddleware, AccessLogMiddleware
 from common.openai_client import init_openai_client, warmup_openai, close_openai_client
+from common.redis_client import close_redis
+from common.http_client import close_http_clients, get_http_client
+from common.llm_usage import llm_usage
+from common.metrics import CONTENT_TYPE, registry as metrics_registry
+from common.worker_metrics import multi_worker, peer_metrics, run_metrics_publisher
+from utils.google_sheets import get_sheets_logger
+from apps.telegram_bot.services.voice_service import close_voice_pool
+from apps.knowledge_base.services.device_catalog import init_device_catalog, set_device_catalog
+from apps.knowledge_base.services.device_search import (
+    DeviceSelector,
+    set_device_selector_cached,
+)
+from apps.knowledge_base.services.specs_search import SpecsSearch, set_specs_search_cached
+from apps.knowledge_base.services.faq_search import FAQSearch, set_faq_search_cached
+from apps.knowledge_base.chat_pipeline import ChatPipeline, set_chat_pipeline
+from apps.knowledge_base.services.faq_index import (
+    init_faq_index,
+    listen_faq_updates,
+    set_faq_index,
+)
 
 setup_logging()
 logger = get_logger(__name__)
@@ -18,18 +39,47 @@ logger = get_logger(__name__)
 async def lifespan(app: FastAPI):
     await init_openai_client()
     await warmup_openai()
+    get_http_client()
+    catalog = init_device_catalog()
+    set_device_selector_cached(DeviceSelector(catalog))
+    set_specs_search_cached(SpecsSearch(catalog))
+    set_faq_search_cached(FAQSearch())
+    set_chat_pipeline(ChatPipeline())
+    faq_index = await init_faq_index()
+    faq_listener = asyncio.create_task(listen_faq_updates(faq_index))
+    await get_sheets_logger().start()
+    whatsapp_workers = WhatsAppWorkerPool(process_whatsapp_message)
+    await whatsapp_workers.start()
+    metrics_publisher = asyncio.create_task(run_metrics_publisher()) if multi_worker() else None
 
-    logger.info("Setting Telegram webhook to: %s", config.WEBHOOK_URL)
-    await bot.set_webhook(config.WEBHOOK_URL)
-    await set_default_commands(bot)
+    await setup_webhook()
 
     logger.info("App started (Telegram + WhatsApp)")
     yield
 
-    logger.info("Shutting down, deleting Telegram webhook")
-    await bot.delete_webhook()
+    logger.info("Shutting down")
+    await shutdown_webhook()
+    await get_update_processor().drain()
+    set_update_processor(None)
     await bot.session.close()
+    await dp.storage.close()
+    await whatsapp_workers.stop()
+    await get_sheets_logger().stop()
+    close_voice_pool()
+    set_device_selector_cached(None)
+    set_specs_search_cached(None)
+    set_faq_search_cached(None)
+    set_chat_pipeline(None)
+    background = [t for t in (faq_listener, metrics_publisher) if t is not None]
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    set_faq_index(None)
+    set_device_catalog(None)
+    logger.info("LLM usage totals: %s", llm_usage.snapshot())
     await close_openai_client()
+    await close_http_clients()
+    await close_redis()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -38,4 +88,15 @@ app.add_middleware(RequestContextMiddleware)
 app.add_middleware(AccessLogMiddleware)
 
 app.include_router(telegram_router)
-app.include_router(whatsapp_router)
\ No newline at end of file
+app.include_router(whatsapp_router)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    peers = []
+    if multi_worker():
+        try:
+            peers = await peer_metrics()
+        except Exception as e:
+            logger.warning("Peer metrics unavailable: %s", e)
+    return Response(metrics_registry.render(peers), media_type=CONTENT_TYPE)
\ No newline at end of file
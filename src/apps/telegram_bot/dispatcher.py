@@ -1,21 +1,80 @@
+import asyncio
+
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
 
 from settings import config
 from apps.telegram_bot.handlers import start
 from apps.telegram_bot.handlers import chat
 from apps.telegram_bot.handlers import help
+from apps.telegram_bot.commands.commands import set_default_commands
+from common.redis_client import get_redis
+from common.worker_metrics import multi_worker
+from logger import get_logger
 from logger.middlewares.aiogram import TelegramContextMiddleware
 
+logger = get_logger(__name__)
+
+_SETUP_LOCK_KEY = "tg:setup_lock"
+_SETUP_LOCK_TTL = 60
+_SETUP_LOCK_WAIT = 30.0
+
 bot = Bot(
     token=config.TELEGRAM_BOT_TOKEN,
     default=DefaultBotProperties(parse_mode="HTML"),
 )
 
-dp = Dispatcher(storage=MemoryStorage())
+# FSM-состояния (Registration.wait_for_phone) хранятся в Redis,
+# чтобы их видели все воркеры и реплики.
+dp = Dispatcher(
+    storage=RedisStorage.from_url(
+        config.REDIS_URL,
+        state_ttl=config.FSM_STATE_TTL,
+        data_ttl=config.FSM_STATE_TTL,
+    )
+)
 dp.update.outer_middleware(TelegramContextMiddleware())
 
 dp.include_router(start.router)
 dp.include_router(help.router)
-dp.include_router(chat.router)
\ No newline at end of file
+dp.include_router(chat.router)
+
+
+async def setup_webhook() -> None:
+    """
+    Ставит вебхук и команды бота. Воркеры делают это по очереди под
+    блокировкой в Redis, и каждый сверяется с get_webhook_info(): вебхук,
+    снятый только что остановленным процессом, будет поставлен заново.
+    """
+    redis = await get_redis()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + _SETUP_LOCK_WAIT
+    while not (acquired := await redis.set(_SETUP_LOCK_KEY, 1, nx=True, ex=_SETUP_LOCK_TTL)):
+        if loop.time() >= deadline:
+            logger.warning("Telegram setup lock is still held, checking webhook without it")
+            break
+        await asyncio.sleep(0.5)
+    try:
+        info = await bot.get_webhook_info()
+        if info.url != config.WEBHOOK_URL:
+            logger.info("Setting Telegram webhook to: %s", config.WEBHOOK_URL)
+            await bot.set_webhook(config.WEBHOOK_URL)
+        await set_default_commands(bot)
+    finally:
+        if acquired:
+            await redis.delete(_SETUP_LOCK_KEY)
+
+
+async def shutdown_webhook() -> None:
+    """
+    Снимает вебхук, если это разрешено (TELEGRAM_DELETE_WEBHOOK_ON_SHUTDOWN,
+    по умолчанию — только при одном воркере): при нескольких воркерах
+    остановка одного не должна отключать остальных.
+    """
+    delete = config.TELEGRAM_DELETE_WEBHOOK_ON_SHUTDOWN
+    if delete is None:
+        delete = not multi_worker()
+    if delete:
+        logger.info("Deleting Telegram webhook")
+        await bot.delete_webhook()
@@ -1,30 +1,22 @@
 import asyncio
-import json
-from pathlib import Path
 
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.enums import ChatAction
 
-from apps.knowledge_base.intent_router import IntentRouter
-from db.session import async_session_maker
-from apps.knowledge_base.services.faq_search import FAQSearch
-from apps.knowledge_base.services.device_search import DeviceSelector
-from apps.knowledge_base.services.answer_service import AnswerService
-from apps.knowledge_base.services.dialog_history import DialogHistory
-from apps.telegram_bot.services.voice_service import transcribe_voice
-from utils.telegram import delete_message
-from utils.text import sanitize_telegram_html
-from utils.google_sheets import GoogleSheetsLogger
+from apps.knowledge_base.chat_pipeline import get_chat_pipeline
+from apps.knowledge_base.services.answer_service import StreamingPostprocessor
+from apps.telegram_bot.services.voice_service import VoiceRejectedError, transcribe_voice
+from utils.telegram import MessageStreamer, delete_message, send_html
+from utils.answer_format import FormattedAnswer, format_answer
+from utils.google_sheets import get_sheets_logger
 from logger.config import get_logger
+from settings import config
 
 router = Router()
-intent_router = IntentRouter()
-answer_service = AnswerService(model="gpt-4o")
-sheets_logger = GoogleSheetsLogger()
 logger = get_logger(__name__)
 
-history = DialogHistory(max_messages=20)
+EMPTY_ANSWER_TEXT = "Не получилось сформулировать ответ. Попробуй переформулировать вопрос."
 
 
 async def keep_typing(message: Message, stop_event: asyncio.Event):
@@ -36,14 +28,33 @@ async def keep_typing(message: Message, stop_event: asyncio.Event):
             continue
 
 
-def _load_devices_json() -> list[dict]:
-    path = Path(__file__).resolve().parents[3] / "common" / "devices.json"
-    with open(path, encoding="utf-8") as f:
-        return json.load(f)
+class TelegramAnswerStream:
+    """
+    Показывает ответ по мере генерации, редактируя сообщение-заглушку.
+    """
 
+    def __init__(self, placeholder: Message, stop_typing: asyncio.Event) -> None:
+        self._streamer = MessageStreamer(placeholder, min_interval=config.STREAM_EDIT_INTERVAL)
+        self._post = StreamingPostprocessor()
+        self._stop_typing = stop_typing
 
-def _filter_devices_by_ids(all_devices: list[dict], device_ids: list[str]) -> list[dict]:
-    return [d for d in all_devices if d.get("id") in device_ids]
+    async def on_delta(self, delta: str) -> None:
+        self._post.feed(delta)
+        if self._streamer.due():
+            await self._streamer.update(self._post.render())
+            if self._streamer.edits:
+                self._stop_typing.set()
+
+    async def finish(self, answer: FormattedAnswer) -> None:
+        """
+        Ставит итоговый ответ в заглушку. Если он длиннее лимита Telegram
+        или правка не удалась — заглушка удаляется, ответ уходит новыми
+        сообщениями.
+        """
+        if await self._streamer.update(answer.html, force=True):
+            return
+        await delete_message(self._streamer.message, delay=0)
+        await send_html(self._streamer.message, answer.html)
 
 
 @router.message(F.text | F.voice)
@@ -53,6 +64,16 @@ async def handle_chat(message: Message):
     elif message.voice:
         try:
             user_message = await transcribe_voice(message)
+        except VoiceRejectedError as e:
+            logger.info("Голосовое сообщение отклонено: %s", e)
+            if e.reason == "size":
+                limit_mb = config.VOICE_MAX_FILE_SIZE // (1024 * 1024)
+                return await message.answer(
+                    f"❌ Файл голосового сообщения слишком большой. Максимум — {limit_mb} МБ."
+                )
+            return await message.answer(
+                f"❌ Голосовое сообщение слишком длинное. Максимум — {config.VOICE_MAX_DURATION} сек."
+            )
         except Exception as e:
             logger.error("Ошибка транскрибации голоса", exc_info=e)
             return await message.answer("❌ Не удалось распознать голосовое сообщение")
@@ -64,60 +85,35 @@ async def handle_chat(message: Message):
     typing_task = asyncio.create_task(keep_typing(message, stop_event))
 
     chat_id = str(message.chat.id)
-    past_messages = await history.get(chat_id)
+    stream = TelegramAnswerStream(typing_msg, stop_event) if config.STREAM_ANSWERS else None
+    streamed = False
 
     try:
-        intent = await intent_router.classify(user_message)
-
-        async with async_session_maker() as session:
-            if intent == "FAQ":
-                search = FAQSearch(session)
-                context = await search.top_faq_json(user_message, top_n=3)
-
-            elif intent == "Device":
-                selector = DeviceSelector()
-                selection = await selector.select(user_message)
-
-                all_devices = _load_devices_json()
-                devices_data = _filter_devices_by_ids(
-                    all_devices, selection.get("device_ids", [])
-                )
-
-                context = {
-                    "selection": selection,
-                    "devices": devices_data,
-                }
-
-            elif intent == "Specs":
-                context = {"message": "Поиск по характеристикам в разработке."}
-
-            else:
-                answer = await answer_service.fallback(
-                    user_message, past_messages=past_messages
-                )
-                await history.add(chat_id, "user", user_message)
-                await history.add(chat_id, "assistant", answer)
-                await delete_message(typing_msg, delay=0)
-                return await message.answer(sanitize_telegram_html(answer))
-
-        answer = await answer_service.generate(
-            user_message, context, intent, past_messages=past_messages
+        result = await get_chat_pipeline().run(
+            chat_id,
+            user_message,
+            on_delta=stream.on_delta if stream is not None else None,
         )
-
-        await history.add(chat_id, "user", user_message)
-        await history.add(chat_id, "assistant", answer)
-
+        answer = result.formatted
+        if not answer.html:
+            # Модель не вернула текста: заглушка «📝» не должна остаться в чате.
+            logger.warning("Пустой ответ intent=%s", result.intent)
+            answer = format_answer(EMPTY_ANSWER_TEXT)
+        if result.streamed:
+            await stream.finish(answer)
+            streamed = True
     except Exception as e:
         logger.error("Ошибка обработки сообщения", exc_info=e)
-        answer = "⚠️ Что-то пошло не так. Попробуй ещё раз."
+        answer = format_answer("⚠️ Что-то пошло не так. Попробуй ещё раз.")
     finally:
         stop_event.set()
         typing_task.cancel()
 
-    await delete_message(typing_msg, delay=0)
-    await message.answer(sanitize_telegram_html(answer))
+    if not streamed:
+        await delete_message(typing_msg, delay=0)
+        await send_html(message, answer.html)
 
     try:
-        sheets_logger.log_message(user_message, answer, source="telegram")
+        get_sheets_logger().log_message(user_message, answer.log, source="telegram")
     except Exception as e:
         logger.error("Ошибка логирования в Google Sheets", exc_info=e)
\ No newline at end of file
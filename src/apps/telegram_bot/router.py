@@ -3,7 +3,7 @@ from fastapi.responses import JSONResponse
 from pydantic import ValidationError
 from aiogram import types
 
-from apps.telegram_bot.dispatcher import bot, dp
+from apps.telegram_bot.update_processor import get_update_processor
 from logger import get_logger
 
 router = APIRouter()
@@ -12,11 +12,15 @@ logger = get_logger(__name__)
 
 @router.post("/webhook/telegram")
 async def telegram_webhook(request: Request):
+    """
+    Принимает апдейт и сразу отвечает Telegram; обработка идёт в фоне
+    (TELEGRAM_BACKGROUND_UPDATES), повторные доставки отбрасываются.
+    """
     try:
         data = await request.json()
         logger.info("Telegram update received")
         update = types.Update(**data)
-        await dp.feed_update(bot=bot, update=update)
+        await get_update_processor().submit(update)
         return {"ok": True}
     except ValidationError as ve:
         logger.warning("Validation error: %s", ve)
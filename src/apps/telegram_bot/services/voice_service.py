@@ -1,35 +1,119 @@
-import httpx
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from typing import Literal
+
+import openai
 from aiogram.types import Message
-from pydub import AudioSegment
-from pydub.utils import which
 
+from common.metrics import timed
 from common.openai_client import ensure_openai_client
+from logger.config import get_logger
+from settings import config
 
-AudioSegment.converter = which("ffmpeg")
+logger = get_logger(__name__)
 
+# Форматы, которые Whisper принимает без конвертации.
+_WHISPER_MIME = {
+    "audio/ogg": "ogg",
+    "audio/oga": "oga",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "m4a",
+    "audio/m4a": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/webm": "webm",
+    "audio/flac": "flac",
+}
 
-async def transcribe_voice(message: Message) -> str:
+_semaphore = asyncio.Semaphore(config.VOICE_MAX_CONCURRENCY)
+_pool: ProcessPoolExecutor | None = None
+
+
+class VoiceRejectedError(ValueError):
+    """
+    Голосовое сообщение не принято к распознаванию.
+    reason: "duration" — слишком длинное, "size" — слишком большой файл.
     """
-    Транскрибация голосовых сообщений с помощью ffmpeg и Whisper.
+
+    def __init__(self, message: str, reason: Literal["duration", "size"]) -> None:
+        super().__init__(message)
+        self.reason = reason
+
+
+def _convert_to_mp3(data: bytes) -> bytes:
     """
-    file_info = await message.bot.get_file(message.voice.file_id)
-    file_url = f"https://api.telegram.org/file/bot{message.bot.token}/{file_info.file_path}"
+    Перекодирует аудио в MP3 через ffmpeg. Выполняется в отдельном процессе.
+    """
+    from pydub import AudioSegment
+    from pydub.utils import which
+
+    AudioSegment.converter = which("ffmpeg")
+    audio = AudioSegment.from_file(BytesIO(data))
+    out = BytesIO()
+    audio.export(out, format="mp3")
+    return out.getvalue()
+
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(file_url)
-        voice_data = BytesIO(response.content)
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=config.VOICE_FFMPEG_WORKERS)
+    return _pool
 
-    audio = AudioSegment.from_file(voice_data, format="ogg")
-    mp3_data = BytesIO()
-    audio.export(mp3_data, format="mp3")
-    mp3_data.seek(0)
-    mp3_data.name = "voice.mp3"
 
+def close_voice_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _whisper(data: bytes, filename: str) -> str:
     client = await ensure_openai_client()
     transcription = await client.audio.transcriptions.create(
         model="whisper-1",
-        file=mp3_data,
+        file=(filename, data),
     )
+    return transcription.text
+
+
+async def _to_mp3(data: bytes) -> bytes:
+    loop = asyncio.get_running_loop()
+    with timed("voice_conversion"):
+        return await loop.run_in_executor(_get_pool(), _convert_to_mp3, data)
+
+
+@timed("voice_transcription")
+async def transcribe_voice(message: Message) -> str:
+    """
+    Транскрибация голосовых сообщений через Whisper.
+    OGG/Opus из Telegram отправляется как есть; ffmpeg-конвертация в MP3
+    (в пуле процессов) — только для неподдерживаемых форматов или если
+    Whisper отклонил исходный файл.
+    """
+    voice = message.voice
+    if voice.duration and voice.duration > config.VOICE_MAX_DURATION:
+        raise VoiceRejectedError(f"voice too long: {voice.duration}s", "duration")
+    if voice.file_size and voice.file_size > config.VOICE_MAX_FILE_SIZE:
+        raise VoiceRejectedError(f"voice too large: {voice.file_size} bytes", "size")
+
+    async with _semaphore:
+        buffer = BytesIO()
+        await message.bot.download(voice, destination=buffer)
+        data = buffer.getvalue()
+
+        ext = _WHISPER_MIME.get((voice.mime_type or "audio/ogg").lower())
+        if ext is None:
+            return await _whisper(await _to_mp3(data), "voice.mp3")
 
-    return transcription.text
\ No newline at end of file
+        try:
+            return await _whisper(data, f"voice.{ext}")
+        except openai.BadRequestError as e:
+            logger.warning("Whisper rejected %s, converting to mp3: %s", ext, e)
+            return await _whisper(await _to_mp3(data), "voice.mp3")
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from common.metrics import registry
+from common.redis_client import get_redis
+from logger import get_logger
+from logger.middlewares.aiogram import extract_chat_id
+from settings import config
+
+logger = get_logger(__name__)
+
+_SEEN_PREFIX = "tg:update"
+_CHAT_LOCK_PREFIX = "tg:chat_lock"
+
+# Продление и снятие блокировки только её владельцем.
+_RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+TELEGRAM_UPDATES = registry.counter(
+    "fujida_telegram_updates_total",
+    "Telegram webhook updates by outcome (accepted, duplicate, processed, failed).",
+    ("outcome",),
+)
+
+_update_processor: UpdateProcessor | None = None
+
+
+class UpdateProcessor:
+    """
+    Фоновая обработка апдейтов Telegram: вебхук отвечает сразу,
+    апдейт обрабатывается в задаче.
+
+    Повторные доставки отсекаются по update_id в Redis (SET NX с TTL).
+    Апдейты одного чата идут строго по очереди (одна задача на чат),
+    разные чаты — параллельно, но не больше max_concurrency одновременно.
+    Между воркерами и репликами чат дополнительно защищён блокировкой
+    в Redis: два процесса не обрабатывают один чат одновременно (порядок
+    между процессами — по времени захвата блокировки).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_concurrency: int | None = None) -> None:
+        self._dp = dp
+        self._bot = bot
+        self._semaphore = asyncio.Semaphore(
+            max_concurrency if max_concurrency is not None else config.TELEGRAM_MAX_CONCURRENT_UPDATES
+        )
+        self._queues: Dict[int | str, asyncio.Queue[Update]] = {}
+        self._workers: Dict[int | str, asyncio.Task] = {}
+        self._accepting = True
+        self._owner = f"{socket.gethostname()}-{os.getpid()}"
+
+    async def _is_new(self, update: Update) -> bool:
+        try:
+            redis = await get_redis()
+            fresh = await redis.set(
+                f"{_SEEN_PREFIX}:{update.update_id}",
+                1,
+                nx=True,
+                ex=config.TELEGRAM_UPDATE_DEDUPE_TTL,
+            )
+        except Exception as e:
+            logger.warning("Update dedupe unavailable, processing anyway: %s", e)
+            return True
+        return bool(fresh)
+
+    @asynccontextmanager
+    async def _chat_lock(self, chat_id: int | None) -> AsyncIterator[None]:
+        """
+        Межпроцессная блокировка чата. Пока обработчик работает, блокировка
+        продлевается в фоне, так что долгий ответ (стриминг, повторы OpenAI)
+        не отдаёт чат другому процессу. Если Redis недоступен — без неё.
+        """
+        if chat_id is None:
+            yield
+            return
+        key = f"{_CHAT_LOCK_PREFIX}:{chat_id}"
+        token = f"{self._owner}-{uuid.uuid4().hex}"
+        lock_ms = int(config.TELEGRAM_CHAT_LOCK_TTL * 1000)
+        redis = None
+        try:
+            redis = await get_redis()
+            while not await redis.set(key, token, nx=True, px=lock_ms):
+                await asyncio.sleep(config.TELEGRAM_CHAT_LOCK_POLL)
+        except Exception as e:
+            logger.warning("Chat lock unavailable chat_id=%s: %s", chat_id, e)
+            redis = None
+        if redis is None:
+            yield
+            return
+        heartbeat = asyncio.create_task(self._renew_chat_lock(key, token, lock_ms))
+        try:
+            yield
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            try:
+                await redis.eval(_RELEASE_LUA, 1, key, token)
+            except Exception as e:
+                logger.warning("Chat lock release failed chat_id=%s: %s", chat_id, e)
+
+    async def _renew_chat_lock(self, key: str, token: str, lock_ms: int) -> None:
+        redis = await get_redis()
+        while True:
+            await asyncio.sleep(lock_ms / 3000)
+            try:
+                renewed = await redis.eval(_RENEW_LUA, 1, key, token, lock_ms)
+            except Exception as e:
+                logger.warning("Chat lock renew failed key=%s: %s", key, e)
+                continue
+            if not renewed:
+                logger.warning("Chat lock lost key=%s", key)
+                return
+
+    async def _feed(self, update: Update) -> None:
+        async with self._chat_lock(extract_chat_id(update)), self._semaphore:
+            try:
+                await self._dp.feed_update(bot=self._bot, update=update)
+                TELEGRAM_UPDATES.inc(outcome="processed")
+            except Exception as e:
+                TELEGRAM_UPDATES.inc(outcome="failed")
+                logger.error("Telegram update failed update_id=%s", update.update_id, exc_info=e)
+
+    async def _chat_worker(self, key: int | str) -> None:
+        queue = self._queues[key]
+        try:
+            while not queue.empty():
+                update = queue.get_nowait()
+                await self._feed(update)
+        finally:
+            self._queues.pop(key, None)
+            self._workers.pop(key, None)
+
+    async def submit(self, update: Update) -> bool:
+        """
+        Ставит апдейт в очередь его чата. Возвращает False для дублей.
+        """
+        if not await self._is_new(update):
+            TELEGRAM_UPDATES.inc(outcome="duplicate")
+            logger.info("Duplicate Telegram update_id=%s", update.update_id)
+            return False
+        TELEGRAM_UPDATES.inc(outcome="accepted")
+
+        if not self._accepting or not config.TELEGRAM_BACKGROUND_UPDATES:
+            await self._feed(update)
+            return True
+
+        chat_id = extract_chat_id(update)
+        key: int | str = chat_id if chat_id is not None else f"update:{update.update_id}"
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue()
+        queue.put_nowait(update)
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._chat_worker(key))
+        return True
+
+    @property
+    def in_flight(self) -> int:
+        return sum(q.qsize() for q in self._queues.values()) + len(self._workers)
+
+    async def drain(self, timeout: float | None = None) -> None:
+        """
+        Дожидается обработки принятых апдейтов; новые после этого
+        обрабатываются синхронно в запросе.
+        """
+        self._accepting = False
+        timeout = timeout if timeout is not None else config.TELEGRAM_DRAIN_TIMEOUT
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        logger.info("Draining Telegram updates chats=%d", len(workers))
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Telegram drain timed out, cancelled chats=%d", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def get_update_processor() -> UpdateProcessor:
+    global _update_processor
+    if _update_processor is None:
+        from apps.telegram_bot.dispatcher import bot, dp
+
+        _update_processor = UpdateProcessor(dp, bot)
+    return _update_processor
+
+
+def set_update_processor(processor: UpdateProcessor | None) -> None:
+    global _update_processor
+    _update_processor = processor
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List
+
+from redis.exceptions import ResponseError
+
+from common.metrics import registry
+from common.redis_client import get_redis
+from logger import get_logger
+from settings import config
+
+logger = get_logger(__name__)
+
+STREAM_PREFIX = "wa:in"
+GROUP = "wa-workers"
+_SEEN_PREFIX = "wa:seen"
+_LEASE_PREFIX = "wa:lease"
+DEAD_STREAM = "wa:dead"
+
+WHATSAPP_MESSAGES = registry.counter(
+    "fujida_whatsapp_messages_total",
+    "Incoming WhatsApp messages by outcome (queued, duplicate, processed, failed, dead).",
+    ("outcome",),
+)
+
+# Продление и снятие аренды только её владельцем.
+_RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+# Отметка «видели» ставится только вместе с успешным XADD: если запись
+# в стрим упала, повторная доставка Green API не будет принята за дубль.
+# KEYS: отметка, стрим. ARGV: TTL отметки, MAXLEN стрима, payload.
+_ENQUEUE_LUA = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('xadd', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'payload', ARGV[3])
+redis.call('set', KEYS[1], 1, 'EX', ARGV[1])
+return 1
+"""
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _partition(chat_id: str) -> int:
+    return zlib.crc32(chat_id.encode("utf-8")) % config.WHATSAPP_STREAM_PARTITIONS
+
+
+def _stream_key(partition: int) -> str:
+    return f"{STREAM_PREFIX}:{partition}"
+
+
+async def enqueue_incoming(id_message: str, chat_id: str, text: str) -> bool:
+    """
+    Кладёт входящее сообщение в Redis Stream своего чата.
+    Возвращает False, если сообщение с таким idMessage уже принималось.
+    """
+    redis = await get_redis()
+    payload = json.dumps(
+        {"id_message": id_message, "chat_id": chat_id, "text": text},
+        ensure_ascii=False,
+    )
+    fresh = await redis.eval(
+        _ENQUEUE_LUA,
+        2,
+        f"{_SEEN_PREFIX}:{id_message}",
+        _stream_key(_partition(chat_id)),
+        config.WHATSAPP_DEDUPE_TTL,
+        config.WHATSAPP_STREAM_MAXLEN,
+        payload,
+    )
+    if not fresh:
+        WHATSAPP_MESSAGES.inc(outcome="duplicate")
+        return False
+    WHATSAPP_MESSAGES.inc(outcome="queued")
+    return True
+
+
+class WhatsAppWorkerPool:
+    """
+    Пул асинхронных обработчиков входящих сообщений WhatsApp.
+
+    Сообщения лежат в WHATSAPP_STREAM_PARTITIONS стримах (партиция — по chatId),
+    читаются через consumer group, поэтому пул масштабируется на несколько
+    реплик. Партицию в каждый момент обрабатывает только держатель аренды
+    в Redis, и обрабатывает строго по порядку — так сохраняется порядок
+    сообщений внутри чата. Пока сообщение обрабатывается, аренда продлевается
+    в фоне. Зависшие (не подтверждённые) сообщения упавшего обработчика
+    забираются через XAUTOCLAIM новым держателем аренды, когда они
+    пролежат дольше WHATSAPP_LEASE_TTL, то есть аренда прежнего держателя
+    заведомо истекла.
+
+    Сообщение, на котором обработчик упал, остаётся неподтверждённым
+    и повторяется тем же путём; после WHATSAPP_MAX_DELIVERIES доставок
+    оно переносится в стрим wa:dead. При остановке прочитанные, но не
+    обработанные сообщения сразу отдаются следующему держателю аренды.
+    """
+
+    def __init__(self, handler: Handler, workers: int | None = None) -> None:
+        self._handler = handler
+        self._workers = workers if workers is not None else config.WHATSAPP_WORKERS
+        self._consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    async def _ensure_groups(self) -> None:
+        redis = await get_redis()
+        for p in range(config.WHATSAPP_STREAM_PARTITIONS):
+            try:
+                await redis.xgroup_create(_stream_key(p), GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        await self._ensure_groups()
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.create_task(self._run(f"{self._consumer_prefix}-{i}", i))
+            for i in range(self._workers)
+        ]
+        logger.info("WhatsApp workers started count=%d", self._workers)
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """
+        Даёт обработчикам закончить текущие сообщения и останавливает пул.
+        """
+        if not self._tasks:
+            return
+        self._stopping.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, consumer: str, offset: int) -> None:
+        partitions = config.WHATSAPP_STREAM_PARTITIONS
+        while not self._stopping.is_set():
+            handled = 0
+            for i in range(partitions):
+                if self._stopping.is_set():
+                    break
+                try:
+                    handled += await self._drain(consumer, (offset + i) % partitions)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("WhatsApp worker error", exc_info=e)
+                    await asyncio.sleep(1.0)
+            if not handled:
+                try:
+                    await asyncio.wait_for(
+                        self._stopping.wait(), timeout=config.WHATSAPP_POLL_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _drain(self, consumer: str, partition: int) -> int:
+        """
+        Обрабатывает доступные сообщения партиции, если удалось взять аренду.
+        """
+        redis = await get_redis()
+        lease_key = f"{_LEASE_PREFIX}:{partition}"
+        lease_ms = int(config.WHATSAPP_LEASE_TTL * 1000)
+        if not await redis.set(lease_key, consumer, nx=True, px=lease_ms):
+            return 0
+
+        stream = _stream_key(partition)
+        handled = 0
+        unprocessed: List[str] = []
+        heartbeat = asyncio.create_task(self._heartbeat(lease_key, consumer, lease_ms))
+        try:
+            # Сначала недообработанное прошлым держателем аренды, потом новое.
+            _, claimed, *_ = await redis.xautoclaim(
+                stream, GROUP, consumer, min_idle_time=lease_ms, start_id="0-0", count=100
+            )
+            entries = list(claimed)
+            if not entries and (await redis.xpending(stream, GROUP))["pending"]:
+                # Есть сообщения, которые ещё нельзя забрать: новые не читаем,
+                # чтобы не нарушить порядок внутри чата.
+                return 0
+            while not self._stopping.is_set():
+                if not entries:
+                    result = await redis.xreadgroup(
+                        GROUP, consumer, {stream: ">"}, count=config.WHATSAPP_READ_BATCH
+                    )
+                    entries = result[0][1] if result else []
+                    if not entries:
+                        break
+                for i, (entry_id, fields) in enumerate(entries):
+                    if self._stopping.is_set():
+                        unprocessed = [eid for eid, _ in entries[i:]]
+                        break
+                    if not await self._process(stream, entry_id, fields):
+                        # Сообщение и всё после него ждут повтора: порядок
+                        # внутри чата важнее, партиция отдаётся до XAUTOCLAIM.
+                        return handled
+                    handled += 1
+                entries = []
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            if unprocessed:
+                await self._release_entries(stream, consumer, unprocessed, lease_ms)
+            await redis.eval(_RELEASE_LUA, 1, lease_key, consumer)
+        return handled
+
+    async def _release_entries(
+        self, stream: str, consumer: str, entry_ids: List[str], lease_ms: int
+    ) -> None:
+        """
+        Помечает прочитанные, но не обработанные сообщения простоявшими
+        WHATSAPP_LEASE_TTL, чтобы следующий держатель аренды забрал их
+        через XAUTOCLAIM сразу, а не через TTL.
+        """
+        redis = await get_redis()
+        try:
+            await redis.xclaim(
+                stream, GROUP, consumer, 0, entry_ids, idle=lease_ms, justid=True
+            )
+        except Exception as e:
+            logger.warning("WhatsApp: failed to release unprocessed entries", exc_info=e)
+
+    async def _heartbeat(self, lease_key: str, consumer: str, lease_ms: int) -> None:
+        """
+        Продлевает аренду, пока партиция обрабатывается, в том числе
+        во время долгого обработчика (LLM и повторы).
+        """
+        redis = await get_redis()
+        while True:
+            await asyncio.sleep(lease_ms / 3000)
+            if not await redis.eval(_RENEW_LUA, 1, lease_key, consumer, lease_ms):
+                logger.warning("WhatsApp lease lost key=%s consumer=%s", lease_key, consumer)
+                return
+
+    async def _process(self, stream: str, entry_id: str, fields: Dict[str, str] | None) -> bool:
+        """
+        Обрабатывает сообщение. Возвращает False, если оно оставлено
+        неподтверждённым для повтора.
+        """
+        redis = await get_redis()
+        try:
+            if fields and "payload" in fields:
+                await self._handler(json.loads(fields["payload"]))
+                WHATSAPP_MESSAGES.inc(outcome="processed")
+        except Exception as e:
+            WHATSAPP_MESSAGES.inc(outcome="failed")
+            logger.error("WhatsApp message processing failed id=%s", entry_id, exc_info=e)
+            if not await self._exhausted(stream, entry_id):
+                return False
+            await self._dead_letter(stream, entry_id, fields, e)
+        await redis.xack(stream, GROUP, entry_id)
+        await redis.xdel(stream, entry_id)
+        return True
+
+    async def _exhausted(self, stream: str, entry_id: str) -> bool:
+        redis = await get_redis()
+        info = await redis.xpending_range(stream, GROUP, min=entry_id, max=entry_id, count=1)
+        deliveries = info[0]["times_delivered"] if info else 0
+        return deliveries >= config.WHATSAPP_MAX_DELIVERIES
+
+    async def _dead_letter(
+        self, stream: str, entry_id: str, fields: Dict[str, str] | None, error: Exception
+    ) -> None:
+        redis = await get_redis()
+        await redis.xadd(
+            DEAD_STREAM,
+            {
+                "payload": (fields or {}).get("payload", ""),
+                "stream": stream,
+                "entry_id": entry_id,
+                "error": repr(error),
+            },
+            maxlen=config.WHATSAPP_STREAM_MAXLEN,
+            approximate=True,
+        )
+        WHATSAPP_MESSAGES.inc(outcome="dead")
+        logger.error("WhatsApp message moved to %s id=%s", DEAD_STREAM, entry_id)
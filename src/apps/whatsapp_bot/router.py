@@ -1,25 +1,59 @@
-import re
+from typing import Any, Dict
 
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
-from apps.knowledge_base.services.answer_service import AnswerService
-from utils.google_sheets import GoogleSheetsLogger
+from apps.knowledge_base.chat_pipeline import get_chat_pipeline
+from utils.answer_format import format_answer
+from utils.google_sheets import get_sheets_logger
 from logger import get_logger
+from .queue import enqueue_incoming
 from .services import send_whatsapp_message
 
 router = APIRouter()
 logger = get_logger(__name__)
 
-answer_service = AnswerService(model="gpt-4o")
-sheets_logger = GoogleSheetsLogger()
 
+def extract_text(data: Dict[str, Any]) -> str | None:
+    msg_data = data.get("messageData", {})
+    msg_type = msg_data.get("typeMessage")
 
-def clean_text(text: str) -> str:
-    return re.sub(r"<[^>]+>", "", text).strip()
+    if msg_type == "textMessage":
+        return msg_data.get("textMessageData", {}).get("textMessage")
+    if msg_type == "extendedTextMessage":
+        return msg_data.get("extendedTextMessageData", {}).get("text")
+    return None
+
+
+async def process_whatsapp_message(item: Dict[str, Any]) -> None:
+    """
+    Обработка сообщения из очереди: ответ, отправка, логирование.
+    """
+    text = item["text"]
+    from_number = item["chat_id"].replace("@c.us", "")
+
+    try:
+        result = await get_chat_pipeline().run(f"whatsapp:{item['chat_id']}", text)
+        answer = result.formatted
+        if not answer.plain:
+            logger.warning("WhatsApp empty answer intent=%s", result.intent)
+            answer = format_answer("Не получилось сформулировать ответ. Попробуйте переформулировать вопрос.")
+    except Exception as e:
+        logger.error("Ошибка обработки сообщения WhatsApp", exc_info=e)
+        answer = format_answer("⚠️ Что-то пошло не так. Попробуйте ещё раз.")
+
+    await send_whatsapp_message(from_number, answer.plain)
+
+    try:
+        get_sheets_logger().log_message(text, answer.log, source="whatsapp")
+    except Exception as e:
+        logger.error("Ошибка логирования в Google Sheets", exc_info=e)
 
 
 @router.post("/webhook/whatsapp")
 async def whatsapp_webhook(request: Request):
+    """
+    Принимает уведомление Green API, ставит сообщение в очередь и сразу отвечает 200.
+    """
     try:
         data = await request.json()
         logger.info("WhatsApp update received: %s", data)
@@ -27,29 +61,15 @@ async def whatsapp_webhook(request: Request):
         if data.get("typeWebhook") != "incomingMessageReceived":
             return {"ok": True}
 
-        msg_data = data.get("messageData", {})
-        msg_type = msg_data.get("typeMessage")
-
-        text = None
-        if msg_type == "textMessage":
-            text = msg_data.get("textMessageData", {}).get("textMessage")
-        elif msg_type == "extendedTextMessage":
-            text = msg_data.get("extendedTextMessageData", {}).get("text")
-
-        if not text:
+        text = extract_text(data)
+        id_message = data.get("idMessage")
+        chat_id = data.get("senderData", {}).get("chatId")
+        if not text or not id_message or not chat_id:
             return {"ok": True}
 
-        from_number = data["senderData"]["chatId"].replace("@c.us", "")
-
-        answer = await answer_service.fallback(text)
-        answer = clean_text(answer)
-
-        try:
-            sheets_logger.log_message(text, answer, source="whatsapp")
-        except Exception as e:
-            logger.error("Ошибка логирования в Google Sheets", exc_info=e)
-
-        await send_whatsapp_message(from_number, answer)
+        queued = await enqueue_incoming(id_message, chat_id, text)
+        if not queued:
+            logger.info("WhatsApp duplicate idMessage=%s", id_message)
 
         return {"ok": True}
     except Exception as e:
@@ -57,4 +77,4 @@ async def whatsapp_webhook(request: Request):
         return JSONResponse(
             status_code=500,
             content={"error": "InternalServerError", "details": str(e)},
-        )
\ No newline at end of file
+        )
@@ -1,31 +1,42 @@
 import httpx
+
+from common.http_client import request
 from settings import config
 from logger import get_logger
+from utils.text import split_message
 
 logger = get_logger(__name__)
 
 
-async def send_whatsapp_message(to: str, text: str):
-    url = (
-        f"{config.GREEN_API_URL}/waInstance{config.GREEN_API_INSTANCE_ID}"
-        f"/sendMessage/{config.GREEN_API_TOKEN}"
-    )
+async def _send_chunk(url: str, to: str, text: str) -> dict:
     payload = {
         "chatId": f"{to}@c.us",
         "message": text,
     }
-    headers = {"Content-Type": "application/json"}
+    try:
+        resp = await request("POST", url, json=payload)
+        resp.raise_for_status()
+    except httpx.RequestError as e:
+        logger.error("Ошибка соединения с Green API: %s", e)
+        raise
+    except httpx.HTTPStatusError as e:
+        logger.error("Ошибка ответа Green API: %s", e.response.text)
+        raise
+    return resp.json()
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            resp = await client.post(url, json=payload, headers=headers)
-            resp.raise_for_status()
-        except httpx.RequestError as e:
-            logger.error("Ошибка соединения с Green API: %s", e)
-            raise
-        except httpx.HTTPStatusError as e:
-            logger.error("Ошибка ответа Green API: %s", e.response.text)
-            raise
 
-    logger.info("Сообщение отправлено в WhatsApp: %s", resp.json())
-    return resp.json()
\ No newline at end of file
+async def send_whatsapp_message(to: str, text: str):
+    """
+    Отправляет сообщение через Green API; длинный текст уходит
+    несколькими сообщениями по порядку.
+    """
+    url = (
+        f"{config.GREEN_API_URL}/waInstance{config.GREEN_API_INSTANCE_ID}"
+        f"/sendMessage/{config.GREEN_API_TOKEN}"
+    )
+
+    result = None
+    for chunk in split_message(text, config.WHATSAPP_MAX_MESSAGE_LEN):
+        result = await _send_chunk(url, to, chunk)
+        logger.info("Сообщение отправлено в WhatsApp: %s", result)
+    return result
@@ -0,0 +1,113 @@
+"""
+Бенчмарк постобработки ответа: прежняя цепочка против format_answer.
+
+Прежняя цепочка на каждый ответ: шесть re.sub по вводным фразам (шаблоны
+компилируются на лету), code fences, markdown-ссылки, затем для Telegram
+BeautifulSoup (sanitize_telegram_html), для логов ещё один BeautifulSoup
+(strip_all_tags), для WhatsApp — regex clean_text. Новая — один проход
+format_answer, который сразу даёт HTML, простой текст и текст для логов.
+
+Запуск (из src, для прежней цепочки нужен beautifulsoup4):
+    python -m benchmarks.answer_format --repeat 2000
+"""
+import argparse
+import re
+import timeit
+from typing import Callable, Dict
+
+from bs4 import BeautifulSoup
+
+from utils.answer_format import ALLOWED_ATTRS, ALLOWED_TAGS, META_PHRASES, format_answer
+
+_SAMPLES = {
+    "faq": (
+        "Согласно данным, обновить базу камер можно через приложение Fujida Connect.\n\n"
+        "1. Скачайте файл базы с сайта.\n2. Скопируйте его на карту памяти.\n"
+        "3. Вставьте карту в устройство и дождитесь обновления.\n\n"
+        "Подробная инструкция: [страница поддержки](https://fujida.ru/support/update)."
+    ),
+    "device": (
+        "<b>Fujida Karma Pro S WiFi</b> и <b>Fujida Zoom Hit S</b> отличаются так:\n\n"
+        "• <b>Сенсор</b>: Sony Starvis IMX307 | GalaxyCore GC2053\n"
+        "• <b>Радар-детектор</b>: есть | нет\n"
+        "• <b>GPS-информатор</b>: есть <i>(база камер обновляется)</i> | есть\n\n"
+        "Для ночной съёмки лучше <b>Karma Pro S WiFi</b>.\n"
+        '<a href="https://fujida.ru/karma-pro-s-wifi">Страница модели</a>'
+    ),
+    "meta": (
+        "Судя по предоставленной информации, гарантия на устройство — 2 года. "
+        "В контексте обращения: сохраните чек и <u>гарантийный талон</u>. "
+        "На основе предоставленных данных ремонт проводится в сервисном центре."
+    ),
+    "fence": (
+        "## Настройка\n\n**Важно**: перед обновлением зарядите устройство.\n\n"
+        "```\nFW_VERSION=2.1.4\n```\n\n"
+        "Если что-то пошло не так — напишите нам, и мы поможем <3"
+    ),
+}
+
+_MD_LINK_RE = re.compile(r"\[([^\]]+)\]\((https?://[^\s)]+)\)")
+_CODE_FENCE_RE = re.compile(r"```.+?```", flags=re.DOTALL)
+
+
+def _legacy_postprocess(text: str) -> str:
+    text = _CODE_FENCE_RE.sub("", text)
+    text = _MD_LINK_RE.sub(lambda m: f'<a href="{m.group(2).strip()}">{m.group(1).strip()}</a>', text)
+    for phrase in META_PHRASES:
+        text = re.sub(rf"\b{re.escape(phrase)}\b[:,\s]*", "", text, flags=re.IGNORECASE)
+    return text.strip()
+
+
+def _legacy_sanitize(text: str) -> str:
+    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
+    text = re.sub(r"^#+\s*", "", text, flags=re.MULTILINE)
+    soup = BeautifulSoup(text, "html.parser")
+    for tag in soup.find_all(True):
+        name = tag.name.lower()
+        if name not in ALLOWED_TAGS:
+            tag.unwrap()
+            continue
+        allowed = ALLOWED_ATTRS.get(name, set())
+        tag.attrs = {k: v for k, v in tag.attrs.items() if k in allowed}
+        if name == "span" and tag.attrs.get("class") != ["tg-spoiler"]:
+            tag.unwrap()
+        if name == "a" and not tag.attrs.get("href", "").startswith(("http://", "https://", "tg://")):
+            tag.unwrap()
+    return str(soup)
+
+
+def _legacy_all(text: str) -> Dict[str, str]:
+    answer = _legacy_postprocess(text)
+    return {
+        "html": _legacy_sanitize(answer),
+        "plain": re.sub(r"<[^>]+>", "", answer).strip(),
+        "log": BeautifulSoup(answer, "html.parser").get_text(" ", strip=True),
+    }
+
+
+def _measure(fn: Callable[[str], object], text: str, repeat: int) -> float:
+    return min(timeit.repeat(lambda: fn(text), number=repeat, repeat=3)) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--show", action="store_true", help="напечатать результаты обеих цепочек")
+    args = parser.parse_args()
+
+    for name, text in _SAMPLES.items():
+        legacy = _measure(_legacy_all, text, args.repeat)
+        single = _measure(format_answer, text, args.repeat)
+        print(
+            f"{name:<7} len={len(text):<4} legacy={legacy:8.1f} us "
+            f"format_answer={single:6.1f} us x{legacy / single:.1f}"
+        )
+        if args.show:
+            formatted = format_answer(text)
+            for channel, value in _legacy_all(text).items():
+                print(f"  legacy {channel}: {value!r}")
+                print(f"  new    {channel}: {getattr(formatted, channel)!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Бенчмарк записи истории диалога в Redis: прежняя схема против add_turn.
+
+Прежняя схема — JSON-записи и два вызова add (rpush + ltrim каждый) на ход,
+новая — бинарные записи и один EVALSHA (push + trim + expire) на ход.
+Считает обращения к Redis на ход, байты полезной нагрузки и MEMORY USAGE
+ключа на чат, а также время записи.
+
+Запуск (из src, нужен Redis из REDIS_URL):
+    python -m benchmarks.dialog_history --chats 200 --turns 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+
+from apps.knowledge_base.services.dialog_history import DialogHistory
+from common.redis_client import close_redis, get_redis_bytes
+from settings import config
+
+PREFIX = "bench"
+
+_QUESTIONS = [
+    "Какой регистратор лучше взять для ночной съёмки?",
+    "Как обновить базу камер на Fujida Karma Pro S WiFi?",
+    "Не включается после зимы, что делать?",
+    "Чем отличается Zoom Hit S от Zoom Smart S?",
+]
+_ANSWER = (
+    "Для ночной съёмки подойдёт модель с сенсором Sony Starvis и светосильным "
+    "объективом. Обновить базу камер можно через приложение или с карты памяти. "
+)
+
+
+class _RoundTrips:
+    """
+    Считает обращения к серверу: одиночные команды и выполнения пайплайнов.
+    """
+
+    def __init__(self, client: redis.Redis) -> None:
+        self.count = 0
+        self._client = client
+        self._command = client.execute_command
+        self._pipeline_execute = Pipeline.execute
+
+    def __enter__(self) -> "_RoundTrips":
+        counter = self
+
+        async def command(*args, **kwargs):
+            counter.count += 1
+            return await counter._command(*args, **kwargs)
+
+        async def pipeline_execute(pipe, *args, **kwargs):
+            counter.count += 1
+            return await counter._pipeline_execute(pipe, *args, **kwargs)
+
+        self._client.execute_command = command
+        Pipeline.execute = pipeline_execute
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._client.execute_command = self._command
+        Pipeline.execute = self._pipeline_execute
+
+
+async def _legacy_add(client: redis.Redis, key: str, role: str, content: str, max_messages: int) -> None:
+    entry = json.dumps({"role": role, "content": content}, ensure_ascii=False)
+    await client.rpush(key, entry)
+    await client.ltrim(key, -max_messages, -1)
+
+
+async def _measure(
+    name: str,
+    client: redis.Redis,
+    chats: int,
+    turns: int,
+    write_turn: Callable[[str, str, str], Awaitable[None]],
+) -> None:
+    keys = [f"dialog:{PREFIX}:{name}:{i}" for i in range(chats)]
+    rng = random.Random(42)
+    with _RoundTrips(client) as trips:
+        started = time.perf_counter()
+        for _ in range(turns):
+            for i in range(chats):
+                question = rng.choice(_QUESTIONS)
+                await write_turn(f"{PREFIX}:{name}:{i}", question, _ANSWER * rng.randint(1, 4))
+        elapsed = time.perf_counter() - started
+
+    payload = 0
+    memory = 0
+    for key in keys:
+        payload += sum(len(raw) for raw in await client.lrange(key, 0, -1))
+        memory += await client.memory_usage(key) or 0
+    total_turns = chats * turns
+    print(
+        f"{name:<8} round-trips/turn={trips.count / total_turns:.2f} "
+        f"payload/chat={payload / chats:,.0f} B memory/chat={memory / chats:,.0f} B "
+        f"write/turn={elapsed / total_turns * 1000:.2f} ms"
+    )
+    await client.delete(*keys)
+    await client.delete(*(f"{key}:tokens" for key in keys))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--max-messages", type=int, default=20)
+    args = parser.parse_args()
+
+    client = await get_redis_bytes()
+    history = DialogHistory(max_messages=args.max_messages)
+
+    async def legacy(chat_id: str, user: str, assistant: str) -> None:
+        key = f"dialog:{chat_id}"
+        await _legacy_add(client, key, "user", user, args.max_messages)
+        await _legacy_add(client, key, "assistant", assistant, args.max_messages)
+
+    print(f"Redis: {config.REDIS_URL}, chats={args.chats}, turns={args.turns}")
+    try:
+        await _measure("legacy", client, args.chats, args.turns, legacy)
+        await _measure("add_turn", client, args.chats, args.turns, history.add_turn)
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+Бенчмарк поиска по эмбеддингам FAQ: точный перебор против HNSW/IVFFlat.
+
+Создаёт временную таблицу с синтетическим корпусом, строит ANN-индекс
+и сравнивает recall@k и задержку с точным поиском.
+
+Запуск (из src):
+    python -m benchmarks.faq_vector_search --rows 100000 --queries 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from settings import config
+
+TABLE = "faq_vector_bench"
+
+
+def _vector_literal(vec: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
+
+
+async def _fill(conn, rows: int, dim: int, clusters: int) -> None:
+    """
+    Генерирует корпус на стороне Postgres: точки вокруг случайных центров,
+    чтобы распределение было ближе к реальным эмбеддингам, чем равномерный шум.
+    """
+    await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    await conn.execute(text(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, embedding vector({dim}))"))
+    await conn.execute(text(f"CREATE TEMP TABLE {TABLE}_centers AS SELECT c AS cid, "
+                            f"(SELECT array_agg(random() - 0.5) FROM generate_series(1, {dim}) WHERE c > 0) AS v "
+                            f"FROM generate_series(1, {clusters}) c"))
+    await conn.execute(
+        text(
+            f"INSERT INTO {TABLE} (embedding) "
+            f"SELECT (SELECT array_agg(c.v[i] + (random() - 0.5) * 0.3) "
+            f"        FROM generate_series(1, {dim}) i WHERE g > 0)::vector "
+            f"FROM generate_series(1, {rows}) g "
+            f"JOIN {TABLE}_centers c ON c.cid = 1 + (g % {clusters})"
+        )
+    )
+
+
+async def _timed(conn, sql: str, params: dict, k: int) -> tuple[list[int], float]:
+    started = time.perf_counter()
+    result = await conn.execute(text(sql), params)
+    ids = [r[0] for r in result.all()]
+    return ids[:k], (time.perf_counter() - started) * 1000
+
+
+def _summary(name: str, latencies: list[float], recalls: list[float] | None = None) -> str:
+    lat = sorted(latencies)
+    p95 = lat[int(len(lat) * 0.95) - 1] if len(lat) > 1 else lat[0]
+    line = f"{name:<28} p50={statistics.median(lat):7.2f} ms  p95={p95:7.2f} ms"
+    if recalls is not None:
+        line += f"  recall={statistics.mean(recalls):.4f}"
+    return line
+
+
+async def run(args: argparse.Namespace) -> None:
+    engine = create_async_engine(config.DATABASE_URL)
+    rng = np.random.default_rng(42)
+    query_sql = (
+        f"SELECT id FROM {TABLE} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"
+    )
+
+    async with engine.begin() as conn:
+        if not args.reuse:
+            print(f"Generating {args.rows} rows, dim={args.dim} ...")
+            started = time.perf_counter()
+            await _fill(conn, args.rows, args.dim, args.clusters)
+            print(f"  done in {time.perf_counter() - started:.1f} s")
+
+    queries = [_vector_literal(rng.random(args.dim, dtype=np.float32) - 0.5) for _ in range(args.queries)]
+
+    exact: list[list[int]] = []
+    exact_lat: list[float] = []
+    async with engine.connect() as conn:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {TABLE}_ann"))
+        await conn.commit()
+        for q in queries:
+            ids, ms = await _timed(conn, query_sql, {"q": q, "k": args.k}, args.k)
+            exact.append(ids)
+            exact_lat.append(ms)
+    print(_summary("exact (seq scan)", exact_lat))
+
+    async with engine.connect() as conn:
+        started = time.perf_counter()
+        if args.index == "hnsw":
+            await conn.execute(text(
+                f"CREATE INDEX {TABLE}_ann ON {TABLE} USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {args.m}, ef_construction = {args.ef_construction})"
+            ))
+        else:
+            await conn.execute(text(
+                f"CREATE INDEX {TABLE}_ann ON {TABLE} USING ivfflat (embedding vector_cosine_ops) "
+                f"WITH (lists = {args.lists})"
+            ))
+        await conn.commit()
+        print(f"Built {args.index} index in {time.perf_counter() - started:.1f} s")
+
+        param = "hnsw.ef_search" if args.index == "hnsw" else "ivfflat.probes"
+        for value in args.values:
+            await conn.execute(text(f"SET {param} = {int(value)}"))
+            lat: list[float] = []
+            recalls: list[float] = []
+            for q, truth in zip(queries, exact):
+                ids, ms = await _timed(conn, query_sql, {"q": q, "k": args.k}, args.k)
+                lat.append(ms)
+                recalls.append(len(set(ids) & set(truth)) / max(len(truth), 1))
+            print(_summary(f"{args.index} {param}={value}", lat, recalls))
+
+    if not args.keep:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--index", choices=("hnsw", "ivfflat"), default="hnsw")
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--lists", type=int, default=300)
+    parser.add_argument(
+        "--values",
+        type=int,
+        nargs="+",
+        default=[10, 20, 40, 80, 160],
+        help="значения ef_search (hnsw) или probes (ivfflat)",
+    )
+    parser.add_argument("--reuse", action="store_true", help="не пересоздавать таблицу")
+    parser.add_argument("--keep", action="store_true", help="не удалять таблицу после прогона")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
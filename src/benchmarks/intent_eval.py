@@ -0,0 +1,153 @@
+"""
+Офлайн-оценка локального классификатора намерений против LLM.
+
+Правила LocalIntentClassifier и примеры из промпта IntentRouter
+(INTENT_EXAMPLES, на них же обучается n-граммная модель) писались
+по одним и тем же вопросам, поэтому оценка идёт на отложенном наборе
+intent_holdout.jsonl, которого не видели ни правила, ни модель, ни LLM
+в промпте. Вопросы набора, совпадающие с INTENT_EXAMPLES, отбрасываются.
+Правила и модель отчитываются отдельно: покрытие и точность правил,
+точность модели на том, что правила не покрыли, и модели самой по себе.
+
+Свой набор — JSONL со строками {"text": ..., "intent": ...}.
+
+Запуск (из src):
+    python -m benchmarks.intent_eval
+    python -m benchmarks.intent_eval --data intents.jsonl --llm
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from apps.knowledge_base.intent_router import IntentRouter
+from apps.knowledge_base.services.intent_classifier import (
+    INTENT_EXAMPLES,
+    INTENTS,
+    IntentPrediction,
+    LocalIntentClassifier,
+)
+from utils.text import normalize
+from common.openai_client import close_openai_client, init_openai_client
+
+
+HOLDOUT_PATH = Path(__file__).with_name("intent_holdout.jsonl")
+
+
+def _load(path: Path) -> List[Tuple[str, str]]:
+    seen = {normalize(text) for text, _ in INTENT_EXAMPLES}
+    rows, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if normalize(item["text"]) in seen:
+                skipped += 1
+                continue
+            rows.append((item["text"], item["intent"]))
+    if skipped:
+        print(f"skipped {skipped} examples present in INTENT_EXAMPLES")
+    return rows
+
+
+def _accuracy(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return "—"
+    ok = sum(g == p for g, p in pairs)
+    return f"{ok}/{len(pairs)} = {ok / len(pairs):.3f}"
+
+
+def _confusion(gold: List[str], pred: List[str]) -> str:
+    counts = Counter(zip(gold, pred))
+    header = "gold\\pred".ljust(10) + "".join(p.rjust(8) for p in INTENTS)
+    lines = [header]
+    for g in INTENTS:
+        lines.append(g.ljust(10) + "".join(str(counts[(g, p)]).rjust(8) for p in INTENTS))
+    return "\n".join(lines)
+
+
+def _report_local(
+    rows: List[Tuple[str, str]],
+    preds: List[IntentPrediction],
+    by_rules: List[Optional[IntentPrediction]],
+    by_model: List[str],
+    thresholds: List[float],
+) -> None:
+    gold = [label for _, label in rows]
+    labels = [p.intent for p in preds]
+
+    covered = [(g, r.intent) for g, r in zip(gold, by_rules) if r is not None]
+    rest = [(g, m) for g, m, r in zip(gold, by_model, by_rules) if r is None]
+    print(f"rules coverage: {len(covered)}/{len(rows)} = {len(covered) / len(rows):.3f}")
+    print(f"rules accuracy on covered: {_accuracy(covered)}")
+    print(f"model accuracy on not covered by rules: {_accuracy(rest)}")
+    print(f"model alone on all: {_accuracy(list(zip(gold, by_model)))}")
+    print(f"rules + model: {_accuracy(list(zip(gold, labels)))}")
+
+    print("\nthreshold  coverage  accuracy_on_covered")
+    for t in thresholds:
+        covered = [(g, p) for g, p in zip(gold, preds) if p.confidence >= t]
+        acc = sum(g == p.intent for g, p in covered) / len(covered) if covered else 0.0
+        print(f"{t:9.2f}  {len(covered) / len(rows):8.3f}  {acc:19.3f}")
+
+    print("\n" + _confusion(gold, labels))
+
+    errors = [(t, g, p) for (t, g), p in zip(rows, preds) if g != p.intent]
+    if errors:
+        print("\nerrors:")
+        for text, g, p in errors:
+            print(f"  [{g} → {p.intent} {p.source} {p.confidence:.2f}] {text}")
+
+
+async def _report_llm(rows: List[Tuple[str, str]], preds: List[IntentPrediction]) -> None:
+    await init_openai_client()
+    router = IntentRouter()
+    try:
+        started = time.perf_counter()
+        llm = await asyncio.gather(*(router.classify_llm(text) for text, _ in rows))
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_openai_client()
+
+    gold = [label for _, label in rows]
+    correct = sum(g == p for g, p in zip(gold, llm))
+    agree = sum(p.intent == l for p, l in zip(preds, llm))
+    print(f"\nllm accuracy: {correct}/{len(rows)} = {correct / len(rows):.3f} ({elapsed:.1f} s)")
+    print(f"local/llm agreement: {agree}/{len(rows)} = {agree / len(rows):.3f}")
+    print("\n" + _confusion(gold, llm))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--data", type=Path, default=HOLDOUT_PATH, help="JSONL с полями text и intent"
+    )
+    parser.add_argument("--llm", action="store_true", help="также прогнать LLM-классификатор")
+    parser.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="+",
+        default=[0.5, 0.6, 0.7, 0.8, 0.9],
+    )
+    args = parser.parse_args()
+
+    rows = _load(args.data)
+    classifier = LocalIntentClassifier()
+    started = time.perf_counter()
+    preds = [classifier.classify(text) for text, _ in rows]
+    per_message = (time.perf_counter() - started) / len(rows) * 1000
+    by_rules = [classifier.rules(text) for text, _ in rows]
+    by_model = [classifier.model_predict(text)[0] for text, _ in rows]
+    print(f"examples={len(rows)} ({args.data.name})  local classify {per_message:.2f} ms/message\n")
+    _report_local(rows, preds, by_rules, by_model, args.thresholds)
+
+    if args.llm:
+        asyncio.run(_report_llm(rows, preds))
+
+
+if __name__ == "__main__":
+    main()
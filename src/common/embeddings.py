@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from typing import Sequence
+
+import numpy as np
+
+from common.metrics import timed
+from common.openai_client import ensure_openai_client
+from common.redis_client import get_redis_bytes
+from settings import config
+from utils.text import normalize
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+_KEY_PREFIX = "emb"
+
+_embedding_cache: EmbeddingCache | None = None
+
+
+class EmbeddingCache:
+    """
+    Контентно-адресуемый кеш эмбеддингов.
+    Ключ — хеш модели и нормализованного текста, значение — float32-байты в Redis.
+    Перед Redis стоит ограниченный LRU в памяти процесса.
+    """
+
+    def __init__(self, max_local: int | None = None, ttl: int | None = None) -> None:
+        self._max_local = max_local if max_local is not None else config.EMBEDDING_CACHE_LOCAL_SIZE
+        self._ttl = ttl if ttl is not None else config.EMBEDDING_CACHE_TTL
+        self._local: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{normalize(text or '')}".encode("utf-8")).hexdigest()
+        return f"{_KEY_PREFIX}:{digest}"
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._local[key] = vector
+        self._local.move_to_end(key)
+        while len(self._local) > self._max_local:
+            self._local.popitem(last=False)
+
+    async def get_many(self, model: str, texts: Sequence[str]) -> list[np.ndarray | None]:
+        """
+        Возвращает эмбеддинги из кеша (None — промах) в порядке texts.
+        """
+        keys = [self.key(model, t) for t in texts]
+        out: list[np.ndarray | None] = [None] * len(keys)
+        remote: list[int] = []
+        for i, key in enumerate(keys):
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+                out[i] = vector
+            else:
+                remote.append(i)
+
+        if remote:
+            redis = await get_redis_bytes()
+            values = await redis.mget([keys[i] for i in remote])
+            for i, raw in zip(remote, values):
+                if raw:
+                    vector = np.frombuffer(raw, dtype=np.float32)
+                    self._remember(keys[i], vector)
+                    out[i] = vector
+        return out
+
+    async def set_many(
+        self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]
+    ) -> None:
+        if not texts:
+            return
+        redis = await get_redis_bytes()
+        pipe = redis.pipeline(transaction=False)
+        for text, vector in zip(texts, vectors):
+            key = self.key(model, text)
+            arr = np.asarray(vector, dtype=np.float32)
+            self._remember(key, arr)
+            pipe.set(key, arr.tobytes(), ex=self._ttl)
+        await pipe.execute()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+async def embed_batch(
+    texts: Sequence[str], model: str = EMBEDDING_MODEL
+) -> tuple[list[list[float]], int]:
+    """
+    Возвращает эмбеддинги текстов и число потраченных токенов.
+    Промахи кеша отправляются одним запросом к OpenAI.
+    """
+    cache = get_embedding_cache()
+    cached = await cache.get_many(model, texts)
+    missing = [i for i, v in enumerate(cached) if v is None]
+    tokens = 0
+
+    if missing:
+        inputs = [texts[i] or "" for i in missing]
+        client = await ensure_openai_client()
+        resp = await client.embeddings.create(model=model, input=inputs)
+        vectors = [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+        tokens = resp.usage.total_tokens if resp.usage else 0
+        await cache.set_many(model, inputs, vectors)
+        for i, vector in zip(missing, vectors):
+            cached[i] = np.asarray(vector, dtype=np.float32)
+
+    return [v.tolist() for v in cached], tokens
+
+
+@timed("embedding")
+async def get_embeddings(
+    texts: Sequence[str], model: str = EMBEDDING_MODEL
+) -> list[list[float]]:
+    """
+    Возвращает эмбеддинги текстов: из кеша или одним запросом к OpenAI для промахов.
+    """
+    vectors, _ = await embed_batch(texts, model)
+    return vectors
+
+
+async def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> list[float]:
+    """
+    Возвращает эмбеддинг текста фиксированной длины 1536.
+    """
+    return (await get_embeddings([text], model))[0]
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict
+
+import httpx
+
+from common.metrics import registry
+from logger.config import get_logger
+from settings import config
+
+logger = get_logger(__name__)
+
+HTTP_RETRIES = registry.counter(
+    "fujida_http_retries_total",
+    "Outbound HTTP requests retried after 429/5xx or a transport error.",
+    ("host",),
+)
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Ошибки, при которых запрос заведомо не дошёл до сервера.
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_host_limits: Dict[str, asyncio.Semaphore] = {}
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_CONNECTIONS // 2,
+        keepalive_expiry=60.0,
+    )
+
+
+def _build_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        timeout=config.HTTP_TIMEOUT,
+        connect=5.0,
+    )
+
+
+def get_http_client(name: str = "default") -> httpx.AsyncClient:
+    """
+    Общий httpx-клиент с пулом keep-alive соединений (HTTP/2, если есть h2).
+    Клиенты живут до close_http_clients в lifespan.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=_build_limits(),
+            timeout=_build_timeout(),
+        )
+        _clients[name] = client
+    return client
+
+
+async def close_http_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    _host_limits.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _host_limit(host: str) -> asyncio.Semaphore:
+    sem = _host_limits.get(host)
+    if sem is None:
+        sem = _host_limits[host] = asyncio.Semaphore(config.HTTP_PER_HOST_LIMIT)
+    return sem
+
+
+def _retry_delay(attempt: int, response: httpx.Response | None) -> float:
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), config.HTTP_BACKOFF_MAX)
+            except ValueError:
+                try:
+                    at = parsedate_to_datetime(retry_after)
+                    delta = (at - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(delta, 0.0), config.HTTP_BACKOFF_MAX)
+                except (TypeError, ValueError):
+                    pass
+    delay = config.HTTP_BACKOFF_BASE * (2 ** attempt)
+    return min(delay, config.HTTP_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    client_name: str = "default",
+    retries: int | None = None,
+    idempotent: bool | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Запрос через общий клиент: не больше HTTP_PER_HOST_LIMIT одновременных
+    запросов на хост, повтор с экспоненциальной задержкой на 429/5xx
+    и сетевых ошибках (Retry-After учитывается).
+
+    Неидемпотентные запросы (по умолчанию POST и PATCH) повторяются только
+    на 429 и если соединение не установилось: после таймаута чтения или 5xx
+    сервер мог уже выполнить запрос, и повтор, например, отправит сообщение
+    WhatsApp дважды.
+    """
+    client = get_http_client(client_name)
+    host = httpx.URL(url).host
+    attempts = (retries if retries is not None else config.HTTP_RETRIES) + 1
+    if idempotent is None:
+        idempotent = method.upper() in _IDEMPOTENT_METHODS
+    retry_statuses = _RETRY_STATUSES if idempotent else {429}
+    retry_errors = httpx.TransportError if idempotent else _NOT_SENT_ERRORS
+
+    for attempt in range(attempts):
+        response: httpx.Response | None = None
+        try:
+            async with _host_limit(host):
+                response = await client.request(method, url, **kwargs)
+            if response.status_code not in retry_statuses or attempt == attempts - 1:
+                return response
+            logger.warning("HTTP %s %s -> %d, retrying", method, host, response.status_code)
+        except retry_errors as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning("HTTP %s %s failed: %s, retrying", method, host, e)
+
+        HTTP_RETRIES.inc(host=host)
+        await asyncio.sleep(_retry_delay(attempt, response))
+
+    raise RuntimeError("unreachable")
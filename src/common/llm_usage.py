@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Tuple
+
+from common.metrics import LLM_REQUESTS, LLM_TOKENS
+from logger.config import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class UsageStats:
+    calls: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+class LLMUsageRegistry:
+    """
+    Счётчики токенов OpenAI по месту вызова и модели:
+    входные, закешированные провайдером (prompt caching) и выходные.
+    """
+
+    def __init__(self) -> None:
+        self._stats: Dict[Tuple[str, str], UsageStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, call_site: str, model: str, usage: Any) -> None:
+        """
+        Учитывает usage из ответа Responses API (может быть None).
+        """
+        if usage is None:
+            return
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+        details = getattr(usage, "input_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+        with self._lock:
+            stats = self._stats.setdefault((call_site, model), UsageStats())
+            stats.calls += 1
+            stats.input_tokens += input_tokens
+            stats.cached_tokens += cached_tokens
+            stats.output_tokens += output_tokens
+
+        LLM_REQUESTS.inc(call_site=call_site, model=model)
+        LLM_TOKENS.inc(input_tokens, call_site=call_site, model=model, kind="input")
+        LLM_TOKENS.inc(cached_tokens, call_site=call_site, model=model, kind="cached")
+        LLM_TOKENS.inc(output_tokens, call_site=call_site, model=model, kind="output")
+
+        logger.info(
+            "LLM usage site=%s model=%s input=%d cached=%d output=%d",
+            call_site,
+            model,
+            input_tokens,
+            cached_tokens,
+            output_tokens,
+        )
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """
+        Текущие счётчики с долей закешированных входных токенов.
+        """
+        with self._lock:
+            items = sorted(self._stats.items())
+            return [
+                {
+                    "call_site": site,
+                    "model": model,
+                    **asdict(stats),
+                    "cache_hit_rate": round(stats.cache_hit_rate, 4),
+                }
+                for (site, model), stats in items
+            ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+llm_usage = LLMUsageRegistry()
+
+
+def record_usage(call_site: str, response: Any) -> None:
+    """
+    Записывает usage ответа OpenAI в общий реестр.
+    """
+    llm_usage.record(call_site, getattr(response, "model", "") or "", getattr(response, "usage", None))
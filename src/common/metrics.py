@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import abc
+import functools
+import inspect
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+_LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> _LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self, peers: Sequence[list] = ()) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(peers),
+        ]
+
+    @abc.abstractmethod
+    def dump(self) -> list:
+        """
+        Значения в JSON-совместимом виде — для суммирования между воркерами.
+        """
+
+    @abc.abstractmethod
+    def _samples(self, peers: Sequence[list]) -> List[str]:
+        """
+        Строки экспозиции с учётом снимков других воркеров (peers).
+        """
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_LabelValues, float] = {} if self.labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def dump(self) -> list:
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def _samples(self, peers: Sequence[list]) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        for dump in peers:
+            for key, value in dump:
+                key = tuple(key)
+                values[key] = values.get(key, 0.0) + value
+        items = sorted(values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets))
+        self._counts: Dict[_LabelValues, List[int]] = {}
+        self._sums: Dict[_LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self._buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self._buckets) + 1)
+                self._sums[key] = 0.0
+            counts[idx] += 1
+            self._sums[key] += value
+
+    def dump(self) -> list:
+        with self._lock:
+            return [[list(k), list(c), self._sums[k]] for k, c in self._counts.items()]
+
+    def _samples(self, peers: Sequence[list]) -> List[str]:
+        with self._lock:
+            merged = {k: [list(c), self._sums[k]] for k, c in self._counts.items()}
+        for dump in peers:
+            for key, counts, total in dump:
+                key = tuple(key)
+                if len(counts) != len(self._buckets) + 1:
+                    continue
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = [list(counts), total]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], counts)]
+                    current[1] += total
+        items = sorted((k, c, t) for k, (c, t) in merged.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self._buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Минимальный реестр метрик в формате Prometheus text exposition 0.0.4.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def dump(self) -> Dict[str, list]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.dump() for m in metrics}
+
+    def render(self, peers: Sequence[Dict[str, list]] = ()) -> str:
+        """
+        peers — dump() других воркеров того же хоста: их значения
+        суммируются с локальными.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render([p[metric.name] for p in peers if metric.name in p]))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = registry.histogram(
+    "fujida_stage_duration_seconds",
+    "Latency of chat pipeline stages.",
+    ("stage",),
+)
+STAGE_ERRORS = registry.counter(
+    "fujida_stage_errors_total",
+    "Exceptions raised inside chat pipeline stages.",
+    ("stage",),
+)
+INTENTS = registry.counter(
+    "fujida_intents_total",
+    "Classified user messages by intent and classifier tier.",
+    ("intent", "source"),
+)
+LLM_REQUESTS = registry.counter(
+    "fujida_llm_requests_total",
+    "OpenAI Responses API calls by call site and model.",
+    ("call_site", "model"),
+)
+LLM_TOKENS = registry.counter(
+    "fujida_llm_tokens_total",
+    "OpenAI tokens by call site, model and kind (input, cached, output).",
+    ("call_site", "model", "kind"),
+)
+OPENAI_RETRIES = registry.counter(
+    "fujida_openai_retries_total",
+    "Requests re-sent by the OpenAI client after a failure.",
+)
+OPENAI_ERRORS = registry.counter(
+    "fujida_openai_errors_total",
+    "OpenAI HTTP responses with an error status.",
+    ("status",),
+)
+
+
+class timed:
+    """
+    Замер длительности этапа в гистограмму fujida_stage_duration_seconds.
+
+        with timed("intent"):
+            ...
+
+        @timed("voice_transcription")
+        async def transcribe(...): ...
+    """
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.elapsed = 0.0
+        self._started = 0.0
+
+    def __enter__(self) -> "timed":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.elapsed = time.perf_counter() - self._started
+        STAGE_SECONDS.observe(self.elapsed, stage=self.stage)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            STAGE_ERRORS.inc(stage=self.stage)
+
+    def __call__(self, func: Callable) -> Callable:
+        stage = self.stage
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
@@ -1,6 +1,8 @@
 import importlib.util
 import httpx
 from openai import AsyncOpenAI
+
+from common.metrics import OPENAI_ERRORS, OPENAI_RETRIES
 from settings import config
 
 _httpx_client: httpx.AsyncClient | None = None
@@ -29,6 +31,23 @@ def _build_timeout() -> httpx.Timeout:
     )
 
 
+async def _on_request(request: httpx.Request) -> None:
+    """
+    SDK OpenAI помечает повторные попытки заголовком x-stainless-retry-count.
+    """
+    try:
+        retry = int(request.headers.get("x-stainless-retry-count", "0"))
+    except ValueError:
+        retry = 0
+    if retry > 0:
+        OPENAI_RETRIES.inc()
+
+
+async def _on_response(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        OPENAI_ERRORS.inc(status=response.status_code)
+
+
 async def init_openai_client() -> None:
     global _httpx_client, openai_client
     if _httpx_client is None:
@@ -36,6 +55,7 @@ async def init_openai_client() -> None:
             http2=_http2_available(),
             limits=_build_limits(),
             timeout=_build_timeout(),
+            event_hooks={"request": [_on_request], "response": [_on_response]},
         )
     if openai_client is None:
         openai_client = AsyncOpenAI(
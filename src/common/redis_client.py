@@ -2,6 +2,7 @@ import redis.asyncio as redis
 from settings import config
 
 _redis: redis.Redis | None = None
+_redis_bytes: redis.Redis | None = None
 
 
 async def init_redis() -> None:
@@ -20,8 +21,21 @@ async def get_redis() -> redis.Redis:
     return _redis
 
 
+async def get_redis_bytes() -> redis.Redis:
+    """
+    Клиент без декодирования ответов — для бинарных значений.
+    """
+    global _redis_bytes
+    if _redis_bytes is None:
+        _redis_bytes = redis.from_url(config.REDIS_URL, decode_responses=False)
+    return _redis_bytes
+
+
 async def close_redis() -> None:
-    global _redis
+    global _redis, _redis_bytes
     if _redis is not None:
         await _redis.aclose()
-        _redis = None
\ No newline at end of file
+        _redis = None
+    if _redis_bytes is not None:
+        await _redis_bytes.aclose()
+        _redis_bytes = None
\ No newline at end of file
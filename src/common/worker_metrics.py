@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+from typing import Dict, List
+
+from common.metrics import registry
+from common.redis_client import get_redis
+from logger.config import get_logger
+from settings import config
+
+logger = get_logger(__name__)
+
+_PREFIX = "metrics:worker"
+
+
+def _host_prefix() -> str:
+    return f"{_PREFIX}:{socket.gethostname()}"
+
+
+def _own_key() -> str:
+    return f"{_host_prefix()}:{os.getpid()}"
+
+
+def multi_worker() -> bool:
+    return config.WEB_CONCURRENCY > 1
+
+
+async def publish_metrics() -> None:
+    """
+    Сохраняет снимок метрик процесса в Redis (живёт три интервала публикации).
+    """
+    redis = await get_redis()
+    ttl = max(int(config.METRICS_SHARE_INTERVAL * 3), 1)
+    await redis.set(_own_key(), json.dumps(registry.dump()), ex=ttl)
+
+
+async def run_metrics_publisher() -> None:
+    """
+    Фоновая публикация метрик, пока uvicorn запущен с несколькими воркерами:
+    /metrics попадает в случайный воркер и суммирует снимки остальных.
+    """
+    while True:
+        try:
+            await publish_metrics()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Metrics publish failed: %s", e)
+        await asyncio.sleep(config.METRICS_SHARE_INTERVAL)
+
+
+async def peer_metrics() -> List[Dict[str, list]]:
+    """
+    Снимки метрик других воркеров этого хоста. Реплики на других хостах
+    собираются Prometheus по отдельности и здесь не учитываются.
+    """
+    redis = await get_redis()
+    own = _own_key()
+    keys = [k async for k in redis.scan_iter(match=f"{_host_prefix()}:*", count=100) if k != own]
+    if not keys:
+        return []
+    return [json.loads(raw) for raw in await redis.mget(keys) if raw]
+
@@ -0,0 +1,33 @@
+"""add faq embedding hnsw index
+
+Revision ID: e3a9f0c51b27
+Revises: b7d41c2e9a10
+Create Date: 2026-10-17 11:40:03.771935
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a9f0c51b27'
+down_revision: Union[str, None] = 'b7d41c2e9a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_faq_entries_embedding_hnsw',
+        'faq_entries',
+        ['embedding'],
+        unique=False,
+        postgresql_using='hnsw',
+        postgresql_with={'m': 16, 'ef_construction': 64},
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_faq_entries_embedding_hnsw', table_name='faq_entries')
@@ -11,3 +11,4 @@ class FAQEntry(Base):
     question: Mapped[str] = mapped_column(String, nullable=False, unique=True)
     answer: Mapped[str] = mapped_column(String, nullable=False)
     embedding: Mapped[list[float]] = mapped_column(Vector(1536), nullable=False)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
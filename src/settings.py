@@ -15,6 +15,18 @@ class Settings(BaseSettings):
     TELEGRAM_BOT_TOKEN: str
     OPENAI_API_KEY: str | None = None
     WEBHOOK_URL: str
+    TELEGRAM_BACKGROUND_UPDATES: bool = True
+    TELEGRAM_MAX_CONCURRENT_UPDATES: int = 100
+    TELEGRAM_UPDATE_DEDUPE_TTL: int = 24 * 3600
+    TELEGRAM_DRAIN_TIMEOUT: float = 30.0
+    TELEGRAM_CHAT_LOCK_TTL: float = 120.0
+    TELEGRAM_CHAT_LOCK_POLL: float = 0.05
+    # None — снимать вебхук при остановке, только если воркер один (WEB_CONCURRENCY=1).
+    TELEGRAM_DELETE_WEBHOOK_ON_SHUTDOWN: bool | None = None
+    FSM_STATE_TTL: int | None = 7 * 24 * 3600
+
+    WEB_CONCURRENCY: int = 1
+    METRICS_SHARE_INTERVAL: float = 5.0
     
     POSTGRES_DB: str
     POSTGRES_USER: str
@@ -24,13 +36,64 @@ class Settings(BaseSettings):
     DATABASE_URL: str
 
     REDIS_URL: str = "redis://redis:6379/0"
+
+    SPECULATIVE_RETRIEVAL: bool = True
+    INTENT_LOCAL_CLASSIFIER: bool = True
+    INTENT_LOCAL_MIN_CONFIDENCE: float = 0.8
+    INTENT_COMBINED_ROUTER: bool = True
+    DEVICE_CONTEXT_TOKEN_BUDGET: int = 1500
+    STREAM_ANSWERS: bool = True
+    STREAM_EDIT_INTERVAL: float = 1.0
+
+    HISTORY_MAX_MESSAGES: int = 20
+    HISTORY_TOKEN_BUDGET: int | None = 1500
+    HISTORY_MAX_ENTRIES: int = 200
+    HISTORY_IDLE_TTL: int = 30 * 24 * 3600
+    HISTORY_SUMMARY_MODEL: str = "gpt-4o-mini"
+    HISTORY_SUMMARY_MAX_TOKENS: int = 300
+
+    VOICE_MAX_DURATION: int = 120
+    VOICE_MAX_FILE_SIZE: int = 20 * 1024 * 1024
+    VOICE_MAX_CONCURRENCY: int = 4
+    VOICE_FFMPEG_WORKERS: int = 2
+
+    EMBEDDING_CACHE_TTL: int = 30 * 24 * 3600
+    EMBEDDING_CACHE_LOCAL_SIZE: int = 4096
+
+    FAQ_INMEMORY_MAX_ROWS: int = 50_000
+    FAQ_HNSW_EF_SEARCH: int = 40
+    FAQ_IVFFLAT_PROBES: int = 10
+
+    FAQ_ANSWER_CACHE_SIMILARITY: float = 0.95
+    FAQ_ANSWER_CACHE_TTL: int = 7 * 24 * 3600
+    FAQ_ANSWER_CACHE_MAX_ENTRIES: int = 2000
     
     GOOGLE_SHEETS_CREDS: str
     GOOGLE_SHEETS_NAME: str
+    SHEETS_QUEUE_MAX: int = 1000
+    SHEETS_BATCH_SIZE: int = 50
+    SHEETS_FLUSH_INTERVAL: float = 5.0
+    SHEETS_SPILL_PATH: str | None = "/tmp/fujida_sheets_spill.jsonl"
     
     GREEN_API_URL: str
     GREEN_API_INSTANCE_ID: int
     GREEN_API_TOKEN: str
+    WHATSAPP_MAX_MESSAGE_LEN: int = 4096
+    WHATSAPP_WORKERS: int = 4
+    WHATSAPP_STREAM_PARTITIONS: int = 16
+    WHATSAPP_STREAM_MAXLEN: int = 100_000
+    WHATSAPP_READ_BATCH: int = 10
+    WHATSAPP_POLL_INTERVAL: float = 0.2
+    WHATSAPP_LEASE_TTL: float = 120.0
+    WHATSAPP_DEDUPE_TTL: int = 24 * 3600
+    WHATSAPP_MAX_DELIVERIES: int = 5
+
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_PER_HOST_LIMIT: int = 10
+    HTTP_TIMEOUT: float = 10.0
+    HTTP_RETRIES: int = 3
+    HTTP_BACKOFF_BASE: float = 0.5
+    HTTP_BACKOFF_MAX: float = 10.0
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
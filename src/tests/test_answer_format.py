@@ -0,0 +1,88 @@
+from utils.answer_format import format_answer
+
+
+def test_unsafe_href_is_unwrapped():
+    answer = format_answer('<a href="javascript:alert(1)">ссылка</a>')
+    assert answer.html == "ссылка"
+    assert answer.plain == "ссылка"
+
+
+def test_allowed_link_is_kept():
+    answer = format_answer('<a href="https://fujida.ru">сайт</a>')
+    assert answer.html == '<a href="https://fujida.ru">сайт</a>'
+    assert answer.plain == "сайт (https://fujida.ru)"
+    assert answer.log == "сайт"
+
+
+def test_unknown_tags_and_attrs_are_dropped():
+    answer = format_answer('<div onclick="x()"><b style="color:red">жирный</b></div>')
+    assert answer.html == "<b>жирный</b>"
+
+
+def test_unclosed_tags_are_closed():
+    assert format_answer("<b>жирный <i>курсив").html == "<b>жирный <i>курсив</i></b>"
+
+
+def test_misnested_closing_tag_closes_inner_tags():
+    assert format_answer("<b>жирный <i>курсив</b> текст").html == "<b>жирный <i>курсив</i></b> текст"
+
+
+def test_stray_closing_tag_is_dropped():
+    assert format_answer("текст</b> конец").html == "текст конец"
+
+
+def test_span_kept_only_as_spoiler():
+    answer = format_answer('<span>a</span> <span class="tg-spoiler">b</span>')
+    assert answer.html == 'a <span class="tg-spoiler">b</span>'
+    assert answer.plain == "a b"
+
+
+def test_bare_specials_are_escaped():
+    answer = format_answer("1 < 2 > 0 & x")
+    assert answer.html == "1 &lt; 2 &gt; 0 &amp; x"
+    assert answer.plain == "1 < 2 > 0 & x"
+    assert answer.log == "1 < 2 > 0 & x"
+
+
+def test_existing_entities_are_not_double_escaped():
+    answer = format_answer("a &amp; b &lt;3 &#8212; c")
+    assert answer.html == "a &amp; b &lt;3 &#8212; c"
+    assert answer.plain == "a & b <3 — c"
+
+
+def test_markdown_link_outside_a():
+    answer = format_answer("[сайт](https://fujida.ru) и [https://a.ru](https://a.ru)")
+    assert answer.html == (
+        '<a href="https://fujida.ru">сайт</a> и <a href="https://a.ru">https://a.ru</a>'
+    )
+    assert answer.plain == "сайт (https://fujida.ru) и https://a.ru"
+    assert answer.log == "сайт и https://a.ru"
+
+
+def test_markdown_link_inside_a_is_not_nested():
+    answer = format_answer('<a href="https://a.ru">[x](https://b.ru)</a>')
+    assert answer.html == '<a href="https://a.ru">x</a>'
+    assert answer.plain == "x (https://a.ru)"
+    assert answer.log == "x"
+
+
+def test_nested_a_tag_is_unwrapped():
+    answer = format_answer('<a href="https://a.ru">a <a href="https://b.ru">b</a> c</a> d')
+    assert answer.html == '<a href="https://a.ru">a b c</a> d'
+
+
+def test_markdown_and_meta_phrases_are_removed():
+    answer = format_answer("Согласно данным, **важно**\n## Заголовок\n```\ncode\n```")
+    assert answer.html == "важно\nЗаголовок"
+    assert answer.plain == answer.log == "важно\nЗаголовок"
+
+
+def test_br_and_blank_lines():
+    answer = format_answer("строка<br>вторая\n\n\n\nтретья")
+    assert answer.html == answer.plain == answer.log == "строка\nвторая\n\nтретья"
+
+
+def test_plain_and_log_have_no_tags():
+    answer = format_answer('<b>Karma</b> <i>Pro</i> — <a href="https://fujida.ru">страница</a>')
+    assert answer.plain == "Karma Pro — страница (https://fujida.ru)"
+    assert answer.log == "Karma Pro — страница"
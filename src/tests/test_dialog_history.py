@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from apps.knowledge_base.services.dialog_history import decode_entry, encode_entry
+from utils.text import estimate_tokens
+
+
+@pytest.mark.parametrize("role", ["user", "assistant"])
+def test_roundtrip(role):
+    raw = encode_entry(role, "Как обновить базу камер?", 12)
+    assert decode_entry(raw) == (role, "Как обновить базу камер?", 12)
+
+
+def test_tokens_are_capped():
+    assert decode_entry(encode_entry("assistant", "x", 70000)) == ("assistant", "x", 0xFFFF)
+
+
+def test_empty_content():
+    assert decode_entry(encode_entry("user", "", 0)) == ("user", "", 0)
+
+
+def test_legacy_json_entry():
+    raw = json.dumps({"role": "user", "content": "привет", "tokens": 3}).encode()
+    assert decode_entry(raw) == ("user", "привет", 3)
+
+
+def test_legacy_json_entry_without_tokens():
+    raw = json.dumps({"role": "assistant", "content": "ответ"}).encode()
+    assert decode_entry(raw) == ("assistant", "ответ", estimate_tokens("ответ"))
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        b"",
+        b"{not json",
+        json.dumps({"role": "user"}).encode(),
+        b"\x01\x00",
+        b"\x09\x00\x01text",
+    ],
+)
+def test_invalid_entries(raw):
+    assert decode_entry(raw) is None
+
+
+def test_broken_utf8_is_replaced():
+    raw = encode_entry("user", "ok", 1) + b"\xff"
+    assert decode_entry(raw) == ("user", "ok�", 1)
@@ -0,0 +1,55 @@
+import pytest
+
+from apps.knowledge_base.services.specs_search import SpecCondition, parse_specs_query
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["какие не поддерживают gps", "отсутствуют gps", "модели без gps"],
+)
+def test_negation(query):
+    assert parse_specs_query(query) == [SpecCondition("gps", "eq", False)]
+
+
+def test_presence():
+    assert parse_specs_query("с gps") == [SpecCondition("gps", "eq", True)]
+
+
+def test_mixed_flags():
+    assert parse_specs_query("какие модели с wifi и без gps") == [
+        SpecCondition("wifi", "eq", True),
+        SpecCondition("gps", "eq", False),
+    ]
+
+
+@pytest.mark.parametrize("query", ["экран от 3 до 4 дюймов", "от 3 до 4 дюймов экран"])
+def test_range(query):
+    assert parse_specs_query(query) == [
+        SpecCondition("диагональ_экрана", "gte", 3.0),
+        SpecCondition("диагональ_экрана", "lte", 4.0),
+    ]
+
+
+def test_range_with_comma():
+    assert parse_specs_query("угол обзора от 140, до 170") == [
+        SpecCondition("угол_обзора", "gte", 140.0),
+        SpecCondition("угол_обзора", "lte", 170.0),
+    ]
+
+
+def test_comparison():
+    assert parse_specs_query("экран больше 3 дюймов") == [
+        SpecCondition("диагональ_экрана", "gt", 3.0),
+    ]
+
+
+def test_lower_bound():
+    assert parse_specs_query("гарантия от 2 лет") == [SpecCondition("гарантия_лет", "gte", 2.0)]
+
+
+def test_memory_card_up_to_means_supported_capacity():
+    assert parse_specs_query("карта памяти до 128") == [SpecCondition("microsd_гб", "gte", 128.0)]
+
+
+def test_no_conditions():
+    assert parse_specs_query("как обновить базу") == []
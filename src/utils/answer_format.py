@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import html
+import re
+from dataclasses import dataclass
+from typing import List, NamedTuple
+
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "del", "strike",
+    "code", "pre", "a", "tg-spoiler", "span", "blockquote", "tg-emoji",
+}
+ALLOWED_ATTRS = {
+    "a": {"href"},
+    "tg-emoji": {"emoji-id"},
+    "code": {"class"},
+    "pre": {"class"},
+    "span": {"class"},
+}
+_LINK_SCHEMES = ("http://", "https://", "tg://")
+
+# Вводные фразы, которые модель иногда добавляет вопреки промпту.
+META_PHRASES = (
+    "судя по предоставленной информации",
+    "согласно предоставленным данным",
+    "в контексте",
+    "согласно контексту",
+    "согласно данным",
+    "на основе предоставленных данных",
+)
+
+# Один проход по тексту: альтернативы проверяются слева направо в каждой позиции.
+_TOKEN_RE = re.compile(
+    r"(?P<fence>```.*?```)"
+    r"|(?P<mdlink>\[(?P<label>[^\]]+)\]\((?P<url>https?://[^\s)]+)\))"
+    r"|(?P<meta>\b(?:" + "|".join(re.escape(p) for p in META_PHRASES) + r")\b[:,\s]*)"
+    r"|(?P<bold>\*\*)"
+    r"|(?P<heading>^#+[ \t]*)"
+    r"|(?P<tag><(?P<close>/)?(?P<name>[a-zA-Z][\w-]*)(?P<attrs>[^<>]*)>)"
+    r"|(?P<entity>&(?:#\d+|#x[0-9a-fA-F]+|[a-zA-Z]\w*);)"
+    r"|(?P<special>[<>&])",
+    re.DOTALL | re.IGNORECASE | re.MULTILINE,
+)
+_ATTR_RE = re.compile(r"""([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+@dataclass(frozen=True)
+class FormattedAnswer:
+    """
+    Ответ для каналов: HTML для Telegram (только разрешённые теги),
+    простой текст для WhatsApp (ссылки — адресом в скобках) и текст
+    без разметки для логов.
+    """
+
+    html: str
+    plain: str
+    log: str
+
+
+class _OpenTag(NamedTuple):
+    name: str
+    href: str | None
+    emitted: bool
+    plain_start: int
+
+
+def _parse_attrs(raw: str) -> dict[str, str]:
+    return {
+        m.group(1).lower(): html.unescape(next(v for v in m.groups()[1:] if v is not None))
+        for m in _ATTR_RE.finditer(raw)
+    }
+
+
+def format_answer(text: str) -> FormattedAnswer:
+    """
+    Постобработка ответа модели за один проход: убирает code fences,
+    **жирный**, # заголовки и вводные фразы, переводит markdown-ссылки
+    в <a> (внутри другой ссылки — только подпись), оставляет только теги из ALLOWED_TAGS (незакрытые закрывает,
+    лишние закрывающие отбрасывает) и экранирует прочие <, >, &.
+    """
+    out_html: List[str] = []
+    out_plain: List[str] = []
+    out_log: List[str] = []
+    stack: List[_OpenTag] = []
+
+    def text_part(chunk: str) -> None:
+        out_html.append(chunk)
+        out_plain.append(chunk)
+        out_log.append(chunk)
+
+    def in_link() -> bool:
+        return any(tag.name == "a" and tag.emitted for tag in stack)
+
+    def close(tag: _OpenTag) -> None:
+        if not tag.emitted:
+            return
+        out_html.append(f"</{tag.name}>")
+        if tag.href and "".join(out_plain[tag.plain_start:]).strip() != tag.href:
+            out_plain.append(f" ({tag.href})")
+
+    pos = 0
+    for m in _TOKEN_RE.finditer(text):
+        if m.start() > pos:
+            text_part(text[pos:m.start()])
+        pos = m.end()
+        kind = m.lastgroup
+
+        if kind in ("fence", "meta", "bold", "heading"):
+            continue
+        if kind == "mdlink":
+            label, url = m.group("label").strip(), m.group("url").strip()
+            if in_link():
+                # Telegram не допускает вложенных ссылок: оставляем подпись.
+                out_html.append(html.escape(label, quote=False))
+                out_plain.append(label)
+                out_log.append(label)
+                continue
+            out_html.append(
+                f'<a href="{html.escape(url)}">{html.escape(label, quote=False)}</a>'
+            )
+            out_plain.append(label if label == url else f"{label} ({url})")
+            out_log.append(label)
+        elif kind == "entity":
+            out_html.append(m.group())
+            char = html.unescape(m.group())
+            out_plain.append(char)
+            out_log.append(char)
+        elif kind == "special":
+            char = m.group()
+            out_html.append(html.escape(char, quote=False))
+            out_plain.append(char)
+            out_log.append(char)
+        else:
+            name = m.group("name").lower()
+            if name == "br":
+                text_part("\n")
+                continue
+            if name not in ALLOWED_TAGS:
+                continue
+            if m.group("close"):
+                # Закрываем до ближайшего такого же открытого тега.
+                for i in range(len(stack) - 1, -1, -1):
+                    if stack[i].name == name:
+                        for tag in reversed(stack[i:]):
+                            close(tag)
+                        del stack[i:]
+                        break
+                continue
+            raw_attrs = m.group("attrs")
+            if raw_attrs.rstrip().endswith("/"):
+                continue
+            attrs = {
+                k: v for k, v in _parse_attrs(raw_attrs).items()
+                if k in ALLOWED_ATTRS.get(name, ())
+            }
+            href = attrs.get("href")
+            valid = not (
+                (name == "span" and attrs.get("class") != "tg-spoiler")
+                or (name == "a" and (not (href or "").startswith(_LINK_SCHEMES) or in_link()))
+            )
+            stack.append(_OpenTag(name, href if name == "a" else None, valid, len(out_plain)))
+            if valid:
+                rendered = "".join(f' {k}="{html.escape(v)}"' for k, v in attrs.items())
+                out_html.append(f"<{name}{rendered}>")
+
+    if pos < len(text):
+        text_part(text[pos:])
+    for tag in reversed(stack):
+        close(tag)
+
+    return FormattedAnswer(
+        html=_BLANK_LINES_RE.sub("\n\n", "".join(out_html)).strip(),
+        plain=_BLANK_LINES_RE.sub("\n\n", "".join(out_plain)).strip(),
+        log=_BLANK_LINES_RE.sub("\n\n", "".join(out_log)).strip(),
+    )
@@ -1,43 +1,261 @@
+from __future__ import annotations
+
+import asyncio
 import datetime
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Set
+
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+
+from common.metrics import registry, timed
 from settings import config
 from logger.config import get_logger
-from utils.text import strip_all_tags
 
 logger = get_logger(__name__)
 
+SHEETS_ROWS = registry.counter(
+    "fujida_sheets_rows_total",
+    "Google Sheets log rows by outcome (written, spilled, dropped).",
+    ("outcome",),
+)
+
+_sheets_logger: GoogleSheetsLogger | None = None
+
 
 class GoogleSheetsLogger:
-    def __init__(self):
-        creds_path = config.GOOGLE_SHEETS_CREDS
-        sheet_name = config.GOOGLE_SHEETS_NAME
+    """
+    Логирование диалогов в Google Sheets в фоне.
+
+    log_message только кладёт строку в ограниченную очередь; фоновый воркер
+    пишет пачками через append_rows (каждые batch_size строк или flush_interval
+    секунд) в пуле потоков, не блокируя event loop. При переполнении очереди
+    или ошибке записи строки дописываются в spill-файл и повторяются при
+    следующем старте (в фоне, старт приложения их не ждёт). Файловые
+    операции со spill-файлом идут в пуле потоков. Авторизация в Google —
+    при первой записи.
+    """
+
+    def __init__(
+        self,
+        max_queue: int | None = None,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+        spill_path: str | None = None,
+    ) -> None:
+        self._max_queue = max_queue if max_queue is not None else config.SHEETS_QUEUE_MAX
+        self._batch_size = batch_size if batch_size is not None else config.SHEETS_BATCH_SIZE
+        self._flush_interval = (
+            flush_interval if flush_interval is not None else config.SHEETS_FLUSH_INTERVAL
+        )
+        self._spill_path = spill_path if spill_path is not None else config.SHEETS_SPILL_PATH
+        self._sheet: gspread.Worksheet | None = None
+        self._sheet_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._queue: asyncio.Queue[list[str]] | None = None
+        self._worker: asyncio.Task | None = None
+        self._replay: asyncio.Task | None = None
+        self._spilling: Set[asyncio.Task] = set()
+
+    def _worksheet(self) -> gspread.Worksheet:
+        """
+        Авторизуется и открывает лист «Логи» при первом обращении.
+        """
+        with self._sheet_lock:
+            if self._sheet is not None:
+                return self._sheet
 
-        logger.info("Инициализация GoogleSheetsLogger: creds=%s, sheet=%s", creds_path, sheet_name)
+            creds_path = config.GOOGLE_SHEETS_CREDS
+            sheet_name = config.GOOGLE_SHEETS_NAME
+            logger.info("Инициализация GoogleSheetsLogger: creds=%s, sheet=%s", creds_path, sheet_name)
 
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
-        client = gspread.authorize(creds)
-        sh = client.open(sheet_name)
+            scope = [
+                "https://spreadsheets.google.com/feeds",
+                "https://www.googleapis.com/auth/drive",
+            ]
+            creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
+            client = gspread.authorize(creds)
+            sh = client.open(sheet_name)
 
+            try:
+                self._sheet = sh.worksheet("Логи")
+                logger.info("Google Sheets подключен, используем таблицу: %s", sheet_name)
+            except Exception as e:
+                logger.error("Не удалось открыть таблицу Google Sheets: %s", sheet_name, exc_info=e)
+                raise
+            return self._sheet
+
+    @timed("sheets_logging")
+    def _append_rows(self, rows: List[list[str]]) -> None:
+        self._worksheet().append_rows(rows, value_input_option="RAW")
+
+    @contextmanager
+    def _locked_spill(self) -> Iterator[None]:
+        """
+        Блокировка spill-файла и внутри процесса, и между воркерами (flock).
+        """
+        with self._spill_lock, open(f"{self._spill_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _spill(self, rows: List[list[str]]) -> bool:
+        if not self._spill_path:
+            return False
         try:
-            self.sheet = sh.worksheet("Логи")
-            logger.info("Google Sheets подключен, используем таблицу: %s", sheet_name)
+            with self._locked_spill(), open(self._spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error("Не удалось сохранить строки Google Sheets на диск", exc_info=e)
+            return False
+        return True
+
+    def _take_spilled(self) -> List[list[str]]:
+        """
+        Забирает строки, сохранённые на диск при прошлых сбоях.
+        """
+        if not self._spill_path or not os.path.exists(self._spill_path):
+            return []
+        replay_path = f"{self._spill_path}.{os.getpid()}.replay"
+        try:
+            with self._locked_spill():
+                # Файл мог уже забрать другой воркер.
+                if not os.path.exists(self._spill_path):
+                    return []
+                os.replace(self._spill_path, replay_path)
+            with open(replay_path, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            os.remove(replay_path)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error("Не удалось прочитать spill-файл Google Sheets", exc_info=e)
+            return []
+        return rows
+
+    async def _spill_async(self, rows: List[list[str]]) -> None:
+        outcome = "spilled" if await asyncio.to_thread(self._spill, rows) else "dropped"
+        SHEETS_ROWS.inc(len(rows), outcome=outcome)
+
+    def _spill_in_background(self, rows: List[list[str]]) -> None:
+        """
+        Сохраняет строки на диск, не блокируя event loop (файл и flock — в потоке).
+        """
+        try:
+            task = asyncio.get_running_loop().create_task(self._spill_async(rows))
+        except RuntimeError:
+            # Вне event loop блокировать нечего.
+            SHEETS_ROWS.inc(len(rows), outcome="spilled" if self._spill(rows) else "dropped")
+            return
+        self._spilling.add(task)
+        task.add_done_callback(self._spilling.discard)
+
+    async def _replay_spilled(self) -> None:
+        spilled = await asyncio.to_thread(self._take_spilled)
+        for i in range(0, len(spilled), self._batch_size):
+            await self._write(spilled[i:i + self._batch_size])
+
+    async def _write(self, rows: List[list[str]]) -> None:
+        try:
+            await asyncio.to_thread(self._append_rows, rows)
+            SHEETS_ROWS.inc(len(rows), outcome="written")
+            logger.info("Google Sheets: добавлено строк=%d", len(rows))
         except Exception as e:
-            logger.error("Не удалось открыть таблицу Google Sheets: %s", sheet_name, exc_info=e)
-            raise
+            logger.error("Ошибка при записи строк в Google Sheets", exc_info=e)
+            await self._spill_async(rows)
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def start(self) -> None:
+        """
+        Запускает фоновый воркер и фоновую дозапись строк из spill-файла.
+        """
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._worker = asyncio.create_task(self._run())
+        self._replay = asyncio.create_task(self._replay_spilled())
+
+    async def stop(self) -> None:
+        """
+        Дописывает очередь и останавливает воркер.
+        """
+        if self._worker is None or self._queue is None:
+            return
+        timeout = self._flush_interval + 30
+        if self._replay is not None:
+            done, _ = await asyncio.wait([self._replay], timeout=timeout)
+            if not done:
+                logger.warning("Google Sheets: строки из spill-файла не успели записаться")
+                self._replay.cancel()
+                await asyncio.gather(self._replay, return_exceptions=True)
+            self._replay = None
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Google Sheets: очередь не успела записаться при остановке")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+        rest: List[list[str]] = []
+        while not self._queue.empty():
+            rest.append(self._queue.get_nowait())
+        if rest:
+            await self._spill_async(rest)
+        if self._spilling:
+            await asyncio.gather(*self._spilling, return_exceptions=True)
+        self._worker, self._queue = None, None
 
     def log_message(self, question: str, answer: str, source: str = "telegram"):
+        """
+        Ставит строку в очередь на запись; не блокирует и не бросает исключений
+        из-за Google API. answer — уже очищенный от разметки текст
+        (FormattedAnswer.log).
+        """
         date_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        row = [question, strip_all_tags(answer), "", "", date_str, source]
-        logger.info("Пробуем записать строку в Google Sheets: %s", row)
+        row = [question, answer, "", "", date_str, source]
+
+        if self._queue is None:
+            logger.warning("GoogleSheetsLogger не запущен, строка сохраняется на диск")
+            self._spill_in_background([row])
+            return
 
         try:
-            self.sheet.append_row(row, value_input_option="RAW")
-            logger.info("Строка успешно добавлена в Google Sheets")
-        except Exception as e:
-            logger.error("Ошибка при записи строки в Google Sheets", exc_info=e)
-            raise
\ No newline at end of file
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            logger.warning("Очередь Google Sheets переполнена")
+            self._spill_in_background([row])
+
+
+def get_sheets_logger() -> GoogleSheetsLogger:
+    global _sheets_logger
+    if _sheets_logger is None:
+        _sheets_logger = GoogleSheetsLogger()
+    return _sheets_logger
@@ -1,19 +1,35 @@
 import asyncio
 import csv
-
+import hashlib
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from sqlalchemy import select
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
 
 from db.session import async_session_maker
 from db.models.faq_entry import FAQEntry
+from apps.knowledge_base.services.answer_cache import get_faq_answer_cache
+from apps.knowledge_base.services.faq_index import publish_faq_updated
 from logger import get_logger, setup_logging
-from common.openai_client import ensure_openai_client, close_openai_client
+from common.openai_client import close_openai_client
+from common.embeddings import EMBEDDING_MODEL, embed_batch
 
 setup_logging()
 logger = get_logger(__name__)
 
 CSV_PATH = Path("src/common/faq.csv")
-EMBEDDING_MODEL = "text-embedding-3-small"
+BATCH_SIZE = 64
+MAX_CONCURRENCY = 4
+
+
+@dataclass
+class FAQRow:
+    question: str
+    answer: str
+    content_hash: str
+    embedding: list[float] | None = None
 
 
 def clean_text(text: str | None) -> str:
@@ -33,61 +49,119 @@ def build_embedding_input(question: str, answer: str) -> str:
     return f"Вопрос: {question}\nОтвет: {answer}"
 
 
-async def get_embedding(text: str) -> list[float]:
+def content_hash(question: str, answer: str) -> str:
     """
-    Возвращает эмбеддинг текста фиксированной длины 1536.
+    Хеш содержимого записи: меняется только при изменении вопроса, ответа или модели.
     """
-    client = await ensure_openai_client()
-    resp = await client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=text or "",
-    )
-    return resp.data[0].embedding
+    payload = f"{EMBEDDING_MODEL}\0{build_embedding_input(question, answer)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_csv(path: Path = CSV_PATH) -> dict[str, FAQRow]:
+    """
+    Читает CSV, пропускает неполные строки; при дублях вопроса побеждает последняя.
+    """
+    rows: dict[str, FAQRow] = {}
+    with path.open("r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            question = clean_text(row.get("question"))
+            answer = clean_text(row.get("answer"))
+            if not question or not answer:
+                logger.warning("Пропущена строка с неполными данными", extra={"row": row})
+                continue
+            rows[question] = FAQRow(question, answer, content_hash(question, answer))
+    return rows
+
+
+async def embed_rows(rows: list[FAQRow]) -> int:
+    """
+    Считает эмбеддинги пачками по BATCH_SIZE не более MAX_CONCURRENCY запросов параллельно.
+    Возвращает число потраченных токенов.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def run(batch: list[FAQRow]) -> int:
+        async with semaphore:
+            inputs = [build_embedding_input(r.question, r.answer) for r in batch]
+            vectors, tokens = await embed_batch(inputs, EMBEDDING_MODEL)
+        for row, vector in zip(batch, vectors):
+            row.embedding = vector
+        logger.info("Посчитаны эмбеддинги: %d строк", len(batch))
+        return tokens
+
+    batches = [rows[i:i + BATCH_SIZE] for i in range(0, len(rows), BATCH_SIZE)]
+    used = await asyncio.gather(*(run(b) for b in batches))
+    return sum(used)
 
 
 async def import_faq() -> None:
     """
-    Импорт и апсерт записей FAQ из CSV с генерацией эмбеддингов.
+    Инкрементальный импорт FAQ из CSV: эмбеддинги только для изменённых строк,
+    bulk upsert и удаление вопросов, которых больше нет в CSV.
     """
     logger.info("Начат импорт FAQ из CSV")
-    with CSV_PATH.open("r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-
-        async with async_session_maker() as session:
-            async with session.begin():
-                for row in reader:
-                    question = clean_text(row.get("question"))
-                    answer = clean_text(row.get("answer"))
-                    if not question or not answer:
-                        logger.warning("Пропущена строка с неполными данными", extra={"row": row})
-                        continue
-
-                    existing = (
-                        await session.execute(
-                            select(FAQEntry).where(FAQEntry.question == question)
-                        )
-                    ).scalar_one_or_none()
-
-                    emb_input = build_embedding_input(question, answer)
-                    embedding = await get_embedding(emb_input)
-
-                    if existing:
-                        existing.answer = answer
-                        existing.embedding = embedding
-                        action = "Обновляется"
-                    else:
-                        session.add(
-                            FAQEntry(
-                                question=question,
-                                answer=answer,
-                                embedding=embedding,
-                            )
-                        )
-                        action = "Добавлен новый"
-
-                    logger.info("%s вопрос: %s", action, question)
-
-    logger.info("Импорт FAQ завершён")
+    started = time.perf_counter()
+    rows = read_csv()
+
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(FAQEntry.id, FAQEntry.question, FAQEntry.content_hash)
+        )
+        existing = {question: (entry_id, stored) for entry_id, question, stored in result.all()}
+
+    changed = [
+        r for r in rows.values()
+        if existing.get(r.question, (None, None))[1] != r.content_hash
+    ]
+    removed = [q for q in existing if q not in rows]
+    tokens = await embed_rows(changed)
+
+    async with async_session_maker() as session:
+        async with session.begin():
+            if changed:
+                stmt = insert(FAQEntry).values(
+                    [
+                        {
+                            "question": r.question,
+                            "answer": r.answer,
+                            "embedding": r.embedding,
+                            "content_hash": r.content_hash,
+                        }
+                        for r in changed
+                    ]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[FAQEntry.question],
+                    set_={
+                        "answer": stmt.excluded.answer,
+                        "embedding": stmt.excluded.embedding,
+                        "content_hash": stmt.excluded.content_hash,
+                    },
+                )
+                await session.execute(stmt)
+
+            if removed:
+                await session.execute(delete(FAQEntry).where(FAQEntry.question.in_(removed)))
+
+    updated_ids = [existing[r.question][0] for r in changed if r.question in existing]
+    removed_ids = [existing[q][0] for q in removed]
+    await get_faq_answer_cache().invalidate_entries(updated_ids + removed_ids)
+    if changed or removed:
+        await publish_faq_updated()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Импорт FAQ завершён: строк=%d новых=%d обновлено=%d удалено=%d без изменений=%d "
+        "токенов=%d время=%.2fс скорость=%.1f строк/с",
+        len(rows),
+        len(changed) - len(updated_ids),
+        len(updated_ids),
+        len(removed_ids),
+        len(rows) - len(changed),
+        tokens,
+        elapsed,
+        len(rows) / elapsed if elapsed > 0 else 0.0,
+    )
 
 
 async def main() -> None:
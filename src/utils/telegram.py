@@ -1,10 +1,102 @@
 import asyncio
+import time
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message
 
+from common.metrics import timed
+from logger.config import get_logger
+from utils.answer_format import format_answer
+from utils.text import split_message
+
+logger = get_logger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Запас под закрывающие теги, которые format_answer добавит к части.
+_CHUNK_MARGIN = 96
+
 
 async def delete_message(message: Message, delay: float = 3.0):
     await asyncio.sleep(delay)
     try:
         await message.delete()
     except Exception:
-        pass
\ No newline at end of file
+        pass
+
+
+class MessageStreamer:
+    """
+    Прогрессивно обновляет одно сообщение Telegram через edit_text
+    не чаще, чем раз в min_interval секунд.
+
+    Промежуточные правки — по возможности: ошибки Telegram (сеть, лимиты,
+    слишком длинный текст) логируются и пропускаются, генерация ответа
+    из-за них не прерывается. update возвращает False, если правка
+    не удалась; для force=True это сигнал отправить ответ новым сообщением.
+    """
+
+    def __init__(self, message: Message, min_interval: float = 1.0) -> None:
+        self._message = message
+        self._min_interval = min_interval
+        self._last_text = ""
+        self._last_edit = 0.0
+        self.edits = 0
+
+    @property
+    def message(self) -> Message:
+        return self._message
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last_edit >= self._min_interval
+
+    async def _edit(self, text: str) -> None:
+        try:
+            with timed("telegram_send"):
+                await self._message.edit_text(text)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+
+    async def update(self, text: str, force: bool = False) -> bool:
+        text = text.strip()
+        if not text or text == self._last_text:
+            return True
+        if not force and not self.due():
+            return True
+        if len(text) > TELEGRAM_MESSAGE_LIMIT:
+            return False
+        try:
+            await self._edit(text)
+        except TelegramRetryAfter as e:
+            self._last_edit = time.monotonic() + e.retry_after
+            if not force:
+                return False
+            await asyncio.sleep(e.retry_after)
+            try:
+                await self._edit(text)
+            except TelegramAPIError as retry_error:
+                logger.warning("Telegram edit failed after retry: %s", retry_error)
+                return False
+        except TelegramAPIError as e:
+            logger.warning("Telegram edit failed (force=%s): %s", force, e)
+            self._last_edit = time.monotonic()
+            return False
+        self._last_text = text
+        self._last_edit = max(self._last_edit, time.monotonic())
+        self.edits += 1
+        return True
+
+
+async def send_html(message: Message, html: str) -> None:
+    """
+    Отправляет HTML-ответ; длиннее лимита Telegram — несколькими сообщениями.
+    Каждая часть заново проходит format_answer, чтобы теги, разрезанные
+    на границе, были закрыты.
+    """
+    if len(html) <= TELEGRAM_MESSAGE_LIMIT:
+        with timed("telegram_send"):
+            await message.answer(html)
+        return
+    for chunk in split_message(html, TELEGRAM_MESSAGE_LIMIT - _CHUNK_MARGIN):
+        with timed("telegram_send"):
+            await message.answer(format_answer(chunk).html)
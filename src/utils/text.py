@@ -1,21 +1,18 @@
 from __future__ import annotations
 
-import re
-from bs4 import BeautifulSoup
+import functools
+import importlib.util
+import math
 from typing import Any, Mapping
 
 
-ALLOWED_TAGS = {
-    "b", "strong", "i", "em", "u", "ins", "s", "del", "strike",
-    "code", "pre", "a", "tg-spoiler", "span", "blockquote", "tg-emoji",
-}
-ALLOWED_ATTRS = {
-    "a": {"href"},
-    "tg-emoji": {"emoji-id"},
-    "code": {"class"},
-    "pre": {"class"},
-    "span": {"class"},
-}
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
 
 
 def normalize(text: str) -> str:
@@ -28,6 +25,13 @@ def normalize(text: str) -> str:
     return x
 
 
+def transliterate(text: str) -> str:
+    """
+    Переводит кириллицу в латиницу (для нечёткого сравнения названий).
+    """
+    return text.lower().translate(_TRANSLIT)
+
+
 def strip_empty_fields(obj: Any) -> Any:
     """
     Удаляет пустые списки, словари, None и пустые строки.
@@ -41,45 +45,55 @@ def strip_empty_fields(obj: Any) -> Any:
     return obj
 
 
-def _cleanup_markdown(text: str) -> str:
-    """
-    Убирает markdown-подобные элементы (**жирный**, # заголовки).
-    """
-    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
-    text = re.sub(r"^#+\s*", "", text, flags=re.MULTILINE)
-    return text
+_SPLIT_SEPARATORS = ("\n\n", "\n", ". ", " ")
 
 
-def strip_all_tags(text: str) -> str:
+def split_message(text: str, limit: int) -> list[str]:
     """
-    Убирает все HTML-теги, оставляя только текстовое содержимое.
+    Делит длинный текст на части не длиннее limit, стараясь резать
+    по абзацам, строкам, предложениям и словам (в этом порядке).
     """
-    soup = BeautifulSoup(text, "html.parser")
-    return soup.get_text(" ", strip=True)
-
-
-def sanitize_telegram_html(text: str) -> str:
+    text = text.strip()
+    chunks: list[str] = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = -1
+        for sep in _SPLIT_SEPARATORS:
+            pos = window.rfind(sep)
+            if pos > limit // 2:
+                cut = pos + len(sep)
+                break
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+# Без tiktoken: для gpt-4o (o200k) кириллица и латиница дают в среднем
+# ~3-4 символа на токен; берём 3 с запасом.
+_CHARS_PER_TOKEN = 3.0
+
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding() -> Any:
+    if importlib.util.find_spec("tiktoken") is None:
+        return None
+    import tiktoken
+
+    return tiktoken.get_encoding("o200k_base")
+
+
+def estimate_tokens(text: str) -> int:
     """
-    Убирает markdown-артефакты и чистит HTML для Telegram.
+    Число токенов текста: точно через tiktoken (если установлен),
+    иначе оценка по длине.
     """
-    text = _cleanup_markdown(text)
-    soup = BeautifulSoup(text, "html.parser")
-
-    for tag in soup.find_all(True):
-        tag_name = tag.name.lower()
-        if tag_name not in ALLOWED_TAGS:
-            tag.unwrap()
-            continue
-
-        allowed_attrs = ALLOWED_ATTRS.get(tag_name, set())
-        tag.attrs = {k: v for k, v in tag.attrs.items() if k in allowed_attrs}
-
-        if tag_name == "span" and tag.attrs.get("class") != ["tg-spoiler"]:
-            tag.unwrap()
-
-        if tag_name == "a":
-            href = tag.attrs.get("href", "")
-            if not href.startswith(("http://", "https://", "tg://")):
-                tag.unwrap()
-
-    return str(soup)
\ No newline at end of file
+    if not text:
+        return 0
+    encoding = _token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)